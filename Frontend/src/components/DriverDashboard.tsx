@@ -86,6 +86,51 @@ export function DriverDashboard({ onLogout, onBackToProfile, onAcceptRide }: Dri
       .catch(console.error);
   }, []);
 
+  // Stay online while the dashboard is open: re-send the location every
+  // heartbeat_interval seconds, as advertised by /current_loc
+  useEffect(() => {
+    let timer: ReturnType<typeof setTimeout>;
+    let cancelled = false;
+
+    const sendHeartbeat = (intervalSec: number) => {
+      if (!navigator.geolocation) return;
+      const scheduleNext = (nextSec: number) => {
+        if (!cancelled) timer = setTimeout(() => sendHeartbeat(nextSec), nextSec * 1000);
+      };
+
+      navigator.geolocation.getCurrentPosition(
+        async (position) => {
+          let nextSec = intervalSec;
+          try {
+            const res = await fetch(`http://127.0.0.1:5000/driver/${driverId}/current_loc`, {
+              method: 'POST',
+              headers: {
+                'Content-Type': 'application/json',
+                Authorization: `Bearer ${authToken}`,
+              },
+              body: JSON.stringify({
+                latitude: position.coords.latitude,
+                longitude: position.coords.longitude,
+              }),
+            });
+            const data = await res.json();
+            if (data.heartbeat_interval) nextSec = data.heartbeat_interval;
+          } catch (err) {
+            console.error('Heartbeat failed:', err);
+          }
+          scheduleNext(nextSec);
+        },
+        () => scheduleNext(intervalSec)
+      );
+    };
+
+    sendHeartbeat(20);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, []);
+
   const handleAccept = async (request: RideRequest) => {
 
   try {
@@ -41,7 +41,8 @@ export function RideBookingPage({ onBack, onProceedToConfirmation, userToken, us
   const [fareEstimate, setFareEstimate] = useState({
     distance: 0,
     duration: 0,
-    estimatedFare: 0
+    estimatedFare: 0,
+    quoteId: ''
   });
   
   const mapRef = useRef<HTMLDivElement>(null);
@@ -256,7 +257,8 @@ export function RideBookingPage({ onBack, onProceedToConfirmation, userToken, us
         setFareEstimate({
           distance: data.distance_km,
           duration: data.duration_min,
-          estimatedFare: data.estimated_fare
+          estimatedFare: data.estimated_fare,
+          quoteId: data.quote_id
         });
 
         setMinFare((data.estimated_fare * 0.8).toFixed(2));
@@ -312,9 +314,7 @@ export function RideBookingPage({ onBack, onProceedToConfirmation, userToken, us
           drop_lon: dropLocation.lon,
           min_fare: parseFloat(minFare),
           max_fare: parseFloat(maxFare),
-          estimated_fare: fareEstimate.estimatedFare,
-          distance_km: fareEstimate.distance,
-          duration_min: fareEstimate.duration,
+          quote_id: fareEstimate.quoteId,
         }),
       });
 
@@ -1,6 +1,22 @@
+import os
+import time
+import logging
 import requests
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 from datetime import datetime
+from metrics import track
+from circuit_breaker import CircuitBreaker, CircuitOpenError, StaleCache
+
+log = logging.getLogger(__name__)
+
+WEATHER_TIMEOUT = float(os.getenv("WEATHER_TIMEOUT", "3"))
+# Readings are shared by every request within the same ~5 km area
+WEATHER_AREA_DEG = float(os.getenv("WEATHER_AREA_DEG", "0.05"))
+WEATHER_FRESH_SECONDS = float(os.getenv("WEATHER_FRESH_SECONDS", "300"))
+# How long the last good reading may stand in for WeatherAPI during an outage
+WEATHER_STALE_SECONDS = float(os.getenv("WEATHER_STALE_SECONDS", "3600"))
+# Oldest prefetched verdict check_weather_safety answers from without a live lookup
+WEATHER_VERDICT_MAX_AGE = float(os.getenv("WEATHER_VERDICT_MAX_AGE", "1800"))
 
 class WeatherService:
     """
@@ -11,6 +27,14 @@ class WeatherService:
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.base_url = "https://api.weatherapi.com/v1/current.json"
+        self.breaker = CircuitBreaker("weatherapi", slow_call_seconds=WEATHER_TIMEOUT / 2)
+        self.cache = StaleCache("weather", WEATHER_FRESH_SECONDS, WEATHER_STALE_SECONDS)
+        self.api_calls = 0
+
+        # Filled in by WeatherPrefetcher for the areas it covers
+        self.prefetch_areas = set()
+        self.verdicts = {}    # area key -> (is_safe, alert_message, weather_details, fetched_at)
+        self.demand = {}      # area key -> recent lookups, decayed by the prefetcher
 
         # Safety thresholds
         self.max_safe_wind_kph = 40      # Above 40 km/h → unsafe
@@ -28,31 +52,77 @@ class WeatherService:
             "Haze", "Fog", "Mist", "Smoke", "Dust"
         ]
 
-    def get_weather(self, lat: float, lon: float) -> Dict:
+    def area_key(self, lat: float, lon: float) -> Tuple[float, float]:
+        """Centre of the WEATHER_AREA_DEG cell containing the point"""
+        return (round(round(lat / WEATHER_AREA_DEG) * WEATHER_AREA_DEG, 4),
+                round(round(lon / WEATHER_AREA_DEG) * WEATHER_AREA_DEG, 4))
+
+    def get_weather(self, lat: float, lon: float) -> Tuple[Optional[Dict], bool]:
         """
-        Fetch current weather data for given coordinates.
+        Fetch current weather data for the area around the coordinates.
+        Returns (data, stale): during a WeatherAPI outage the last good
+        reading for the area is returned with stale=True, and (None, False)
+        when there is none.
         """
+        key = self.area_key(lat, lon)
         try:
-            params = {
-                "key": self.api_key,
-                "q": f"{lat},{lon}",
-                "aqi": "no"
-            }
-            response = requests.get(self.base_url, params=params, timeout=5)
+            return self.cache.get(key, lambda: self.breaker.call(self._fetch, *key))
+        except CircuitOpenError:
+            log.warning("Weather API circuit open, no reading for %s", key, extra={"sample_rate": 0.1})
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log.warning("Weather API error: %s", e)
+        return None, False
+
+    def refresh_area(self, key: Tuple[float, float]) -> None:
+        """Fetch one area now and store its verdict; raises on failure"""
+        data = self.breaker.call(self._fetch, *key)
+        self.cache.put(key, data)
+        is_safe, alert_message, weather_details = self.evaluate(data)
+        self.verdicts[key] = (is_safe, alert_message, weather_details, data["fetched_at"])
+
+    def _fetch(self, lat: float, lon: float) -> Dict:
+        self.api_calls += 1
+        params = {
+            "key": self.api_key,
+            "q": f"{lat},{lon}",
+            "aqi": "no"
+        }
+        with track("weatherapi", "current"):
+            response = requests.get(self.base_url, params=params, timeout=WEATHER_TIMEOUT)
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Weather API error: {e}")
-            return None
+        data = response.json()
+        data["fetched_at"] = time.time()
+        return data
 
     def check_weather_safety(self, lat: float, lon: float) -> Tuple[bool, str, Dict]:
         """
         Check if weather conditions are safe for a ride.
         Returns: is_safe (bool), alert_message (str), weather_details (dict)
+
+        Inside the prefetched service area this is a local lookup; elsewhere,
+        or when the area's verdict is too old, WeatherAPI is queried.
         """
-        weather_data = self.get_weather(lat, lon)
+        key = self.area_key(lat, lon)
+        if key in self.prefetch_areas:
+            self.demand[key] = self.demand.get(key, 0) + 1
+            verdict = self.verdicts.get(key)
+            if verdict is not None and time.time() - verdict[3] <= WEATHER_VERDICT_MAX_AGE:
+                is_safe, alert_message, weather_details, _ = verdict
+                return is_safe, alert_message, dict(weather_details)
+
+        weather_data, stale = self.get_weather(lat, lon)
+        return self.evaluate(weather_data, stale)
+
+    def evaluate(self, weather_data: Optional[Dict], stale: bool = False) -> Tuple[bool, str, Dict]:
+        """Turn a WeatherAPI reading into (is_safe, alert_message, weather_details)"""
         if not weather_data:
-            return True, "⚠️ Unable to fetch weather data. Please check conditions manually.", {}
+            # Rides stay allowed, but the verdict says it was not checked
+            return True, "⚠️ Unable to fetch weather data. Please check conditions manually.", {
+                "severity": "unknown",
+                "is_safe": True,
+                "weather_unavailable": True,
+                "timestamp": datetime.now().isoformat()
+            }
 
         current = weather_data["current"]
         main_weather = current["condition"]["text"]
@@ -120,6 +190,12 @@ class WeatherService:
 
         weather_details["severity"] = severity
         weather_details["is_safe"] = is_safe
+        weather_details["stale"] = stale
+        weather_details["as_of"] = datetime.fromtimestamp(
+            weather_data.get("fetched_at", time.time())
+        ).isoformat()
+        if stale:
+            alert_message += "\n\n⚠️ Live weather is unavailable; this is based on the last reading for your area."
 
         return is_safe, alert_message, weather_details
 
@@ -1,39 +1,84 @@
 import eventlet
 eventlet.monkey_patch()
 import os
-from flask import Flask, jsonify, request
-from sqlalchemy import text, create_engine
+from flask import Flask, jsonify, request, Response
+from sqlalchemy import text
 import jwt
 import datetime
 from functools import wraps
 from flask_socketio import SocketIO, emit, join_room, leave_room  # type: ignore
 from dotenv import load_dotenv
 from ml_recommender import DriverRecommender
+from training_jobs import TrainingJobQueue
 from models import db
 import redis
-from db import drivers_from_ride, get_non_active, book_ride_proc, login_user, signup_user, login_driver, signup_driver, assign_driver_to_ride, cancel_ride_by_driver, complete_ride_by_driver, update_user_location, update_driver_location, get_pending_rides, accept_ride_proc, reject_ride_proc, update_driver_and_ride_location, start_ride_db, add_feedback_db, get_user_profile, get_driver_profile, get_vehicle_by_driver_id, create_vehicle, update_vehicle, update_driver_discount, start_ride_transaction, complete_ride_transaction, get_available_drivers
+from db import drivers_from_ride, get_non_active, book_ride_proc, login_user, signup_user, login_driver, signup_driver, assign_driver_to_ride, cancel_ride_by_driver, complete_ride_by_driver, update_user_location, update_driver_location, get_pending_rides, accept_ride_proc, reject_ride_proc, update_driver_and_ride_location, start_ride_db, add_feedback_db, get_user_profile, get_driver_profile, get_vehicle_by_driver_id, create_vehicle, update_vehicle, update_driver_discount, start_ride_transaction, complete_ride_transaction, get_available_drivers, get_driver_stats, insert_weather_checks, run_weather_maintenance, get_weather_hourly, get_idle_drivers_by_ids, set_drivers_offline, get_ride_trace
 from werkzeug.exceptions import Unauthorized
 from sqlalchemy.exc import IntegrityError
-from route_service import RouteService
+from route_service import RouteService, RouteUnavailableError
+from road_graph import RouteNotFound, haversine_m
 from fare_calculator import FareCalculator
 from time import time
 from flask_cors import CORS
-from WeatherService import WeatherService
+from WeatherService import WeatherService, WEATHER_AREA_DEG
+from weather_prefetch import WeatherPrefetcher
+from weather_writer import WeatherWriter
+from weather_retention import WeatherMaintenance
+from quote_service import QuoteService
+from surge import SurgeEngine
+from presence import PresenceStore, PresenceSweeper
+from ping_rate import PingRatePolicy, IDLE, TO_PICKUP, ON_TRIP
+from motion_model import MotionTracker, InterpolationBroadcaster
+from trip_trace import TripTraceRecorder, decode_trace
 import pandas as pd
 import numpy as np
+import metrics
+import hmac
+import logging
+from profiler import SamplingProfiler
+from logging_setup import configure_logging
 
 
 load_dotenv()
+configure_logging()
+log = logging.getLogger(__name__)
 
 # ---------- factory ----------
 route_service = RouteService(api_key=os.getenv("ORS_API_KEY"))
-fare_calc = FareCalculator()
-driver_locations = {}   # store driver_id → (lat, lon)
+surge_engine = SurgeEngine()
+fare_calc = FareCalculator(surge_engine=surge_engine)
 weather_service = WeatherService(api_key=os.getenv("WEATHER_API_KEY"))
-engine = create_engine(os.environ["DATABASE_URL"], pool_pre_ping=True, pool_size=5)
+weather_prefetcher = WeatherPrefetcher(weather_service)
+weather_writer = WeatherWriter(insert_weather_checks)
+weather_maintenance = WeatherMaintenance(run_weather_maintenance)
 
 SECRET_KEY = os.getenv("SECRET_KEY", "cb2a1f2a23921e96d3570d83082763beffb231cbb9ed0084238972d134c26f01")
-r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+r = metrics.InstrumentedRedis(host='localhost', port=6379, db=0, decode_responses=True)
+TRAINING_SNAPSHOT_PATH = os.getenv("TRAINING_SNAPSHOT_PATH", os.path.join("models", "training_rides.npz"))
+# Fraction of per-ping location logs kept when LOG_LEVEL=DEBUG
+LOCATION_LOG_SAMPLE_RATE = float(os.getenv("LOCATION_LOG_SAMPLE_RATE", "0.01"))
+# Shared secret for /admin endpoints (X-Admin-Token header); unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+profiler = SamplingProfiler()
+# Largest batch accepted by /admin/fares/bulk; bigger jobs should call compute_many directly
+BULK_FARE_MAX_ROWS = int(os.getenv("BULK_FARE_MAX_ROWS", "1000000"))
+# Rank dispatch candidates by road distance from one RouteService.get_matrix call
+DISPATCH_ROUTE_MATRIX = os.getenv("DISPATCH_ROUTE_MATRIX", "false").lower() == "true"
+# Nearest drivers (straight line) sent to the matrix when that is enabled
+DISPATCH_MATRIX_CANDIDATES = int(os.getenv("DISPATCH_MATRIX_CANDIDATES", "50"))
+# Idle drivers fetched per dispatch: the nearest N within the radius (GiST KNN)
+DISPATCH_SEARCH_LIMIT = int(os.getenv("DISPATCH_SEARCH_LIMIT", "200"))
+DISPATCH_SEARCH_RADIUS_M = float(os.getenv("DISPATCH_SEARCH_RADIUS_M", "15000"))
+DISPATCH_PRESENCE_FALLBACKS = metrics.REGISTRY.counter(
+    "dispatch_presence_fallback_total", "Dispatch lookups that went to the database instead of presence",
+    ("reason",))
+quote_service = QuoteService(r, route_service, fare_calc, weather_service, secret=SECRET_KEY)
+presence = PresenceStore(r)
+presence_sweeper = PresenceSweeper(presence, set_drivers_offline)
+# Idle drivers may be slowed under load, but never past a third of the presence TTL
+ping_policy = PingRatePolicy(presence.heartbeat_interval, presence.ttl / 3)
+motion = MotionTracker()
+trip_traces = TripTraceRecorder(r)
 
 
 def create_access_token(user_id=None, driver_id=None, expires_in=3600):
@@ -94,38 +139,30 @@ def token_required(user_type=None):
     return decorator
 
 
+def admin_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify(msg="Not found"), 404
+        token = request.headers.get("X-Admin-Token", "")
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify(msg="Admin token required"), 401
+        return f(*args, **kwargs)
+    return decorated
+
+
 def save_weather_data(ride_id, weather_details, is_safe):
     """
-    Helper function to save weather data in the database.
-    Creates a new weather check record each time (historical tracking).
+    Record a weather check for the ride (historical tracking).
+    The record is queued and written in bulk by weather_writer, so this
+    never waits on the database; returns False if the queue was full.
 
     Args:
         ride_id: The ride ID to associate weather data with
         weather_details: Dictionary containing weather information
         is_safe: Boolean indicating if conditions are safe
     """
-    from models import Weather
-
-    try:
-        # Always create new record to maintain weather check history
-        weather_record = Weather(
-            ride_id=ride_id,
-            checked_at=db.func.current_timestamp(),
-            temperature=weather_details.get('temperature'),
-            wind_speed=weather_details.get('wind_speed_ms'),
-            visibility=weather_details.get('visibility_m'),
-            humidity=weather_details.get('humidity'),
-            weather_code=weather_details.get('weather_code'),
-            condition=weather_details.get('condition'),
-            is_safe=is_safe
-        )
-        db.session.add(weather_record)
-        db.session.commit()
-        return True
-    except Exception as e:
-        print(f"Error saving weather data: {e}")
-        db.session.rollback()
-        return False
+    return weather_writer.submit(ride_id, weather_details, is_safe)
 
 
 def create_app():
@@ -137,18 +174,122 @@ def create_app():
     db.init_app(app)
     socketio = SocketIO(app, cors_allowed_origins='*')
 
+    metrics.instrument_flask(app)
+    metrics.instrument_socketio(socketio)
+    profiler.instrument(app, socketio)
+    with app.app_context():
+        metrics.instrument_pool(db.engine, "flask_sqlalchemy")
+
     # Initialize ML Recommender
     recommender = DriverRecommender()
     try:
         recommender.load_model('models/driver_recommender.pkl')
-        print("✓ ML Model loaded")
+        log.info("ML model loaded")
     except:
-        print("⚠ No model found. Train using /train_model")
+        log.warning("No model found. Train using /train_model")
+    training_jobs = TrainingJobQueue(app, db, recommender)
+    surge_engine.start()
+    weather_prefetcher.start()
+    weather_writer.start()
+    weather_maintenance.start()
+    presence_sweeper.start()
+    motion_broadcaster = InterpolationBroadcaster(
+        motion, lambda ride_id, payload: socketio.emit('ride_location', payload, room=f"ride_{ride_id}")
+    )
+    motion_broadcaster.start()
+
+    def push_ping_interval(driver_id, state, ride_id=None):
+        """Send the driver the ping interval for their new ride state"""
+        interval = ping_policy.advertise(driver_id, state)
+        socketio.emit('ping_interval', {"interval": interval, "ride_id": ride_id},
+                      room=f'driver_{driver_id}')
 
     @app.get('/')
     def hello():
         return jsonify(msg='Flask ↔ Supabase ready!')
 
+    @app.get('/metrics')
+    @admin_required
+    def metrics_endpoint():
+        """
+        Prometheus scrape endpoint for this worker. Needs the X-Admin-Token
+        header like the other admin endpoints (http_headers in the scrape
+        config).
+        """
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.get('/admin/profiles')
+    @admin_required
+    def admin_profiles():
+        """
+        Sampled request profiles.
+        Without arguments: JSON summary per endpoint.
+        ?endpoint=POST /recommend_drivers&mode=wall|cpu: collapsed stacks for
+        flamegraph.pl / speedscope.
+        """
+        endpoint = request.args.get('endpoint')
+        if not endpoint:
+            return jsonify(profiler.summary())
+        mode = request.args.get('mode', 'wall')
+        if mode not in ('wall', 'cpu'):
+            return jsonify(msg="mode must be 'wall' or 'cpu'"), 400
+        return Response(profiler.collapsed(endpoint, mode), mimetype='text/plain')
+
+    @app.delete('/admin/profiles')
+    @admin_required
+    def reset_profiles():
+        profiler.reset()
+        return jsonify(ok=True)
+
+    @app.get('/admin/weather/hourly')
+    @admin_required
+    def weather_hourly():
+        """
+        Hourly per-cell weather rollups for analytics.
+        ?from=&to= ISO timestamps (default the last 24 hours), optional
+        min_lat/min_lon/max_lat/max_lon bounding box and limit.
+        """
+        try:
+            end = datetime.datetime.fromisoformat(request.args['to']) if 'to' in request.args \
+                else datetime.datetime.utcnow()
+            start = datetime.datetime.fromisoformat(request.args['from']) if 'from' in request.args \
+                else end - datetime.timedelta(hours=24)
+        except ValueError:
+            return jsonify(msg="from/to must be ISO timestamps"), 400
+        limit = min(request.args.get('limit', 5000, type=int), 50000)
+
+        rows = get_weather_hourly(
+            start, end,
+            min_lat=request.args.get('min_lat', type=float),
+            min_lon=request.args.get('min_lon', type=float),
+            max_lat=request.args.get('max_lat', type=float),
+            max_lon=request.args.get('max_lon', type=float),
+            limit=limit
+        )
+        for row in rows:
+            row['hour'] = row['hour'].isoformat()
+        return jsonify(ok=True, cell_deg=WEATHER_AREA_DEG, rows=rows)
+
+    @app.get('/admin/ride/<int:ride_id>/trace')
+    @admin_required
+    def ride_trace(ride_id):
+        """
+        Recorded location trace of a completed ride, for disputes and fare
+        audits. ?format=raw returns the stored blob (trip_trace format).
+        """
+        row = get_ride_trace(ride_id)
+        if not row:
+            return jsonify(ok=False, msg="No trace recorded for this ride"), 404
+        if request.args.get('format') == 'raw':
+            return Response(bytes(row['trace']), mimetype='application/octet-stream')
+
+        points = [
+            [lat, lon, datetime.datetime.fromtimestamp(t, datetime.timezone.utc).isoformat()]
+            for lat, lon, t in decode_trace(row['trace'])
+        ]
+        return jsonify(ok=True, ride_id=ride_id, points=points,
+                       started_at=row['started_at'].isoformat(), ended_at=row['ended_at'].isoformat())
+
     @app.post("/login")
     def login():
         data = request.get_json(force=True)
@@ -161,14 +302,11 @@ def create_app():
         if not ok:
             raise Unauthorized(msg)
         token = create_access_token(user_id=user["user_id"])
-        print(user)
+        log.debug("User logged in", extra={"user_id": user["user_id"]})
         return jsonify(user=user, token=token, msg=msg, ok=ok)
 
     @app.post("/signup")
     def signup():
-        print("Content-Type :", request.content_type)
-        print("Raw body     :", request.get_data(as_text=True))
-
         data = request.get_json()
         if data is None:
             return jsonify(msg="Body must be valid JSON"), 400
@@ -229,7 +367,8 @@ def create_app():
         if not ok:
             return jsonify(msg=msg), 401
         token = create_access_token(driver_id=driver["driver_id"])
-        return jsonify(driver=driver, token=token, msg=msg, ok=ok)
+        return jsonify(driver=driver, token=token, msg=msg, ok=ok,
+                       heartbeat_interval=ping_policy.interval(IDLE))
 
     @app.post("/driver/logout")
     @token_required(user_type="driver")
@@ -239,6 +378,9 @@ def create_app():
             return jsonify(msg="Token missing"), 401
         token = auth_header.split(" ")[1]
         r.delete(token)
+        presence.remove(request.driver_id)
+        ping_policy.forget(request.driver_id)
+        set_drivers_offline([request.driver_id], presence.ttl)
         return jsonify(msg="Logged out successfully"), 200
 
     @app.post("/user/<int:user_id>/current_loc")
@@ -283,6 +425,7 @@ def create_app():
                 'status': 'in_progress',
                 'driver_id': driver_id
             }, room=f'ride_{ride_id}')
+            push_ping_interval(driver_id, ON_TRIP, ride_id)
 
         if not success:
             return jsonify({
@@ -313,7 +456,12 @@ def create_app():
         lon = float(data.get("longitude"))
 
         ok, msg = update_driver_location(driver_id, lat, lon)
-        return jsonify({"ok": ok, "msg": msg}), (200 if ok else 404)
+        if ok:
+            surge_engine.driver_seen(driver_id, lat, lon)
+            presence.heartbeat(driver_id, lat, lon)
+            ping_policy.count()
+        # Drivers re-send their location this often to stay online
+        return jsonify({"ok": ok, "msg": msg, "heartbeat_interval": ping_policy.interval(IDLE)}), (200 if ok else 404)
 
     @app.post("/driver/<int:driver_id>/get_requests")
     def driver_get_requests(driver_id):
@@ -349,7 +497,7 @@ def create_app():
             ride.pickup_latitude,
             ride.pickup_longitude
         )
-        print(weather_details)
+        log.debug("Pickup weather: %s", weather_details, extra={"ride_id": ride_id})
         save_weather_data(ride_id, weather_details, is_safe)
 
         if not is_safe:
@@ -370,13 +518,16 @@ def create_app():
 
         from models import Driver
         if ok:
+            surge_engine.driver_busy(driver_id)
+            presence.mark_busy(driver_id)
+            push_ping_interval(driver_id, TO_PICKUP, ride_id)
             driver = Driver.query.get(driver_id)
             socketio.emit('driver_accepted', {
                 'ride_id': ride_id,
                 'driver_id': driver_id,
                 'driver_name': driver.name if driver else 'Driver'
             }, room=f'ride_{ride_id}')
-            print(f'Driver {driver_id} accepted ride {ride_id}')
+            log.info("Driver accepted ride", extra={"driver_id": driver_id, "ride_id": ride_id})
 
         status_code = 200 if ok else 400
         recommender.update_driver_acceptance_probability(db, driver_id)
@@ -395,15 +546,13 @@ def create_app():
             return jsonify(msg="ride_id is required", ok=False), 400
 
         ok, msg = reject_ride_proc(driver_id, ride_id)
-        print(msg)
-
         if ok:
             socketio.emit('driver_rejected', {
                 'ride_id': ride_id,
                 'driver_id': driver_id,
                 'msg': msg
             }, room=f'ride_{ride_id}')
-            print(f'Driver {driver_id} rejected ride {ride_id}')
+            log.info("Driver rejected ride", extra={"driver_id": driver_id, "ride_id": ride_id})
 
         status_code = 200 if ok else 400
         recommender.update_driver_acceptance_probability(db, driver_id)
@@ -442,13 +591,21 @@ def create_app():
                 "msg": f"Invalid payment method. Must be one of: {', '.join(valid_methods)}"
             }), 400
 
+        trace = trip_traces.get(ride_id)
         success, message, payment_id, fare = complete_ride_transaction(
             driver_id,
             ride_id,
-            payment_method
+            payment_method,
+            trace=trace.to_row(ride_id) if trace else None
         )
 
         if success:
+            presence.mark_idle(driver_id)
+            push_ping_interval(driver_id, IDLE, ride_id)
+            motion.forget(ride_id)
+            if trace is None:
+                trip_traces.missing(ride_id)
+            trip_traces.forget(ride_id)
             socketio.emit('complete_ride_socket', {
                 'ride_id': ride_id,
                 'status': 'completed',
@@ -476,6 +633,11 @@ def create_app():
     @token_required(user_type="driver")
     def cancel_ride(driver_id, ride_id):
         ok, msg = cancel_ride_by_driver(driver_id, ride_id)
+        if ok:
+            presence.mark_idle(driver_id)
+            push_ping_interval(driver_id, IDLE, ride_id)
+            motion.forget(ride_id)
+            trip_traces.forget(ride_id)
         return jsonify({"ok": ok, "msg": msg}), (200 if ok else 404)
 
     @app.post("/estimate_fare")
@@ -487,29 +649,30 @@ def create_app():
         pickup_lon = float(data["pickup_lon"])
         drop_lat = float(data["drop_lat"])
         drop_lon = float(data["drop_lon"])
-        print(pickup_lat, pickup_lon, drop_lat, drop_lon)
-
-        is_safe, alert_msg, weather_details = weather_service.check_weather_safety(
-            pickup_lat,
-            pickup_lon
-        )
-
-        distance_km, duration_min, _ = route_service.get_route(
-            (pickup_lon, pickup_lat),
-            (drop_lon, drop_lat)
-        )
-        print('Weather details:', weather_details)
 
-        estimated_fare = fare_calc.compute(distance_km, duration_min)
-        print(estimated_fare)
+        try:
+            quote = quote_service.quote(request.user_id, pickup_lat, pickup_lon, drop_lat, drop_lon)
+        except RouteNotFound as e:
+            return jsonify(ok=False, msg=str(e)), 422
+        except RouteUnavailableError as e:
+            return jsonify(ok=False, msg=str(e)), 503
+        log.debug("Fare estimate %.2f for %.2f km / %.1f min, weather: %s",
+                  quote["estimated_fare"], quote["distance_km"], quote["duration_min"],
+                  quote["weather_details"])
 
         return jsonify({
-            "distance_km": round(distance_km, 2),
-            "duration_min": round(duration_min, 1),
-            "estimated_fare": round(estimated_fare, 2),
-            "weather_safe": is_safe,
-            "weather_alert": alert_msg,
-            "weather_details": weather_details
+            "quote_id": quote["quote_id"],
+            "quote_expires_at": quote["expires_at"],
+            "distance_km": round(quote["distance_km"], 2),
+            "duration_min": round(quote["duration_min"], 1),
+            "estimated_fare": round(quote["estimated_fare"], 2),
+            "surge_multiplier": quote["surge_multiplier"],
+            "route_stale": quote.get("route_stale", False),
+            # Google encoded polyline, (lat, lon) at 1e-5 precision
+            "route_polyline": quote.get("route_polyline"),
+            "weather_safe": quote["weather_safe"],
+            "weather_alert": quote["weather_alert"],
+            "weather_details": quote["weather_details"]
         })
 
     @app.post("/request_driver")
@@ -553,36 +716,44 @@ def create_app():
     @app.post("/create_ride_request")
     @token_required(user_type="user")
     def create_ride_request():
+        """
+        Create a pending ride from a quote_id issued by /estimate_fare. The
+        fare, route and weather verdict come from the stored quote, never
+        from the request body; the quote is claimed here and handed back
+        if the ride is not created.
+        """
         data = request.get_json()
 
         pickup_name = data["pickup_name"]
         drop_name = data["drop_name"]
-        pickup_lat = float(data["pickup_lat"])
-        pickup_lon = float(data["pickup_lon"])
-        drop_lat = float(data["drop_lat"])
-        drop_lon = float(data["drop_lon"])
-        user_id = int(data["user_id"])
         min_fare = float(data["min_fare"])
         max_fare = float(data["max_fare"])
-        estimated_fare = float(data["estimated_fare"])
-        distance_km = float(data.get("distance_km", 0))
-        duration_min = float(data.get("duration_min", 0))
         ride_date = db.func.current_date()
-
-        is_safe, alert_msg, weather_details = weather_service.check_weather_safety(
-            pickup_lat,
-            pickup_lon
-        )
-
-        if not is_safe:
+        quote_id = data.get("quote_id")
+
+        if not quote_id:
+            return jsonify({"ok": False, "msg": "quote_id is required, please estimate the fare first"}), 400
+        quote, error = quote_service.redeem(quote_id, request.user_id)
+        if quote is None:
+            return jsonify({"ok": False, "msg": error}), 400
+        user_id = quote["user_id"]
+        pickup_lat, pickup_lon = quote["pickup_lat"], quote["pickup_lon"]
+        drop_lat, drop_lon = quote["drop_lat"], quote["drop_lon"]
+        estimated_fare = quote["estimated_fare"]
+        distance_km = quote["distance_km"]
+        duration_min = quote["duration_min"]
+
+        if not quote["weather_safe"]:
+            quote_service.restore(quote)
             return jsonify({
                 "ok": False,
                 "msg": "Ride request blocked due to severe weather conditions",
-                "weather_alert": alert_msg,
-                "weather_details": weather_details
+                "weather_alert": quote["weather_alert"],
+                "weather_details": quote["weather_details"]
             }), 400
 
         if not (min_fare <= estimated_fare <= max_fare):
+            quote_service.restore(quote)
             return jsonify({
                 "ok": False,
                 "msg": f"Estimated fare Rs {estimated_fare:.2f} is outside your selected range ({min_fare}–{max_fare})."
@@ -608,8 +779,14 @@ def create_app():
             last_route_update=db.func.now()
         )
 
-        db.session.add(new_ride)
-        db.session.commit()
+        try:
+            db.session.add(new_ride)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            quote_service.restore(quote)
+            raise
+        surge_engine.record_request(pickup_lat, pickup_lon)
 
         response = {
             "ok": True,
@@ -620,12 +797,60 @@ def create_app():
             "msg": f"Ride request created successfully at Rs {estimated_fare:.2f}"
         }
 
+        weather_details = quote["weather_details"]
         if weather_details.get('severity') in ['moderate', 'mild']:
-            response["weather_warning"] = alert_msg
+            response["weather_warning"] = quote["weather_alert"]
             response["weather_details"] = weather_details
 
         return jsonify(response), 201
 
+    @app.post("/admin/fares/bulk")
+    @admin_required
+    def bulk_fares():
+        """
+        Recompute fares for a batch of trips with FareCalculator.compute_many.
+        Request Body:
+        {
+            "distance_km": [12.4, 3.1, ...],
+            "duration_min": [25.0, 9.5, ...],
+            "surge": [1.0, 1.5, ...]     (optional, scalar or per row)
+            "discount": [0, 10, ...]     (optional, percent, scalar or per row)
+        }
+        """
+        data = request.get_json(silent=True) or {}
+        if "distance_km" not in data or "duration_min" not in data:
+            return jsonify(ok=False, msg="distance_km and duration_min are required"), 400
+
+        try:
+            distance_km = np.asarray(data["distance_km"], dtype=np.float64)
+            duration_min = np.asarray(data["duration_min"], dtype=np.float64)
+            rows = distance_km.size
+            if rows > BULK_FARE_MAX_ROWS:
+                return jsonify(ok=False, msg=f"At most {BULK_FARE_MAX_ROWS} trips per request"), 413
+            for name in ("duration_min", "surge", "discount"):
+                value = np.asarray(data.get(name, 0), dtype=np.float64)
+                if value.ndim and value.size != rows:
+                    return jsonify(ok=False, msg=f"{name} must be a scalar or have {rows} values"), 400
+            fares = fare_calc.compute_many(distance_km, duration_min,
+                                           surge=data.get("surge"), discount=data.get("discount"))
+        except (TypeError, ValueError) as e:
+            return jsonify(ok=False, msg=f"Invalid input: {e}"), 400
+
+        # A scalar trip still gets a list back
+        return jsonify(ok=True, count=rows, fares=np.atleast_1d(fares).tolist())
+
+    @app.get("/surge")
+    def surge_map():
+        """
+        Current surge multipliers.
+        ?lat=&lon= returns the multiplier for that point, otherwise every
+        surging cell (south-west corner) is listed.
+        """
+        lat, lon = request.args.get("lat", type=float), request.args.get("lon", type=float)
+        if lat is not None and lon is not None:
+            return jsonify(ok=True, multiplier=surge_engine.multiplier(lat, lon))
+        return jsonify(ok=True, cell_deg=surge_engine.cell_deg, cells=surge_engine.snapshot())
+
     @app.post("/check_weather")
     def check_weather():
         """
@@ -650,13 +875,13 @@ def create_app():
     @socketio.on('connect')
     def handle_connect():
         """Handle client connection"""
-        print(f'Client connected: {request.sid}')
+        log.debug("Client connected", extra={"sid": request.sid})
         emit('connected', {'msg': 'Connected to server'})
 
     @socketio.on('disconnect')
     def handle_disconnect():
         """Handle client disconnection"""
-        print(f'Client disconnected: {request.sid}')
+        log.debug("Client disconnected", extra={"sid": request.sid})
 
     @socketio.on('join_ride')
     def join_ride(data):
@@ -668,7 +893,7 @@ def create_app():
         if ride_id:
             join_room(f"ride_{ride_id}")
             emit("joined_room", {"msg": f"Joined ride {ride_id}"})
-            print(f"Passenger joined ride_{ride_id}")
+            log.debug("Passenger joined ride room", extra={"ride_id": ride_id})
 
     @socketio.on('join_driver_room')
     def handle_join_driver_room(data):
@@ -680,7 +905,7 @@ def create_app():
         if driver_id:
             join_room(f'driver_{driver_id}')
             emit('joined_driver_room', {'msg': f'Joined driver room {driver_id}'})
-            print(f'Driver {driver_id} joined their room')
+            log.debug("Driver joined their room", extra={"driver_id": driver_id})
 
     @socketio.on('leave_ride')
     def leave_ride(data):
@@ -692,7 +917,7 @@ def create_app():
         if ride_id:
             leave_room(f"ride_{ride_id}")
             emit("left_room", {"msg": f"Left ride {ride_id}"})
-            print(f"Left ride_{ride_id}")
+            log.debug("Left ride room", extra={"ride_id": ride_id})
 
     @socketio.on('ride_request_sent')
     def handle_ride_request_sent(data):
@@ -727,7 +952,7 @@ def create_app():
                     'timestamp': str(datetime.datetime.now())
                 }, room=f'driver_{driver_id}')
 
-                print(f'Ride request {ride_id} notification sent to driver {driver_id}')
+                log.info("Ride request sent to driver", extra={"ride_id": ride_id, "driver_id": driver_id})
 
     @socketio.on('driver_accept_ride_socket')
     def handle_driver_accept_socket(data):
@@ -738,10 +963,9 @@ def create_app():
         """
         ride_id = data.get('ride_id')
         driver_id = data.get('driver_id')
-        driver_name = data.get('driver_name')
 
         if ride_id and driver_id:
-            print(f'Socket confirmation: Driver {driver_id} accepted ride {ride_id}')
+            log.debug("Socket confirmation: driver accepted ride", extra={"driver_id": driver_id, "ride_id": ride_id})
 
     @socketio.on('driver_reject_ride_socket')
     def handle_driver_reject_socket(data):
@@ -754,7 +978,7 @@ def create_app():
         driver_id = data.get('driver_id')
 
         if ride_id and driver_id:
-            print(f'Socket confirmation: Driver {driver_id} rejected ride {ride_id}')
+            log.debug("Socket confirmation: driver rejected ride", extra={"driver_id": driver_id, "ride_id": ride_id})
 
     @socketio.on('start_ride_socket')
     def handle_start_ride_socket(data):
@@ -767,7 +991,7 @@ def create_app():
         driver_id = data.get('driver_id')
 
         if ride_id and driver_id:
-            print(f'Socket confirmation: Ride {ride_id} started by driver {driver_id}')
+            log.debug("Socket confirmation: ride started", extra={"driver_id": driver_id, "ride_id": ride_id})
 
     @socketio.on('driver_location_update')
     def handle_driver_location(data):
@@ -792,18 +1016,36 @@ def create_app():
             return
 
         ok = update_driver_and_ride_location(driver_id, ride_id, lat, lon)
+        log.debug("Location ping", extra={"driver_id": driver_id, "ride_id": ride_id, "ok": ok,
+                                          "sample_rate": LOCATION_LOG_SAMPLE_RATE})
 
         if ok:
+            presence.heartbeat(driver_id, lat, lon, busy=True)
+            trip_traces.append(ride_id, lat, lon)
             emit('location_update_response', {"ok": True, "msg": "Location updated"})
 
+            # Passengers get the filtered position; predictions fill the gaps until the next ping
+            smooth_lat, smooth_lon = motion.update(ride_id, lat, lon)
             socketio.emit('ride_location', {
-                "lat": lat,
-                "lon": lon,
-                "timestamp": datetime.datetime.now().isoformat()
+                "lat": smooth_lat,
+                "lon": smooth_lon,
+                "timestamp": datetime.datetime.now().isoformat(),
+                "predicted": False
             }, room=f"ride_{ride_id}")
 
             from models import Ride
             ride = Ride.query.get(ride_id)
+
+            # Tell the driver to speed up or slow down their pings
+            if ride:
+                if ride.status == 'in_progress':
+                    state, target = ON_TRIP, (ride.drop_latitude, ride.drop_longitude)
+                else:
+                    state, target = TO_PICKUP, (ride.pickup_latitude, ride.pickup_longitude)
+                interval = ping_policy.observe(driver_id, lat, lon, state,
+                                               target=target if None not in target else None)
+                if interval is not None:
+                    emit('ping_interval', {"interval": interval, "ride_id": ride_id})
             if ride and ride.drop_latitude and ride.drop_longitude:
                 try:
                     from math import radians, sin, cos, sqrt, atan2
@@ -831,7 +1073,7 @@ def create_app():
                     }, room=f"ride_{ride_id}")
 
                 except Exception as e:
-                    print(f"Error calculating ETA: {e}")
+                    log.warning("Error calculating ETA: %s", e, extra={"ride_id": ride_id})
         else:
             emit('location_update_response', {"ok": False, "msg": "Update failed"})
 
@@ -846,7 +1088,7 @@ def create_app():
         driver_id = data.get('driver_id')
 
         if ride_id and driver_id:
-            print(f'Socket confirmation: Ride {ride_id} completed by driver {driver_id}')
+            log.debug("Socket confirmation: ride completed", extra={"driver_id": driver_id, "ride_id": ride_id})
 
     @socketio.on('request_current_location')
     def handle_request_current_location(data):
@@ -858,6 +1100,16 @@ def create_app():
         ride_id = data.get('ride_id')
 
         if ride_id:
+            predicted = motion.predict(ride_id)
+            if predicted:
+                emit('ride_location', {
+                    "lat": predicted[0],
+                    "lon": predicted[1],
+                    "timestamp": datetime.datetime.now().isoformat(),
+                    "predicted": True
+                })
+                return
+
             from models import Ride
             ride = Ride.query.get(ride_id)
 
@@ -877,7 +1129,7 @@ def create_app():
         """
         emit('pong', {'msg': 'Connection active'})
 
-    from models import Driver, Ride
+    from models import Driver, DriverStats
 
     @app.route("/driver/<int:driver_id>/stats", methods=["GET"])
     @token_required(user_type="driver")
@@ -886,7 +1138,9 @@ def create_app():
         if not driver:
             return jsonify({"ok": False, "msg": "Driver not found"}), 404
 
-        total_rides = Ride.query.filter_by(driver_id=driver_id, status='completed').count()
+        # Trigger-maintained counters instead of a COUNT(*) over ride
+        stats = db.session.get(DriverStats, driver_id)
+        total_rides = stats.completed_rides if stats else 0
         avg_rating = round(driver.rating_avg, 2) if driver.rating_avg else None
 
         return jsonify({
@@ -1018,25 +1272,33 @@ def create_app():
     @app.post("/train_model")
     def train_model_endpoint():
         """
-        Train the ML model from historical ride data.
-        Call this endpoint once to train the model.
+        Queue a background training run from historical ride data.
+        The new model replaces the serving one only after it validates;
+        poll /train_model/<job_id> for progress.
+
+        Optional JSON body:
+        {
+            "incremental": true,    (fold in only rides since the last run)
+            "snapshot": true,       (write the ride extract to TRAINING_SNAPSHOT_PATH)
+            "from_snapshot": true   (reuse the saved extract instead of the database)
+        }
 
         Example: POST http://localhost:5000/train_model
         """
-        try:
-            result = recommender.train_from_database(db)
+        data = request.get_json(silent=True) or {}
+        snapshot = bool(data.get('snapshot')) or bool(data.get('from_snapshot'))
 
-            if result['success']:
-                return jsonify({
-                    'ok': True,
-                    'msg': 'Model trained successfully',
-                    'details': result
-                }), 200
-            else:
-                return jsonify({
-                    'ok': False,
-                    'msg': result['message']
-                }), 400
+        try:
+            job = training_jobs.submit(
+                snapshot_path=TRAINING_SNAPSHOT_PATH if snapshot else None,
+                use_snapshot=bool(data.get('from_snapshot')),
+                incremental=bool(data.get('incremental'))
+            )
+            return jsonify({
+                'ok': True,
+                'msg': 'Training job queued',
+                'job': training_jobs.public(job)
+            }), 202
 
         except Exception as e:
             return jsonify({
@@ -1044,6 +1306,18 @@ def create_app():
                 'msg': f'Training failed: {str(e)}'
             }), 500
 
+    @app.get("/train_model/<int:job_id>")
+    def train_model_status_endpoint(job_id):
+        """
+        Status of a training job: queued, running, completed, rejected or failed.
+
+        Example: GET http://localhost:5000/train_model/1
+        """
+        job = training_jobs.get(job_id)
+        if not job:
+            return jsonify({'ok': False, 'msg': 'Training job not found'}), 404
+        return jsonify({'ok': True, 'job': training_jobs.public(job)}), 200
+
     @app.post("/recommend_drivers")
     @token_required(user_type="user")
     def recommend_drivers_endpoint():
@@ -1070,7 +1344,7 @@ def create_app():
             """
             Fallback to simple distance-based recommendation if ML fails.
             """
-            print("\n⚠ Using fallback distance-based recommendation")
+            log.info("Using fallback distance-based recommendation")
 
             try:
                 from math import radians, sin, cos, sqrt, atan2
@@ -1106,7 +1380,7 @@ def create_app():
                         'vehicle_number': driver.get('vehicle_number', 'N/A')
                     })
 
-                print(f"✓ Fallback returned {len(recommendations)} drivers")
+                log.debug("Fallback returned %d drivers", len(recommendations))
 
                 return jsonify({
                     'ok': True,
@@ -1117,13 +1391,77 @@ def create_app():
                 }), 200
 
             except Exception as e:
-                print(f"❌ Fallback recommendation failed: {str(e)}")
+                log.exception("Fallback recommendation failed")
                 return jsonify({
                     'ok': False,
                     'msg': f'All recommendation methods failed: {str(e)}',
                     'recommended_drivers': []
                 }), 500
 
+        def _idle_drivers_near(pickup_lat, pickup_lon):
+            """
+            Nearest idle drivers from the shared Redis presence sets, with
+            their live positions; the database only supplies the rest of
+            each row. Falls back to the PostGIS query if Redis is down or
+            presence has no idle driver nearby (e.g. presence was flushed).
+            """
+            try:
+                nearby = presence.nearest(pickup_lat, pickup_lon,
+                                          DISPATCH_SEARCH_RADIUS_M, DISPATCH_SEARCH_LIMIT)
+            except redis.exceptions.RedisError as e:
+                DISPATCH_PRESENCE_FALLBACKS.inc("error")
+                log.warning("Presence lookup failed, querying the database: %s", e)
+                return _idle_drivers_from_db(pickup_lat, pickup_lon)
+
+            drivers = []
+            if nearby:
+                rows = get_idle_drivers_by_ids([driver_id for driver_id, _, _, _ in nearby])
+                for driver_id, _, lat, lon in nearby:
+                    row = rows.get(driver_id)
+                    if row is not None:
+                        row['Latitude'], row['Longitude'] = lat, lon
+                        drivers.append(row)
+            if not drivers:
+                DISPATCH_PRESENCE_FALLBACKS.inc("empty")
+                log.warning("No idle drivers in presence near pickup, querying the database",
+                            extra={"sample_rate": 0.1})
+                return _idle_drivers_from_db(pickup_lat, pickup_lon)
+            return drivers
+
+        def _idle_drivers_from_db(pickup_lat, pickup_lon):
+            return get_available_drivers(
+                pickup=(pickup_lat, pickup_lon),
+                limit=DISPATCH_SEARCH_LIMIT,
+                radius_m=DISPATCH_SEARCH_RADIUS_M
+            )
+
+        def _road_distances_to_pickup(pickup_lat, pickup_lon, drivers_df):
+            """
+            Keep the DISPATCH_MATRIX_CANDIDATES nearest drivers by straight line
+            and fetch their drive distance and time to the pickup in one matrix
+            call. Returns (drivers_df, distances_km); distances_km is None if
+            routing fails, so the recommender falls back to straight lines.
+            """
+            straight = haversine_m(
+                pickup_lat, pickup_lon,
+                drivers_df['Latitude'].to_numpy(dtype=np.float64),
+                drivers_df['Longitude'].to_numpy(dtype=np.float64)
+            )
+            nearest = np.argsort(straight)[:DISPATCH_MATRIX_CANDIDATES]
+            drivers_df = drivers_df.iloc[nearest].reset_index(drop=True)
+
+            try:
+                distance_km, duration_min = route_service.get_matrix(
+                    list(zip(drivers_df['Longitude'], drivers_df['Latitude'])),
+                    [(pickup_lon, pickup_lat)]
+                )
+            except Exception as e:
+                log.warning("Route matrix failed, using straight-line distances: %s", e)
+                return drivers_df, None
+
+            drivers_df['pickup_eta_min'] = duration_min[:, 0].round(1)
+            return drivers_df, distance_km[:, 0]
+
         try:
             data = request.get_json()
 
@@ -1137,13 +1475,9 @@ def create_app():
             pickup_lon = float(data['pickup_lon'])
             top_n = int(data.get('top_n', 5))
 
-            print(f"\n{'='*60}")
-            print(f"DRIVER RECOMMENDATION REQUEST")
-            print(f"{'='*60}")
-            print(f"Pickup Location: ({pickup_lat}, {pickup_lon})")
-            print(f"Requesting top {top_n} drivers")
+            log.debug("Driver recommendation request at (%s, %s), top %d", pickup_lat, pickup_lon, top_n)
 
-            drivers_list = get_available_drivers()
+            drivers_list = _idle_drivers_near(pickup_lat, pickup_lon)
 
             if not drivers_list:
                 return jsonify({
@@ -1153,53 +1487,54 @@ def create_app():
                     'ml_enabled': False
                 }), 200
 
-            print(f"✓ Found {len(drivers_list)} available drivers")
+            log.debug("Found %d available drivers", len(drivers_list))
 
             drivers_df = pd.DataFrame(drivers_list)
 
             if recommender.model is None:
-                print("⚠ Model not found — Training now...")
-                try:
-                    result = recommender.train_from_database(db)
-                    if not result['success']:
-                        print(f"❌ Training failed: {result['message']}")
-                        return _fallback_distance_recommendation(
-                            pickup_lat, pickup_lon, drivers_df, top_n
-                        )
-                    print("✓ Model trained successfully")
-                except Exception as train_err:
-                    print(f"❌ Training error: {str(train_err)}")
-                    return _fallback_distance_recommendation(
-                        pickup_lat, pickup_lon, drivers_df, top_n
-                    )
+                # Never fit in the request; train in the background and serve
+                # distance-based results until the model is swapped in
+                log.warning("Model not found — queued background training")
+                training_jobs.submit()
+                return _fallback_distance_recommendation(
+                    pickup_lat, pickup_lon, drivers_df, top_n
+                )
+
+            pickup_distances_km = None
+            if DISPATCH_ROUTE_MATRIX:
+                drivers_df, pickup_distances_km = _road_distances_to_pickup(
+                    pickup_lat, pickup_lon, drivers_df
+                )
 
             try:
                 recommended = recommender.recommend_drivers(
                     pickup_lat,
                     pickup_lon,
                     drivers_df,
-                    db
+                    live_stats=get_driver_stats(drivers_df['driver_id']),
+                    pickup_distances_km=pickup_distances_km
                 )
 
                 if not recommended:
-                    print("⚠ ML recommender returned no results, using fallback")
+                    log.warning("ML recommender returned no results, using fallback")
                     return _fallback_distance_recommendation(
                         pickup_lat, pickup_lon, drivers_df, top_n
                     )
 
                 top_recommendations = recommended[:top_n]
-
-                print(f"\n{'='*60}")
-                print(f"ML RECOMMENDATIONS (Top {len(top_recommendations)})")
-                print(f"{'='*60}")
-                for i, driver in enumerate(top_recommendations, 1):
-                    print(f"{i}. {driver['name']} (ID: {driver['driver_id']})")
-                    print(f"   Score: {driver['recommendation_score']:.3f}")
-                    print(f"   Distance: {driver['distance_to_pickup']:.2f} km")
-                    print(f"   Acceptance Prob: {driver['ml_acceptance_probability']:.3f}")
-                    print(f"   Rating: {driver['rating_avg']:.1f}/5.0")
-                    if 'vehicle_type' in driver:
-                        print(f"   Vehicle: {driver['vehicle_type']} ({driver.get('vehicle_number', 'N/A')})")
+                for driver in top_recommendations:
+                    # Unroutable drivers have no ETA; NaN isn't valid JSON
+                    if 'pickup_eta_min' in driver and pd.isna(driver['pickup_eta_min']):
+                        driver['pickup_eta_min'] = None
+
+                if log.isEnabledFor(logging.DEBUG):
+                    for i, driver in enumerate(top_recommendations, 1):
+                        log.debug(
+                            "%d. %s (ID: %s) score %.3f, %.2f km, acceptance %.3f, rating %.1f",
+                            i, driver['name'], driver['driver_id'],
+                            driver['recommendation_score'], driver['distance_to_pickup'],
+                            driver['ml_acceptance_probability'], driver['rating_avg']
+                        )
 
                 return jsonify({
                     'ok': True,
@@ -1210,17 +1545,13 @@ def create_app():
                 }), 200
 
             except Exception as ml_error:
-                print(f"❌ ML recommendation error: {str(ml_error)}")
-                import traceback
-                traceback.print_exc()
+                log.exception("ML recommendation error: %s", ml_error)
                 return _fallback_distance_recommendation(
                     pickup_lat, pickup_lon, drivers_df, top_n
                 )
 
         except Exception as e:
-            print(f"❌ Recommendation endpoint error: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            log.exception("Recommendation endpoint error: %s", e)
             return jsonify({
                 'ok': False,
                 'msg': f'Recommendation failed: {str(e)}'
@@ -1258,10 +1589,14 @@ def create_app():
         Example: GET http://localhost:5000/model_status
         """
         try:
+            pending = training_jobs.pending_job()
+            training = training_jobs.public(pending) if pending else None
+
             if recommender.model is None:
                 return jsonify({
                     'ok': False,
                     'model_trained': False,
+                    'training_job': training,
                     'msg': 'Model not trained. Use /train_model endpoint to train.'
                 }), 200
 
@@ -1271,6 +1606,7 @@ def create_app():
                 'num_drivers_tracked': len(recommender.driver_stats),
                 'num_features': len(recommender.feature_names),
                 'features': recommender.feature_names,
+                'training_job': training,
                 'msg': 'Model is ready'
             }), 200
 
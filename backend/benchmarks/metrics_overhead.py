@@ -0,0 +1,133 @@
+"""
+Cost of the metrics instrumentation (metrics.py).
+
+Times the same work with and without each hook and reports the added
+microseconds per call:
+
+  * an HTTP request to a trivial Flask route, with and without
+    instrument_flask's before/after_request hooks
+  * a Socket.IO handler call through instrument_socketio's wrapper
+  * a track() block around a dependency call (Redis, DB, ORS)
+
+and expresses them against p50 latencies from benchmarks/baseline.json:
+the location-update path (one socket event around a tracked DB call) and
+get_available_drivers (the DB work of a dispatch request: HTTP hooks
+around a tracked DB call). The target is under 2%. Runs alternate between the
+instrumented and plain variants so machine noise hits both alike.
+
+Usage (from backend/):
+    python benchmarks/metrics_overhead.py
+    python benchmarks/metrics_overhead.py --iterations 50000 --rounds 7
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from flask import Flask
+
+import metrics
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+OVERHEAD_TARGET_PCT = 2.0
+
+
+def per_call_us(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def added_us(plain, instrumented, iterations, rounds):
+    """Median over rounds of instrumented - plain, in microseconds per call"""
+    per_call_us(plain, iterations // 10 + 1)          # warm-up
+    per_call_us(instrumented, iterations // 10 + 1)
+    deltas = []
+    for _ in range(rounds):
+        base = per_call_us(plain, iterations)
+        deltas.append(per_call_us(instrumented, iterations) - base)
+    deltas.sort()
+    return max(0.0, deltas[len(deltas) // 2]), base
+
+
+def flask_client(instrumented):
+    app = Flask(__name__)
+    if instrumented:
+        metrics.instrument_flask(app)
+
+    @app.get("/ping")
+    def ping():
+        return "ok"
+    return app.test_client()
+
+
+class FakeSocketIO:
+    """Keeps the handler instrument_socketio registers"""
+    registered = None
+
+    def on(self, message, namespace=None):
+        def add_handler(handler):
+            self.registered = handler
+            return handler
+        return add_handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000, help="calls per timed run")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    plain_client, timed_client = flask_client(False), flask_client(True)
+    http_added, http_base = added_us(lambda: plain_client.get("/ping"), lambda: timed_client.get("/ping"),
+                                     max(1, args.iterations // 5), args.rounds)
+
+    def handler(data):
+        return data
+    sio = FakeSocketIO()
+    metrics.instrument_socketio(sio)
+    sio.on("bench")(handler)
+    socket_added, _ = added_us(lambda: handler(1), lambda: sio.registered(1), args.iterations, args.rounds)
+
+    def tracked():
+        with metrics.track("bench", "op"):
+            pass
+    track_added, _ = added_us(lambda: None, tracked, args.iterations, args.rounds)
+
+    report = {
+        "http_request_us": round(http_base, 1),
+        "http_hooks_added_us": round(http_added, 2),
+        "socket_wrapper_added_us": round(socket_added, 2),
+        "track_added_us": round(track_added, 2),
+    }
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+        paths = {
+            "location_update": socket_added + track_added,
+            "get_available_drivers": http_added + track_added,
+        }
+        worst = 0.0
+        for name, added in paths.items():
+            p50_ms = baseline.get("small", {}).get(name, {}).get("p50_ms")
+            if p50_ms:
+                pct = added / (p50_ms * 1000) * 100
+                report[f"{name}_p50_us"] = round(p50_ms * 1000, 1)
+                report[f"{name}_overhead_pct"] = round(pct, 3)
+                worst = max(worst, pct)
+        report["within_target"] = worst < OVERHEAD_TARGET_PCT
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Size and cost of route geometry (polyline.py, RouteResult).
+
+Generates ORS-like routes around the synthetic city (a vertex every ~8 m
+along a road that curves and turns) and, for each simplification method
+and tolerance, reports:
+
+  * points kept and the largest distance of a dropped point from the
+    simplified line
+  * payload bytes: raw coordinates as JSON vs the encoded polyline
+  * memory per cached route: the coordinate lists vs RouteResult's
+    packed geometry
+  * time to simplify + pack a route and to decode it again
+
+Usage (from backend/):
+    python benchmarks/route_geometry.py
+    python benchmarks/route_geometry.py --routes 50 --km 25 --tolerances 2 5 10
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+import route_service
+from synthetic_city import SyntheticCity
+from polyline import simplify, _to_metres, _segment_distances
+from route_service import RouteResult
+
+VERTEX_SPACING_M = 8
+M_PER_DEG = 111320.0
+
+
+def synthetic_route(rng, start, km):
+    """[[lon, lat], ...] of a road that drifts, curves and takes the odd junction turn"""
+    lat, lon = start
+    heading = rng.uniform(0, 2 * math.pi)
+    coords = [[lon, lat]]
+    for _ in range(int(km * 1000 / VERTEX_SPACING_M)):
+        heading += rng.gauss(0, 0.03)
+        if rng.random() < 0.005:
+            heading += rng.choice((-1, 1)) * math.pi / 2
+        lat += VERTEX_SPACING_M * math.cos(heading) / M_PER_DEG
+        lon += VERTEX_SPACING_M * math.sin(heading) / (M_PER_DEG * math.cos(math.radians(lat)))
+        coords.append([lon, lat])
+    return coords
+
+
+def allocated_bytes(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def max_deviation_m(original, simplified):
+    """Largest distance from a dropped vertex to the simplified line"""
+    xy = _to_metres(original)
+    index = {tuple(p): i for i, p in enumerate(original)}
+    kept = [index[tuple(p)] for p in simplified]
+    worst = 0.0
+    for a, b in zip(kept, kept[1:]):
+        if b - a > 1:
+            worst = max(worst, float(_segment_distances(xy[a + 1:b], xy[a], xy[b]).max()))
+    return worst
+
+
+def run(routes, method, tolerance):
+    route_service.ROUTE_SIMPLIFY_METHOD = method
+    route_service.ROUTE_SIMPLIFY_TOLERANCE_M = tolerance
+
+    points_in = points_kept = raw_json = polyline_json = 0
+    raw_mem = packed_mem = 0
+    worst, build_s, decode_s = 0.0, [], []
+    for coords in routes:
+        started = time.perf_counter()
+        result = RouteResult.from_coordinates(10.0, 20.0, coords, "bench")
+        build_s.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        decoded = result.coordinates
+        decode_s.append(time.perf_counter() - started)
+
+        raw_text = json.dumps(coords)
+        points_in += len(coords)
+        points_kept += len(decoded)
+        raw_json += len(raw_text)
+        polyline_json += len(json.dumps(result.polyline))
+        # Coordinates as parsed from the ORS response vs a fresh copy of the packed form
+        raw_mem += allocated_bytes(lambda: json.loads(raw_text))
+        packed_mem += allocated_bytes(lambda: RouteResult(10.0, 20.0, bytes(bytearray(result.geometry)), "bench"))
+        # Deviation is measured on the simplification itself, before quantization
+        worst = max(worst, max_deviation_m(coords, simplify(coords, tolerance, method)))
+
+    n = len(routes)
+    return {
+        "method": method,
+        "tolerance_m": tolerance,
+        "points_per_route": round(points_in / n),
+        "points_kept": round(points_kept / n),
+        "max_deviation_m": round(worst, 2),
+        "json_bytes_raw": round(raw_json / n),
+        "json_bytes_polyline": round(polyline_json / n),
+        "payload_reduction": f"{raw_json / polyline_json:.0f}x",
+        "cached_bytes_raw": round(raw_mem / n),
+        "cached_bytes_packed": round(packed_mem / n),
+        "memory_reduction": f"{raw_mem / packed_mem:.0f}x",
+        "build_ms_p50": round(float(np.percentile(build_s, 50)) * 1000, 3),
+        "decode_ms_p50": round(float(np.percentile(decode_s, 50)) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", type=int, default=30)
+    parser.add_argument("--km", type=float, default=15, help="length of each route")
+    parser.add_argument("--methods", nargs="+", choices=["dp", "vw"], default=["dp", "vw"])
+    parser.add_argument("--tolerances", type=float, nargs="+", default=[0, 2, 5, 10],
+                        help="simplification tolerances in metres (0 = pack only)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    city = SyntheticCity(1, 1, seed=7)
+    routes = [synthetic_route(rng, city.sample_point(), args.km) for _ in range(args.routes)]
+
+    report = []
+    for method in args.methods:
+        for tolerance in args.tolerances:
+            if tolerance == 0 and method != args.methods[0]:
+                continue     # no simplification: identical for every method
+            report.append(run(routes, method, tolerance))
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Latency / memory benchmarks for the dispatch and fare hot paths.
+
+Builds a synthetic city (benchmarks/synthetic_city.py) in a local SQLite file
+and times get_available_drivers, DriverRecommender.recommend_drivers,
+train_from_database, FareCalculator.compute / compute_many and the socket
+location-update path at several scales. Reports p50/p95/p99 latency and peak allocated memory
+per operation and compares p95 against benchmarks/baseline.json.
+
+Usage (from backend/):
+    python benchmarks/run_benchmarks.py                    # all scales, compare to baseline
+    python benchmarks/run_benchmarks.py --scales small
+    python benchmarks/run_benchmarks.py --update-baseline  # record current numbers
+
+Exits with status 1 when an operation regresses past --tolerance. The stored
+baseline is hardware specific; re-record it with --update-baseline when the
+benchmark machine changes.
+"""
+
+import os
+import sys
+import json
+import atexit
+import shutil
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+WORK_DIR = tempfile.mkdtemp(prefix="safar_bench_")
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+DB_PATH = os.path.join(WORK_DIR, "bench.db")
+# db.py builds its engine from DATABASE_URL at import time
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import numpy as np
+import pandas as pd
+from flask import Flask
+
+from models import db
+from ml_recommender import DriverRecommender
+from fare_calculator import FareCalculator
+from db import get_available_drivers, update_driver_and_ride_location
+from synthetic_city import SyntheticCity, enable_sqlite_compat
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# name -> (drivers, rides)
+SCALES = {
+    "small": (200, 2_000),
+    "medium": (2_000, 20_000),
+    "large": (10_000, 100_000),
+}
+
+# name -> iterations per scale
+ITERATIONS = {
+    "get_available_drivers": 30,
+    "recommend_drivers": 30,
+    "train_from_database": 3,
+    "fare_compute": 20_000,
+    "fare_compute_many": 5,
+    "location_update": 500,
+}
+
+# Trips per FareCalculator.compute_many call
+FARE_BATCH_ROWS = 1_000_000
+
+# Regressions smaller than this (ms) are treated as timer noise
+NOISE_FLOOR_MS = 0.05
+
+
+def create_bench_app():
+    enable_sqlite_compat()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ["DATABASE_URL"]
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def summarize(samples_s, peak_bytes):
+    ms = np.asarray(samples_s) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "peak_kb": round(peak_bytes / 1024, 1),
+        "iterations": len(ms),
+    }
+
+
+def measure(fn, iterations):
+    """Time fn over iterations, then one extra traced run for peak memory"""
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(iterations)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(samples, peak)
+
+
+def run_scale(app, name, num_drivers, num_rides):
+    print(f"\n▶ {name}: {num_drivers} drivers, {num_rides} rides")
+    city = SyntheticCity(num_drivers, num_rides)
+    rng = random.Random(7)
+    results = {}
+
+    with app.app_context():
+        city.load(db)
+
+        recommender = DriverRecommender(autoload=False)
+        results["train_from_database"] = measure(
+            lambda i: recommender.train_from_database(db), ITERATIONS["train_from_database"]
+        )
+
+        results["get_available_drivers"] = measure(
+            lambda i: get_available_drivers(), ITERATIONS["get_available_drivers"]
+        )
+
+        drivers_df = pd.DataFrame(get_available_drivers())
+        pickups = [city.sample_point() for _ in range(ITERATIONS["recommend_drivers"] + 1)]
+        results["recommend_drivers"] = measure(
+            lambda i: recommender.recommend_drivers(pickups[i][0], pickups[i][1], drivers_df.copy()),
+            ITERATIONS["recommend_drivers"]
+        )
+
+        calc = FareCalculator()
+        trips = [(rng.uniform(1, 40), rng.uniform(3, 90)) for _ in range(ITERATIONS["fare_compute"] + 1)]
+        results["fare_compute"] = measure(
+            lambda i: calc.compute(*trips[i]), ITERATIONS["fare_compute"]
+        )
+
+        batch = np.random.default_rng(7)
+        batch_distance = batch.uniform(1, 40, FARE_BATCH_ROWS)
+        batch_duration = batch.uniform(3, 90, FARE_BATCH_ROWS)
+        batch_surge = batch.uniform(1.0, 2.5, FARE_BATCH_ROWS)
+        results["fare_compute_many"] = measure(
+            lambda i: calc.compute_many(batch_distance, batch_duration, surge=batch_surge),
+            ITERATIONS["fare_compute_many"]
+        )
+
+        pings = [
+            (rng.randint(1, num_drivers), rng.randint(1, num_rides), *city.sample_point())
+            for _ in range(ITERATIONS["location_update"] + 1)
+        ]
+        results["location_update"] = measure(
+            lambda i: update_driver_and_ride_location(*pings[i]), ITERATIONS["location_update"]
+        )
+
+        db.session.remove()
+
+    for op, stats in results.items():
+        print(f"  {op:<24} p50 {stats['p50_ms']:>10.3f} ms  p95 {stats['p95_ms']:>10.3f} ms  "
+              f"p99 {stats['p99_ms']:>10.3f} ms  peak {stats['peak_kb']:>10.1f} KB")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regression descriptions (empty when everything is within tolerance)"""
+    regressions = []
+    for scale, ops in results.items():
+        for op, stats in ops.items():
+            base = baseline.get(scale, {}).get(op)
+            if not base:
+                continue
+            for metric in ("p95_ms", "peak_kb"):
+                limit = base[metric] * tolerance
+                floor = NOISE_FLOOR_MS if metric == "p95_ms" else 1.0
+                if stats[metric] > limit and stats[metric] - base[metric] > floor:
+                    regressions.append(
+                        f"{scale}/{op} {metric}: {stats[metric]} > {base[metric]} x {tolerance}"
+                    )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=list(SCALES))
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="allowed ratio over the baseline before failing (default 1.25)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="write the results to benchmarks/baseline.json")
+    args = parser.parse_args()
+
+    # train_from_database saves its model relative to the working directory
+    os.chdir(WORK_DIR)
+    app = create_bench_app()
+
+    results = {name: run_scale(app, name, *SCALES[name]) for name in args.scales}
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline or not baseline:
+        baseline.update(results)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\n✓ Baseline written to {BASELINE_PATH}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\n❌ Performance regressions:")
+        for line in regressions:
+            print(f"   {line}")
+        return 1
+
+    print("\n✓ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,466 @@
+"""
+Socket.IO load generator for live-tracking capacity testing.
+
+Simulates drivers streaming driver_location_update and riders following
+their ride via join_ride / request_current_location, then reports event
+round-trip latency, dropped messages, DB write rate and server CPU.
+
+By default a single app worker is started in a subprocess on a local SQLite
+synthetic city, with Redis, OpenRouteService and WeatherAPI replaced by
+in-process fakes, so results reflect the socket path and not shared
+infrastructure. Pass --url to drive an already running server instead
+(server-side CPU and DB write figures are then unavailable).
+
+Usage (from backend/):
+    python benchmarks/socket_load.py --drivers 1000 --duration 60 --interval 2
+    python benchmarks/socket_load.py --url http://127.0.0.1:5000 --drivers 200
+
+The websocket transport needs the websocket-client package; without it the
+clients fall back to long-polling.
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import subprocess
+from collections import deque
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+# Time allowed after the last ping for acks and broadcasts to arrive
+DRAIN_SECONDS = 5
+CONNECT_TIMEOUT = 30
+
+
+# ---------- server side ----------
+
+class FakeRedis:
+    """Enough of redis.Redis for token storage and trip traces"""
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def delete(self, *keys):
+        return sum(self.data.pop(k, None) is not None for k in keys)
+
+    def rpush(self, key, value):
+        self.data.setdefault(key, []).append(value)
+        return len(self.data[key])
+
+    def ltrim(self, key, start, end):
+        self.data[key] = self.data.get(key, [])[start:end + 1]
+
+    def expire(self, key, seconds):
+        return int(key in self.data)
+
+    def lrange(self, key, start, end):
+        return self.data.get(key, [])[start:None if end == -1 else end + 1]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in calls]
+
+
+class FakePresence:
+    """PresenceStore without Redis GEO; pings are only counted"""
+    def __init__(self):
+        self.heartbeats = 0
+
+    def heartbeat(self, driver_id, lat, lon, busy=False):
+        self.heartbeats += 1
+
+    def mark_busy(self, driver_id):
+        pass
+
+    def mark_idle(self, driver_id):
+        pass
+
+    def remove(self, driver_id):
+        pass
+
+
+class FakeRouteService:
+    def get_route(self, start, end):
+        from synthetic_city import haversine_km
+        distance_km = haversine_km((start[1], start[0]), (end[1], end[0])) * 1.3
+        return distance_km, distance_km / 25 * 60, [list(start), list(end)]
+
+
+class FakeWeatherService:
+    def check_weather_safety(self, lat, lon):
+        return True, "✅ Weather conditions are favorable for your ride.", {
+            "condition": "Clear", "temperature": 30, "wind_kph": 5,
+            "visibility_km": 10, "rain_mm": 0, "severity": "safe", "is_safe": True
+        }
+
+    def get_weather_summary(self, weather_details):
+        return "Clear"
+
+
+def serve(args):
+    """Run one app worker on a synthetic city with local fakes for every upstream"""
+    work_dir = tempfile.mkdtemp(prefix="safar_load_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(work_dir, 'load.db')}"
+    os.chdir(work_dir)
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from synthetic_city import SyntheticCity, enable_sqlite_compat
+    enable_sqlite_compat()
+
+    counters = {"db_writes": 0}
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def count_writes(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:6].upper() in ("UPDATE", "INSERT", "DELETE"):
+            counters["db_writes"] += 1
+
+    import app as app_module
+    app_module.r = FakeRedis()
+    app_module.trip_traces = app_module.TripTraceRecorder(app_module.r)
+    app_module.route_service = FakeRouteService()
+    app_module.weather_service = FakeWeatherService()
+    app_module.presence = FakePresence()
+    # Neither background job has a real store behind it here
+    app_module.presence_sweeper.interval = 0
+    app_module.weather_maintenance.interval = 0
+
+    flask_app, socketio = app_module.create_app()
+
+    with flask_app.app_context():
+        # One ride per simulated driver: ride N is driven by driver N
+        city = SyntheticCity(args.drivers, args.drivers)
+        city.load(app_module.db)
+        app_module.db.session.execute(
+            app_module.text("UPDATE ride SET driver_id = ride_id, status = 'in_progress'")
+        )
+        app_module.db.session.commit()
+
+    @socketio.on('loadtest_stats')
+    def loadtest_stats(data=None):
+        return {
+            "cpu_s": time.process_time(),
+            "db_writes": counters["db_writes"],
+            "wall_s": time.time()
+        }
+
+    print(f"load-test server ready on port {args.port}", flush=True)
+    socketio.run(flask_app, host="127.0.0.1", port=args.port, log_output=False)
+
+
+def start_server(args):
+    cmd = [sys.executable, os.path.abspath(__file__), "--serve",
+           "--port", str(args.port), "--drivers", str(args.drivers)]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR)
+
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("load-test server exited during startup")
+        try:
+            with socket.create_connection(("127.0.0.1", args.port), timeout=1):
+                return proc
+        except OSError:
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("load-test server did not start")
+
+
+# ---------- client side ----------
+
+class Stats:
+    def __init__(self):
+        self.ack_latency = []
+        self.broadcast_latency = []
+        self.join_latency = []
+        self.request_latency = []
+        self.pings_sent = 0
+        self.acks = 0
+        self.ack_errors = 0
+        self.broadcasts_expected = 0
+        self.broadcasts = 0
+        self.predicted_broadcasts = 0
+        self.connect_failures = 0
+
+
+class DriverSim:
+    def __init__(self, url, transports, driver_id, ride_id, origin, stats, riders):
+        import socketio
+        self.url, self.transports = url, transports
+        self.driver_id, self.ride_id = driver_id, ride_id
+        self.lat, self.lon = origin
+        self.stats = stats
+        self.riders = riders
+        self.pending = deque()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('location_update_response', self._on_ack)
+
+    def connect(self):
+        self.sio.connect(self.url, transports=self.transports, wait_timeout=CONNECT_TIMEOUT)
+        self.sio.emit('join_driver_room', {'driver_id': self.driver_id})
+
+    def ping(self):
+        # Drift ~10 m per ping
+        self.lat += random.uniform(-1e-4, 1e-4)
+        self.lon += random.uniform(-1e-4, 1e-4)
+        sent = time.perf_counter()
+        self.pending.append(sent)
+        for rider in self.riders:
+            rider.expect(sent)
+        self.stats.pings_sent += 1
+        self.sio.emit('driver_location_update', {
+            'driver_id': self.driver_id,
+            'ride_id': self.ride_id,
+            'latitude': self.lat,
+            'longitude': self.lon
+        })
+
+    def _on_ack(self, data):
+        if not self.pending:
+            return
+        self.stats.ack_latency.append(time.perf_counter() - self.pending.popleft())
+        self.stats.acks += 1
+        if not data.get('ok'):
+            self.stats.ack_errors += 1
+
+    def disconnect(self):
+        self.sio.disconnect()
+
+
+class RiderSim:
+    def __init__(self, url, transports, ride_id, stats):
+        import socketio
+        self.url, self.transports = url, transports
+        self.ride_id = ride_id
+        self.stats = stats
+        # Send times of pings not yet broadcast; the server broadcasts the
+        # smoothed position, so pings are matched in order, not by coordinates
+        self.expected = deque()
+        self.requested_at = None
+        self.joined = eventlet.event.Event()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('joined_room', self._on_joined)
+        self.sio.on('ride_location', self._on_location)
+        self.sio.on('location_error', self._on_location_error)
+
+    def connect(self):
+        self.sio.connect(self.url, transports=self.transports, wait_timeout=CONNECT_TIMEOUT)
+        self._join_sent = time.perf_counter()
+        self.sio.emit('join_ride', {'ride_id': self.ride_id})
+
+    def request_location(self):
+        self.requested_at = time.perf_counter()
+        self.sio.emit('request_current_location', {'ride_id': self.ride_id})
+
+    def expect(self, sent):
+        self.expected.append(sent)
+        self.stats.broadcasts_expected += 1
+
+    def _on_joined(self, data):
+        self.stats.join_latency.append(time.perf_counter() - self._join_sent)
+        self.joined.send(True)
+
+    def _on_location(self, data):
+        if data.get('predicted') and self.requested_at is None:
+            self.stats.predicted_broadcasts += 1
+        elif self.expected:
+            self.stats.broadcast_latency.append(time.perf_counter() - self.expected.popleft())
+            self.stats.broadcasts += 1
+        elif self.requested_at is not None:
+            self.stats.request_latency.append(time.perf_counter() - self.requested_at)
+            self.requested_at = None
+
+    def _on_location_error(self, data):
+        if self.requested_at is not None:
+            self.stats.request_latency.append(time.perf_counter() - self.requested_at)
+            self.requested_at = None
+
+    def disconnect(self):
+        self.sio.disconnect()
+
+
+def percentiles(samples_s):
+    if not samples_s:
+        return None
+    ms = np.asarray(samples_s) * 1000
+    return {
+        "count": len(ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def server_stats(url, transports):
+    import socketio
+    client = socketio.Client(reconnection=False)
+    try:
+        client.connect(url, transports=transports, wait_timeout=CONNECT_TIMEOUT)
+        return client.call('loadtest_stats', {}, timeout=10)
+    except Exception:
+        return None
+    finally:
+        client.disconnect()
+
+
+def run_load(args, url):
+    from synthetic_city import SyntheticCity
+
+    try:
+        import websocket  # noqa: F401  (websocket-client)
+        transports = ['websocket']
+    except ImportError:
+        transports = ['polling']
+
+    city = SyntheticCity(args.drivers, args.drivers)
+    stats = Stats()
+    pool = eventlet.GreenPool(args.connect_concurrency)
+
+    riders, drivers = [], []
+    for n in range(1, args.drivers + 1):
+        ride_riders = [RiderSim(url, transports, n, stats) for _ in range(args.riders_per_ride)]
+        riders.extend(ride_riders)
+        drivers.append(DriverSim(url, transports, n, n, city.sample_point(), stats, ride_riders))
+
+    def connect(client):
+        try:
+            client.connect()
+            return client
+        except Exception:
+            stats.connect_failures += 1
+            return None
+
+    print(f"Connecting {len(drivers)} drivers and {len(riders)} riders ({transports[0]})...")
+    riders = [c for c in pool.imap(connect, riders) if c]
+    drivers = [c for c in pool.imap(connect, drivers) if c]
+    for rider in riders:
+        rider.joined.wait(CONNECT_TIMEOUT)
+
+    # Current-location requests before any pings, so replies are unambiguous
+    for rider in riders:
+        rider.request_location()
+    eventlet.sleep(2)
+
+    before = server_stats(url, transports)
+    started = time.time()
+
+    def drive(driver):
+        eventlet.sleep(random.uniform(0, args.interval))   # spread the pings out
+        while time.time() - started < args.duration:
+            driver.ping()
+            eventlet.sleep(args.interval)
+
+    print(f"Streaming locations for {args.duration}s every {args.interval}s per driver...")
+    load_pool = eventlet.GreenPool(len(drivers) + 1)
+    for driver in drivers:
+        load_pool.spawn(drive, driver)
+    load_pool.waitall()
+    eventlet.sleep(DRAIN_SECONDS)
+    elapsed = time.time() - started
+
+    after = server_stats(url, transports)
+
+    for client in drivers + riders:
+        try:
+            client.disconnect()
+        except Exception:
+            pass
+
+    report = {
+        "drivers": len(drivers),
+        "riders": len(riders),
+        "connect_failures": stats.connect_failures,
+        "duration_s": round(elapsed, 1),
+        "pings_sent": stats.pings_sent,
+        "pings_per_s": round(stats.pings_sent / args.duration, 1),
+        "ack_latency": percentiles(stats.ack_latency),
+        "broadcast_latency": percentiles(stats.broadcast_latency),
+        "join_latency": percentiles(stats.join_latency),
+        "current_location_latency": percentiles(stats.request_latency),
+        "dropped_acks": stats.pings_sent - stats.acks,
+        "failed_acks": stats.ack_errors,
+        "dropped_broadcasts": stats.broadcasts_expected - stats.broadcasts,
+        "predicted_broadcasts": stats.predicted_broadcasts,
+    }
+    if before and after:
+        wall = after["wall_s"] - before["wall_s"]
+        cpu = after["cpu_s"] - before["cpu_s"]
+        report["server_cpu_s"] = round(cpu, 2)
+        report["server_cpu_pct_of_core"] = round(100 * cpu / wall, 1) if wall else None
+        report["db_writes_per_s"] = round((after["db_writes"] - before["db_writes"]) / wall, 1) if wall else None
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="drive an existing server instead of starting one")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--drivers", type=int, default=200)
+    parser.add_argument("--riders-per-ride", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of location streaming")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between pings per driver")
+    parser.add_argument("--connect-concurrency", type=int, default=50)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return 0
+
+    server = None
+    url = args.url
+    if not url:
+        server = start_server(args)
+        url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        report = run_load(args, url)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(10)
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
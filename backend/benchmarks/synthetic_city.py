@@ -0,0 +1,150 @@
+"""
+Deterministic synthetic city for benchmarks and load tests.
+
+Generates drivers, vehicles, users and rides around a handful of demand
+hotspots, and loads them into any SQLAlchemy database the models can be
+created in (a local SQLite file by default), so the benchmark suite never
+needs the shared Supabase instance.
+"""
+
+import math
+import random
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from fare_calculator import FareCalculator
+
+# Karachi city centre; matches the coordinates used throughout the app
+CITY_CENTER = (24.8607, 67.0011)
+CITY_RADIUS_KM = 25
+
+RIDE_STATUSES = ['completed', 'accepted', 'rejected', 'cancelled', 'pending']
+RIDE_STATUS_WEIGHTS = [0.55, 0.1, 0.15, 0.1, 0.1]
+VEHICLE_TYPES = ['Car', 'Bike', 'Rickshaw']
+
+
+class SyntheticCity:
+    def __init__(self, num_drivers, num_rides, num_hotspots=8, seed=42):
+        self.num_drivers = num_drivers
+        self.num_rides = num_rides
+        self.rng = random.Random(seed)
+        self.fare_calc = FareCalculator()
+
+        self.hotspots = [
+            (self._random_point(CITY_CENTER, CITY_RADIUS_KM * 0.8), self.rng.uniform(0.5, 3.0))
+            for _ in range(num_hotspots)
+        ]
+        self.num_users = max(1, num_rides // 20)
+
+    def _random_point(self, center, radius_km):
+        """Uniform point in a disc around center"""
+        r = radius_km * math.sqrt(self.rng.random())
+        theta = self.rng.uniform(0, 2 * math.pi)
+        dlat = (r * math.cos(theta)) / 111.32
+        dlon = (r * math.sin(theta)) / (111.32 * math.cos(math.radians(center[0])))
+        return center[0] + dlat, center[1] + dlon
+
+    def sample_point(self):
+        """70% of points cluster around a hotspot, the rest spread over the city"""
+        if self.rng.random() < 0.7:
+            center, spread_km = self.rng.choice(self.hotspots)
+            return self._random_point(center, spread_km)
+        return self._random_point(CITY_CENTER, CITY_RADIUS_KM)
+
+    def drivers(self):
+        for driver_id in range(1, self.num_drivers + 1):
+            lat, lon = self.sample_point()
+            yield {
+                'driver_id': driver_id,
+                'name': f'Driver {driver_id}',
+                'email': f'driver{driver_id}@bench.local',
+                'password': 'x',
+                'license_no': f'LIC{driver_id:07d}',
+                'rating_avg': round(self.rng.uniform(2.5, 5.0), 2),
+                'is_active': self.rng.random() < 0.3,   # is_active=False means idle
+                'online': True,
+                'Latitude': lat,
+                'Longitude': lon,
+                'acceptance_probablity': 0.5,
+                'discount': 0.0,
+            }
+
+    def vehicles(self):
+        for driver_id in range(1, self.num_drivers + 1):
+            yield {
+                'vehicle_id': driver_id,
+                'vehicle_no': f'KHI-{driver_id:05d}',
+                'type': self.rng.choice(VEHICLE_TYPES),
+                'driver_id': driver_id,
+            }
+
+    def users(self):
+        for user_id in range(1, self.num_users + 1):
+            yield {
+                'user_id': user_id,
+                'name': f'Rider {user_id}',
+                'email': f'rider{user_id}@bench.local',
+                'phone': f'0300{user_id:07d}',
+                'type': 'Rider',
+            }
+
+    def rides(self):
+        start = date(2025, 1, 1)
+        for ride_id in range(1, self.num_rides + 1):
+            pickup = self.sample_point()
+            drop = self.sample_point()
+            distance_km = haversine_km(pickup, drop) * 1.3   # road factor
+            duration_min = distance_km / 25 * 60
+            yield {
+                'ride_id': ride_id,
+                'pickup': f'Pickup {ride_id}',
+                'drop': f'Drop {ride_id}',
+                'ride_date': start + timedelta(days=ride_id * 365 // max(self.num_rides, 1)),
+                'fare': self.fare_calc.compute(distance_km, duration_min),
+                'driver_id': self.rng.randint(1, self.num_drivers),
+                'user_id': self.rng.randint(1, self.num_users),
+                'pickup_latitude': pickup[0],
+                'pickup_longitude': pickup[1],
+                'drop_latitude': drop[0],
+                'drop_longitude': drop[1],
+                'distance_km': distance_km,
+                'duration_min': duration_min,
+                'status': self.rng.choices(RIDE_STATUSES, RIDE_STATUS_WEIGHTS)[0],
+            }
+
+    def load(self, db, batch_size=5000):
+        """Create the schema and bulk insert the city through the given Flask-SQLAlchemy db"""
+        from models import Driver, Vehicle, User, Ride
+
+        db.drop_all()
+        db.create_all()
+        for model, rows in ((Driver, self.drivers()), (Vehicle, self.vehicles()),
+                            (User, self.users()), (Ride, self.rides())):
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    db.session.execute(model.__table__.insert(), batch)
+                    batch = []
+            if batch:
+                db.session.execute(model.__table__.insert(), batch)
+        db.session.commit()
+
+
+def haversine_km(a, b):
+    lat1, lon1, lat2, lon2 = map(math.radians, [a[0], a[1], b[0], b[1]])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371 * math.asin(math.sqrt(h))
+
+
+def enable_sqlite_compat():
+    """Register the PostgreSQL functions db.py calls on every SQLite connection"""
+    if not event.contains(Engine, "connect", _sqlite_functions):
+        event.listen(Engine, "connect", _sqlite_functions)
+
+
+def _sqlite_functions(dbapi_connection, connection_record):
+    if hasattr(dbapi_connection, "create_function"):
+        dbapi_connection.create_function("NOW", 0, lambda: datetime.now().isoformat(" "))
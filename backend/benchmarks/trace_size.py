@@ -0,0 +1,127 @@
+"""
+Storage cost of recorded ride traces (trip_trace.py).
+
+Simulates trips around the synthetic city (a car driving at city speeds
+with turns, stops and GPS noise), records each into a TraceBuffer and
+reports bytes per ping of the stored blob against the alternatives: one
+ride_location row per ping and the raw (lat, lon, t) floats. Also reports
+the size of the entries TripTraceRecorder keeps in Redis while the ride is
+active, encode/decode time per trip and the worst position error
+introduced by quantization.
+
+Usage (from backend/):
+    python benchmarks/trace_size.py
+    python benchmarks/trace_size.py --trips 200 --minutes 40 --intervals 2 5 10
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from synthetic_city import SyntheticCity
+from trip_trace import TraceBuffer, decode_trace, TRACE_COORD_SCALE
+
+GPS_SIGMA_M = 5
+M_PER_DEG = 111320.0
+# A ping stored as its own row: 23 B tuple header + 1 B padding + ride_id,
+# lat, lon, timestamp (4 + 8 + 8 + 8) + 4 B line pointer, before any index
+ROW_BYTES_PER_PING = 23 + 1 + 28 + 4
+RAW_BYTES_PER_PING = 3 * 8
+
+
+def simulate_trip(rng, start, minutes, interval):
+    """(lat, lon, t) pings of one trip: cruising, turning, stopping at lights"""
+    lat, lon = start
+    heading = rng.uniform(0, 2 * math.pi)
+    speed = rng.uniform(6, 14)
+    t = time.time()
+    pings = []
+    for _ in range(int(minutes * 60 / interval)):
+        if rng.random() < 0.05:
+            speed = 0.0 if speed else rng.uniform(6, 14)
+        if rng.random() < 0.1:
+            heading += rng.choice((-1, 1)) * math.pi / 2
+        step = speed * interval
+        lat += step * math.cos(heading) / M_PER_DEG
+        lon += step * math.sin(heading) / (M_PER_DEG * math.cos(math.radians(lat)))
+        t += interval + rng.uniform(-0.3, 0.3)
+        pings.append((
+            lat + rng.gauss(0, GPS_SIGMA_M) / M_PER_DEG,
+            lon + rng.gauss(0, GPS_SIGMA_M) / (M_PER_DEG * math.cos(math.radians(lat))),
+            t,
+        ))
+    return pings
+
+
+def run(trips, minutes, interval, seed=7):
+    rng = random.Random(seed)
+    city = SyntheticCity(1, 1, seed=seed)
+
+    blob_bytes, redis_bytes, pings_total, max_error_m = 0, 0, 0, 0.0
+    encode_s, decode_s = [], []
+    for _ in range(trips):
+        pings = simulate_trip(rng, city.sample_point(), minutes, interval)
+        buffer = TraceBuffer()
+        for lat, lon, t in pings:
+            buffer.append(lat, lon, t)
+            # The "lat,lon,t" list entry TripTraceRecorder.append pushes
+            redis_bytes += len(f"{round(lat * TRACE_COORD_SCALE)},{round(lon * TRACE_COORD_SCALE)},{round(t)}")
+
+        started = time.perf_counter()
+        blob = buffer.encode()
+        encode_s.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        decoded = decode_trace(blob)
+        decode_s.append(time.perf_counter() - started)
+
+        assert len(decoded) == len(pings)
+        for (lat, lon, _), (d_lat, d_lon, _) in zip(pings, decoded):
+            error = math.hypot((lat - d_lat) * M_PER_DEG,
+                               (lon - d_lon) * M_PER_DEG * math.cos(math.radians(lat)))
+            max_error_m = max(max_error_m, error)
+        blob_bytes += len(blob)
+        pings_total += len(pings)
+
+    return {
+        "ping_interval_s": interval,
+        "pings_per_trip": pings_total // trips,
+        "blob_bytes_per_trip": round(blob_bytes / trips),
+        "blob_bytes_per_ping": round(blob_bytes / pings_total, 2),
+        "row_bytes_per_ping": ROW_BYTES_PER_PING,
+        "raw_float_bytes_per_ping": RAW_BYTES_PER_PING,
+        "redis_entry_bytes_per_ping": round(redis_bytes / pings_total, 1),
+        "vs_rows": f"{ROW_BYTES_PER_PING * pings_total / blob_bytes:.1f}x smaller",
+        "encode_ms_p50": round(float(np.percentile(encode_s, 50)) * 1000, 3),
+        "decode_ms_p50": round(float(np.percentile(decode_s, 50)) * 1000, 3),
+        "max_quantization_error_m": round(max_error_m, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trips", type=int, default=100)
+    parser.add_argument("--minutes", type=float, default=25, help="length of each trip")
+    parser.add_argument("--intervals", type=float, nargs="+", default=[2, 5, 10],
+                        help="seconds between pings")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = [run(args.trips, args.minutes, interval) for interval in args.intervals]
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Circuit breakers and last-known-good caching for upstream APIs.
+
+CircuitBreaker tracks call outcomes over a rolling window. Once at least
+min_calls have been made and the failure rate reaches failure_rate, it opens
+and rejects calls immediately with CircuitOpenError for open_seconds. After
+that a single probe call is let through (half-open): success closes the
+breaker, failure opens it again. Calls slower than slow_call_seconds count as
+failures even if they return, so a degraded upstream trips the breaker
+before it ties up every greenlet.
+
+StaleCache keeps the last good value per key. Fresh entries are served
+without calling upstream. Past fresh_seconds the entry is revalidated by
+calling upstream (through the breaker); if that fails or the breaker is
+open, the entry is served flagged stale for up to stale_seconds. During an
+outage callers get the last known good value straight away, and the
+breaker's half-open probe does the revalidation.
+"""
+
+import time
+import logging
+from collections import OrderedDict, deque
+
+from metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = REGISTRY.gauge(
+    "circuit_breaker_state", "0 closed, 1 half-open, 2 open", ("upstream",))
+CIRCUIT_REJECTIONS = REGISTRY.counter(
+    "circuit_breaker_rejections_total", "Calls failed fast by an open breaker", ("upstream",))
+STALE_SERVED = REGISTRY.counter(
+    "stale_cache_served_total", "Stale values served in place of an upstream call", ("cache",))
+
+
+class CircuitOpenError(Exception):
+    """The upstream's breaker is open; the call was not attempted"""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_rate=0.5, min_calls=10, window_seconds=30,
+                 open_seconds=30, slow_call_seconds=None):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.slow_call_seconds = slow_call_seconds
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._outcomes = deque()    # (timestamp, ok)
+        self._probing = False
+        CIRCUIT_STATE.set_function(lambda: _STATE_VALUES[self.state], name)
+
+    def call(self, fn, *args, **kwargs):
+        if not self.allow():
+            CIRCUIT_REJECTIONS.inc(self.name)
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+        start = time.monotonic()
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = self.slow_call_seconds is None or time.monotonic() - start <= self.slow_call_seconds
+            return result
+        finally:
+            # Also runs for eventlet.Timeout and GreenletExit, which aren't
+            # Exceptions; a half-open probe cut short must still be released
+            self._record(ok)
+
+    def allow(self):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                return False
+            self.state = HALF_OPEN
+            self._probing = False
+        # Half-open: one probe at a time
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def _record(self, ok):
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if ok:
+                log.info("%s circuit closed", self.name)
+                self.state = CLOSED
+                self._outcomes.clear()
+            else:
+                self._open(now)
+            return
+
+        self._outcomes.append((now, ok))
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+        if len(self._outcomes) >= self.min_calls:
+            failures = sum(1 for _, success in self._outcomes if not success)
+            if failures / len(self._outcomes) >= self.failure_rate:
+                self._open(now)
+
+    def _open(self, now):
+        log.warning("%s circuit opened for %ss", self.name, self.open_seconds)
+        self.state = OPEN
+        self.opened_at = now
+        self._outcomes.clear()
+
+
+class StaleCache:
+    def __init__(self, name, fresh_seconds, stale_seconds, max_entries=10000):
+        self.name = name
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (value, stored_at)
+
+    def put(self, key, value):
+        self._entries[key] = (value, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def peek(self, key):
+        """(value, age_seconds) or (None, None); expired entries are dropped"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, None
+        age = time.time() - entry[1]
+        if age > self.stale_seconds:
+            del self._entries[key]
+            return None, None
+        return entry[0], age
+
+    def get(self, key, fetch):
+        """
+        Return (value, stale). fetch() is only called when there is no fresh
+        entry; its exception propagates when nothing usable is cached.
+        """
+        cached, age = self.peek(key)
+        if cached is not None and age <= self.fresh_seconds:
+            return cached, False
+
+        try:
+            value = fetch()
+        except Exception as e:
+            if cached is None:
+                raise
+            log.debug("%s serving stale value for %s: %s", self.name, key, e)
+            STALE_SERVED.inc(self.name)
+            return cached, True
+
+        self.put(key, value)
+        return value, False
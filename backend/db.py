@@ -1,13 +1,18 @@
 from sqlalchemy import create_engine, text
 import os
+import logging
 from dotenv import load_dotenv
 from werkzeug.exceptions import Unauthorized
 from models import Ride,db
+from metrics import timed, instrument_pool
 
 load_dotenv()
 DATABASE_URL = os.environ["DATABASE_URL"]   # set in .env
 engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_size=5)
+instrument_pool(engine, "db")
+log = logging.getLogger(__name__)
 
+@timed("db")
 def update_driver_location(driver_id: int, lat: float, lon: float):
     """
     Updates a driver's current latitude and longitude in the database.
@@ -17,6 +22,7 @@ def update_driver_location(driver_id: int, lat: float, lon: float):
         UPDATE public.driver
         SET "Latitude" = :lat,
             "Longitude" = :lon,
+            online = true,
             last_updated = NOW()
         WHERE driver_id = :did
         RETURNING driver_id;
@@ -28,6 +34,7 @@ def update_driver_location(driver_id: int, lat: float, lon: float):
         return True, f"Driver {driver_id}'s location updated successfully."
     return False, f"Driver {driver_id} not found."
 
+@timed("db")
 def update_user_location(user_id: int, lat: float, lon: float):
     """
     Updates the user's current latitude/longitude and refreshes last_updated timestamp.
@@ -48,7 +55,8 @@ def update_user_location(user_id: int, lat: float, lon: float):
         return True, f"User {user_id}'s location updated successfully."
     return False, f"User {user_id} not found."
 
-def complete_ride_transaction(driver_id: int, ride_id: int, payment_method: str = 'cash'):
+@timed("db")
+def complete_ride_transaction(driver_id: int, ride_id: int, payment_method: str = 'cash', trace: dict = None):
     """
     Call the SQL transaction to complete a ride.
     
@@ -56,6 +64,8 @@ def complete_ride_transaction(driver_id: int, ride_id: int, payment_method: str
         driver_id: ID of the driver completing the ride
         ride_id: ID of the ride to complete
         payment_method: Payment method (default: 'cash')
+        trace: optional ride_trace row (trip_trace.TraceBuffer.to_row),
+            stored in the same transaction when the ride completes
         
     Returns:
         tuple: (success: bool, message: str, payment_id: int, fare: float)
@@ -87,6 +97,8 @@ def complete_ride_transaction(driver_id: int, ride_id: int, payment_method: str
             
             # Commit if successful
             if success:
+                if trace:
+                    _insert_ride_trace(trace)
                 db.session.commit()
             else:
                 db.session.rollback()
@@ -98,9 +110,25 @@ def complete_ride_transaction(driver_id: int, ride_id: int, payment_method: str
             
     except Exception as e:
         db.session.rollback()
-        print(f"Error in complete_ride_transaction: {e}")
+        log.exception("Error in complete_ride_transaction", extra={"ride_id": ride_id})
         return False, f"Database error: {str(e)}", None, None
     
+def _insert_ride_trace(trace):
+    # Savepoint: a failed trace write must not undo the completion
+    try:
+        with db.session.begin_nested():
+            db.session.execute(
+                text("""
+                INSERT INTO public.ride_trace (ride_id, points, started_at, ended_at, trace)
+                VALUES (:ride_id, :points, :started_at, :ended_at, :trace)
+                ON CONFLICT (ride_id) DO NOTHING
+                """),
+                trace
+            )
+    except Exception:
+        log.exception("Could not store ride trace", extra={"ride_id": trace["ride_id"]})
+
+@timed("db")
 def complete_ride_by_driver(driver_id: int, ride_id: int):
     """
     Marks a ride as completed by the driver and sets driver active again.
@@ -129,6 +157,7 @@ def complete_ride_by_driver(driver_id: int, ride_id: int):
 
     return True, f"Ride {ride_id} marked as completed. Driver {driver_id} is now active again"
 
+@timed("db")
 def cancel_ride_by_driver(driver_id: int, ride_id: int):
     """
     Cancels a ride if it belongs to the given driver.
@@ -159,6 +188,7 @@ def cancel_ride_by_driver(driver_id: int, ride_id: int):
     return True, f"Ride {ride_id} cancelled successfully by driver {driver_id} (driver now active)"
 
 
+@timed("db")
 def assign_driver_to_ride(ride_id, driver_id):
     """Assign a driver to the ride and mark it as pending."""
     ride = Ride.query.get(ride_id)
@@ -175,18 +205,21 @@ def assign_driver_to_ride(ride_id, driver_id):
         "msg": f"Driver {driver_id} assigned to ride {ride_id} with status 'pending'."
     }, 200
 
+@timed("db")
 def drivers_from_ride():
     sql = text("SELECT * FROM drivers_from_ride()")
     with engine.begin() as conn:          # engine is a real object here
         rows = conn.execute(sql).fetchall()
     return [dict(r._mapping) for r in rows]
 
+@timed("db")
 def get_non_active():
     sql = text("SELECT * FROM get_non_active_drivers()")
     with engine.begin() as conn:
         rows = conn.execute(sql).fetchall()
     return [dict(r._mapping) for r in rows]
 
+@timed("db")
 def book_ride_proc(uid, did, pickup, drop, date, fare):
     sql = text("SELECT * FROM book_ride(:u,:d,:p,:dr,:dt,:f)")
     params = dict(u=uid, d=did, p=pickup, dr=drop, dt=date, f=fare)
@@ -194,6 +227,7 @@ def book_ride_proc(uid, did, pickup, drop, date, fare):
         ok, rid, msg = conn.execute(sql, params).fetchone()
     return ok, rid, msg
 
+@timed("db")
 def login_user(email: str, password: str):
     """
     Returns (user_dict or None, message, success_bool).
@@ -220,6 +254,7 @@ def login_user(email: str, password: str):
     
 # ---------- db.py ----------
 from sqlalchemy.exc import IntegrityError   # add this at top (used in route)
+@timed("db")
 def signup_user(name: str, email: str, password: str, phone: str, utype: str):
     sql = text("""
         SELECT user_id, name, email, phone, type, msg, ok
@@ -229,11 +264,12 @@ def signup_user(name: str, email: str, password: str, phone: str, utype: str):
     with engine.begin() as conn:
         row = conn.execute(sql, params).fetchone()
 
-    print("row from DB ->", row)          # keep while debugging
+    log.debug("signup_user -> ok=%s msg=%s", row.ok if row else None, row.msg if row else None)
     if row and row.ok:                    # ok comes from the procedure now
         return dict(row._mapping), row.msg, True
     return None, row.msg if row else "Unknown error", False
 
+@timed("db")
 def signup_driver(name: str, email: str, password: str, license_no: str):
     sql = text("""
         SELECT * FROM signup_driver(:p_name, :p_email, :p_password, :p_license_no)
@@ -249,6 +285,7 @@ def signup_driver(name: str, email: str, password: str, license_no: str):
 
 
 # ---------- DRIVER LOGIN HELPER ----------
+@timed("db")
 def login_driver(email: str, password: str):
     """
     Calls the login_driver stored procedure in the database.
@@ -268,6 +305,7 @@ def login_driver(email: str, password: str):
         return dict(row._mapping), row.msg, True
     return None, "Invalid email or password", False
 
+@timed("db")
 def get_pending_rides(driver_id: int):
     """
     Calls the stored procedure get_pending_rides to fetch pending rides for a driver.
@@ -280,6 +318,7 @@ def get_pending_rides(driver_id: int):
     # Convert SQLAlchemy Row objects to dictionaries
     return [dict(r._mapping) for r in rows]
 
+@timed("db")
 def accept_ride_proc(driver_id: int, ride_id: int):
     """
     Calls the accept_ride stored procedure.
@@ -294,6 +333,7 @@ def accept_ride_proc(driver_id: int, ride_id: int):
     return False, "Unknown error occurred"
 
 
+@timed("db")
 def reject_ride_proc(driver_id: int, ride_id: int):
     """
     Calls the reject_ride stored procedure.
@@ -308,6 +348,7 @@ def reject_ride_proc(driver_id: int, ride_id: int):
     return False, "Unknown error occurred"
 
 
+@timed("db")
 def update_driver_and_ride_location(driver_id: int, ride_id: int, lat: float, lon: float):
     """
     Updates driver's location and the ride's current location in DB.
@@ -319,6 +360,7 @@ def update_driver_and_ride_location(driver_id: int, ride_id: int, lat: float, lo
                 UPDATE driver
                 SET "Latitude" = :lat,
                     "Longitude" = :lon,
+                    online = true,
                     last_updated = NOW()
                 WHERE driver_id = :driver_id
             """),
@@ -339,6 +381,7 @@ def update_driver_and_ride_location(driver_id: int, ride_id: int, lat: float, lo
 
     return True
 
+@timed("db")
 def start_ride_db(ride_id: int):
     sql = text("SELECT start_ride(:rid) AS msg;")
 
@@ -348,6 +391,7 @@ def start_ride_db(ride_id: int):
             return True, result.msg
         return False, "Database error"
 
+@timed("db")
 def add_feedback_db(ride_id: int, user_id: int, rating: int, comment: str):
     sql = text("SELECT add_ride_feedback(:ride_id, :user_id, :rating, :comment) AS msg;")
     try:
@@ -362,6 +406,7 @@ def add_feedback_db(ride_id: int, user_id: int, rating: int, comment: str):
     except Exception as e:
         return False, str(e)
 
+@timed("db")
 def get_user_profile(user_id: int):
     """
     Fetch a user's profile from the database.
@@ -375,6 +420,7 @@ def get_user_profile(user_id: int):
         return dict(row._mapping), True
     return None, False
 
+@timed("db")
 def get_driver_profile(driver_id: int):
     """
     Fetch a driver's profile from the database.
@@ -388,6 +434,7 @@ def get_driver_profile(driver_id: int):
         return dict(row._mapping), True
     return None, False
 
+@timed("db")
 def get_vehicle_by_driver_id(driver_id: int):
     """
     Get vehicle information for a specific driver
@@ -416,6 +463,7 @@ def get_vehicle_by_driver_id(driver_id: int):
     
     return None
 
+@timed("db")
 def create_vehicle(vehicle_data: dict):
     """
     Create a new vehicle for a driver
@@ -452,6 +500,7 @@ def create_vehicle(vehicle_data: dict):
             return False, "Vehicle already exists for this driver", None
         return False, f"Database error: {error_msg}", None
     
+@timed("db")
 def update_vehicle(driver_id: int, vehicle_data: dict):
     """
     Update vehicle information for a driver
@@ -488,6 +537,7 @@ def update_vehicle(driver_id: int, vehicle_data: dict):
     except Exception as e:
         return False, f"Database error: {str(e)}", None
     
+@timed("db")
 def update_driver_discount(driver_id: int, discount: float):
     """
     Update discount percentage for a driver
@@ -521,6 +571,7 @@ def update_driver_discount(driver_id: int, discount: float):
     except Exception as e:
         return False, f"Database error: {str(e)}"
     
+@timed("db")
 def start_ride_transaction(ride_id, driver_id):
     """
     Call the SQL transaction to start a ride.
@@ -563,12 +614,22 @@ def start_ride_transaction(ride_id, driver_id):
             
     except Exception as e:
         db.session.rollback()
-        print(f"Error in start_ride_transaction: {e}")
+        log.exception("Error in start_ride_transaction", extra={"ride_id": ride_id})
         return False, f"Database error: {str(e)}"
     
 
-def get_available_drivers():
-    """Get all available drivers with their current locations"""
+@timed("db")
+def get_available_drivers(pickup=None, limit=None, radius_m=None):
+    """
+    Get available drivers with their current locations.
+
+    With pickup=(lat, lon) only the `limit` nearest idle drivers within
+    radius_m metres are returned, nearest first, using the GiST index from
+    sql/driver_location_gist.sql. Without it, every idle driver is returned.
+    """
+    if pickup is not None:
+        return _nearest_available_drivers(pickup, limit, radius_m)
+
     from models import Driver, Vehicle
     
     drivers = db.session.query(
@@ -582,8 +643,182 @@ def get_available_drivers():
         Vehicle.vehicle_no.label('vehicle_number')
     ).outerjoin(Vehicle, Driver.driver_id == Vehicle.driver_id)\
      .filter(Driver.is_active == False)\
+     .filter(Driver.online == True)\
      .filter(Driver.Latitude.isnot(None))\
      .filter(Driver.Longitude.isnot(None))\
      .all()
     
-    return [dict(row._mapping) for row in drivers]
\ No newline at end of file
+    return [dict(row._mapping) for row in drivers]
+
+def _nearest_available_drivers(pickup, limit, radius_m):
+    # KNN first, then the vehicle join, so LIMIT applies to drivers. The
+    # radius is only added when set so the planner sees a plain ST_DWithin.
+    within = "AND ST_DWithin(location, p.pt, :radius)" if radius_m is not None else ""
+    sql = text(f"""
+        SELECT d.driver_id, d.name, d.rating_avg,
+               d."Latitude" AS "Latitude", d."Longitude" AS "Longitude",
+               d.acceptance_probablity,
+               v.type AS vehicle_type, v.vehicle_no AS vehicle_number
+        FROM (
+            SELECT driver_id, name, rating_avg, "Latitude", "Longitude",
+                   acceptance_probablity,
+                   location <-> p.pt AS distance_m
+            FROM public.driver,
+                 (SELECT ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography AS pt) p
+            WHERE is_active = false
+              AND online = true
+              AND location IS NOT NULL
+              {within}
+            ORDER BY location <-> p.pt
+            LIMIT :limit
+        ) d
+        LEFT JOIN public.vehicle v ON v.driver_id = d.driver_id
+        ORDER BY d.distance_m
+    """)
+    params = {"lat": pickup[0], "lon": pickup[1], "radius": radius_m, "limit": limit}
+    with engine.begin() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [dict(row._mapping) for row in rows]
+
+@timed("db")
+def get_idle_drivers_by_ids(driver_ids):
+    """
+    Dispatch columns (as get_available_drivers) for the given drivers,
+    skipping any the database no longer has as idle. Returns {driver_id: row}
+    """
+    driver_ids = [int(d) for d in driver_ids]
+    if not driver_ids:
+        return {}
+
+    sql = text("""
+        SELECT d.driver_id, d.name, d.rating_avg,
+               d."Latitude" AS "Latitude", d."Longitude" AS "Longitude",
+               d.acceptance_probablity,
+               v.type AS vehicle_type, v.vehicle_no AS vehicle_number
+        FROM public.driver d
+        LEFT JOIN public.vehicle v ON v.driver_id = d.driver_id
+        WHERE d.driver_id = ANY(:ids)
+          AND d.is_active = false
+          AND d.online = true
+    """)
+    with engine.begin() as conn:
+        rows = conn.execute(sql, {"ids": driver_ids}).fetchall()
+    return {row.driver_id: dict(row._mapping) for row in rows}
+
+@timed("db")
+def set_drivers_offline(driver_ids, silence_seconds):
+    """
+    Mark the given drivers, and any online driver without a location update
+    in silence_seconds, offline. Returns the ids that changed.
+    """
+    sql = text("""
+        UPDATE public.driver
+        SET online = false
+        WHERE online = true
+          AND (driver_id = ANY(:ids)
+               OR last_updated < NOW() - make_interval(secs => :silence))
+        RETURNING driver_id
+    """)
+    with engine.begin() as conn:
+        rows = conn.execute(sql, {"ids": [int(d) for d in driver_ids], "silence": silence_seconds}).fetchall()
+    return [row.driver_id for row in rows]
+
+@timed("db")
+def get_driver_stats(driver_ids):
+    """
+    Fetch the trigger-maintained driver_stats rows for the given drivers.
+    One primary-key lookup per driver; drivers without a row are omitted.
+    Returns {driver_id: stats_dict}
+    """
+    driver_ids = [int(d) for d in driver_ids]
+    if not driver_ids:
+        return {}
+
+    sql = text("""
+        SELECT driver_id, total_rides, accepted_rides, completed_rides,
+               cancelled_rides, rejected_rides, avg_fare, avg_rating
+        FROM public.driver_stats
+        WHERE driver_id = ANY(:ids)
+    """)
+    with engine.begin() as conn:
+        rows = conn.execute(sql, {"ids": driver_ids}).fetchall()
+
+    return {row.driver_id: dict(row._mapping) for row in rows}
+
+WEATHER_COLUMNS = ("ride_id", "checked_at", "temperature", "wind_speed", "visibility",
+                   "humidity", "weather_code", "condition", "is_safe")
+# Rows per INSERT statement; 9 params each stays well under Postgres' 65535 limit
+WEATHER_INSERT_CHUNK = 1000
+
+@timed("db")
+def insert_weather_checks(rows):
+    """
+    Bulk-insert weather check records (dicts keyed by WEATHER_COLUMNS) with
+    multi-row INSERTs in one transaction. Rows already present (same ride_id
+    and checked_at, e.g. from a retried flush) are skipped.
+    Returns the number of rows inserted.
+    """
+    inserted = 0
+    with engine.begin() as conn:
+        for start in range(0, len(rows), WEATHER_INSERT_CHUNK):
+            chunk = rows[start:start + WEATHER_INSERT_CHUNK]
+            values, params = [], {}
+            for i, row in enumerate(chunk):
+                values.append("(" + ", ".join(f":{col}_{i}" for col in WEATHER_COLUMNS) + ")")
+                for col in WEATHER_COLUMNS:
+                    params[f"{col}_{i}"] = row.get(col)
+            sql = text(f"""
+                INSERT INTO public.weather ({", ".join(WEATHER_COLUMNS)})
+                VALUES {", ".join(values)}
+                ON CONFLICT (ride_id, checked_at) DO NOTHING
+            """)
+            inserted += conn.execute(sql, params).rowcount
+    return inserted
+
+@timed("db")
+def run_weather_maintenance(keep_months: int, months_ahead: int, cell_deg: float):
+    """
+    Create upcoming weather partitions, roll recent hours into weather_hourly
+    and drop expired months (sql/weather_partitioning.sql).
+    Returns the summary dict from public.weather_maintenance().
+    """
+    sql = text("SELECT public.weather_maintenance(:keep, :ahead, 3, :cell) AS summary")
+    with engine.begin() as conn:
+        return conn.execute(sql, {"keep": keep_months, "ahead": months_ahead, "cell": cell_deg}).scalar()
+
+@timed("db")
+def get_weather_hourly(start, end, min_lat=None, min_lon=None, max_lat=None, max_lon=None, limit=5000):
+    """
+    Hourly per-cell weather rollups in [start, end), optionally within a
+    bounding box, oldest first.
+    """
+    sql = text("""
+        SELECT cell_lat, cell_lon, hour, checks, unsafe_checks, rides,
+               completed_rides, cancelled_rides, avg_temperature,
+               max_wind_speed, min_visibility, avg_humidity
+        FROM public.weather_hourly
+        WHERE hour >= :start AND hour < :end
+          AND (CAST(:min_lat AS double precision) IS NULL OR cell_lat >= :min_lat)
+          AND (CAST(:max_lat AS double precision) IS NULL OR cell_lat <= :max_lat)
+          AND (CAST(:min_lon AS double precision) IS NULL OR cell_lon >= :min_lon)
+          AND (CAST(:max_lon AS double precision) IS NULL OR cell_lon <= :max_lon)
+        ORDER BY hour, cell_lat, cell_lon
+        LIMIT :limit
+    """)
+    params = {"start": start, "end": end, "min_lat": min_lat, "max_lat": max_lat,
+              "min_lon": min_lon, "max_lon": max_lon, "limit": limit}
+    with engine.begin() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [dict(row._mapping) for row in rows]
+
+@timed("db")
+def get_ride_trace(ride_id: int):
+    """The stored ride_trace row for the ride as a dict, or None"""
+    sql = text("""
+        SELECT ride_id, points, started_at, ended_at, trace
+        FROM public.ride_trace
+        WHERE ride_id = :r
+    """)
+    with engine.begin() as conn:
+        row = conn.execute(sql, {"r": ride_id}).fetchone()
+    return dict(row._mapping) if row else None
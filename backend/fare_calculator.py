@@ -1,7 +1,50 @@
+import numpy as np
+
+
 class FareCalculator:
-    def __init__(self, base=100, per_km=30, per_min=2, surge=1.0):
+    def __init__(self, base=100, per_km=30, per_min=2, surge=1.0, surge_engine=None):
         self.base, self.per_km, self.per_min, self.surge = base, per_km, per_min, surge
+        self.surge_engine = surge_engine
+
+    def surge_at(self, pickup=None):
+        """Flat surge times the live multiplier for the pickup cell, if any"""
+        if pickup is None or self.surge_engine is None:
+            return self.surge
+        return self.surge * self.surge_engine.multiplier(*pickup)
+
+    def _fare(self, distance_km, duration_min, surge, discount):
+        # Shared by compute and compute_many so both run the same float64
+        # operations in the same order
+        return (self.base + self.per_km*distance_km + self.per_min*duration_min) * surge * (1 - discount/100)
 
-    def compute(self, distance_km, duration_min):
-        fare = (self.base + self.per_km*distance_km + self.per_min*duration_min) * self.surge
+    def compute(self, distance_km, duration_min, pickup=None, discount=0):
+        """
+        pickup: optional (lat, lon) to apply the zone's surge multiplier
+        discount: percentage (0-100) taken off the fare
+        """
+        fare = self._fare(distance_km, duration_min, self.surge_at(pickup), discount)
         return round(fare, 2)
+
+    def compute_many(self, distance_km, duration_min, surge=None, discount=None):
+        """
+        Vectorized compute over arrays of trips; returns a float64 array.
+
+        surge is the total multiplier per row (scalar or array, default the
+        flat self.surge); discount is a percentage per row (default 0).
+        Results are bit-identical to compute(): np.round scales by 100 and
+        can land on the wrong side of a half-cent tie, so the few rows that
+        are within rounding error of a tie are re-rounded with round().
+        """
+        distance_km = np.asarray(distance_km, dtype=np.float64)
+        duration_min = np.asarray(duration_min, dtype=np.float64)
+        surge = self.surge if surge is None else np.asarray(surge, dtype=np.float64)
+        discount = 0 if discount is None else np.asarray(discount, dtype=np.float64)
+
+        fares = np.asarray(self._fare(distance_km, duration_min, surge, discount), dtype=np.float64)
+        rounded = np.round(fares, 2)
+
+        scaled = fares * 100
+        near_tie = np.abs(scaled - np.floor(scaled) - 0.5) <= np.abs(scaled) * 1e-12 + 1e-12
+        for i in np.flatnonzero(near_tie):
+            rounded.flat[i] = round(float(fares.flat[i]), 2)
+        return rounded
@@ -0,0 +1,129 @@
+"""
+Structured, non-blocking logging for the backend.
+
+Call configure_logging() once at startup, then use module loggers:
+
+    log = logging.getLogger(__name__)
+    log.info("ride accepted", extra={"ride_id": 19, "driver_id": 1})
+
+Records are rendered as one JSON object per line (LOG_FORMAT=text for a
+human-readable console while developing). Handlers only put the record on a
+queue; formatting and the stdout write happen in a native OS thread, so a slow
+console or pipe never blocks the eventlet hub.
+
+High-frequency events can be sampled by passing a rate:
+
+    log.debug("location ping", extra={"sample_rate": 0.01, "driver_id": 1})
+
+Roughly that fraction of the records is kept and each one carries the rate,
+so counts can be scaled back up downstream.
+"""
+
+import os
+import sys
+import json
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+from eventlet import patcher
+
+# The listener must run on a real thread with a real queue, even after
+# eventlet.monkey_patch(), or the blocking write would land back on the hub
+_native_threading = patcher.original("threading")
+_native_queue = patcher.original("queue")
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with extra= fields as top-level keys"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a record with probability record.sample_rate (default: always)"""
+
+    def filter(self, record):
+        rate = getattr(record, "sample_rate", None)
+        return rate is None or rate >= 1 or random.random() < rate
+
+
+class _EagerQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that renders the message on the calling thread.
+    Arguments are merged into msg so mutable objects logged by reference
+    can't change before the listener formats them; exc_info is kept for
+    the formatter.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class _NativeQueueListener(logging.handlers.QueueListener):
+    def start(self):
+        self._thread = _native_threading.Thread(target=self._monitor, name="log-writer", daemon=True)
+        self._thread.start()
+
+
+def configure_logging(level=None, fmt=None, stream=None):
+    """Install the queue handler on the root logger (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or LOG_LEVEL).upper()
+    fmt = fmt or LOG_FORMAT
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == "text":
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(name)s: %(message)s"))
+    else:
+        output.setFormatter(JsonFormatter())
+
+    queue = _native_queue.SimpleQueue()
+    handler = _EagerQueueHandler(queue)
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # Per-request access lines from werkzeug/engineio stay at WARNING
+    for name in ("werkzeug", "engineio.server", "socketio.server"):
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+    _listener = _NativeQueueListener(queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records; safe to call more than once"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
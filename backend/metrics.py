@@ -0,0 +1,304 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+
+Histograms use fixed buckets and a per-series list of counters, so recording a
+sample is a bisect plus two additions under a lock (a few microseconds). Everything is kept
+per worker process; scrape each worker, or aggregate in Prometheus.
+
+    from metrics import timed, track, record_cache
+
+    @timed("db")                       # latency of every call, labelled by function name
+    def get_pending_rides(...): ...
+
+    with track("ors", "directions"):   # ad-hoc block
+        requests.get(...)
+
+    record_cache("route", hit=True)
+"""
+
+import time
+import inspect
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+import redis
+
+# Seconds; spans sub-millisecond Redis calls up to slow upstream APIs
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            yield self.name, _labels(self.labelnames, labelvalues), value
+
+
+class Gauge:
+    """Gauge that is either set directly or read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._values = {}
+        self._functions = {}
+
+    def set(self, value, *labelvalues):
+        self._values[labelvalues] = value
+
+    def set_function(self, fn, *labelvalues):
+        self._functions[labelvalues] = fn
+
+    def samples(self):
+        values = dict(self._values)
+        for labelvalues, fn in list(self._functions.items()):
+            try:
+                values[labelvalues] = fn()
+            except Exception:
+                continue
+        for labelvalues, value in values.items():
+            yield self.name, _labels(self.labelnames, labelvalues), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # labelvalues -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        bounds = self.buckets + (float("inf"),)
+        for labelvalues, series in items:
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                yield (f"{self.name}_bucket",
+                       _labels(self.labelnames, labelvalues, f'le="{_number(bound)}"'),
+                       cumulative)
+            yield f"{self.name}_sum", _labels(self.labelnames, labelvalues), series[-1]
+            yield f"{self.name}_count", _labels(self.labelnames, labelvalues), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        """Prometheus text exposition format 0.0.4"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Flask request latency by route",
+    ("method", "route", "status"))
+SOCKET_LATENCY = REGISTRY.histogram(
+    "socketio_event_duration_seconds", "Socket.IO event handler latency",
+    ("event",))
+SOCKET_ERRORS = REGISTRY.counter(
+    "socketio_event_errors_total", "Socket.IO handlers that raised",
+    ("event",))
+DEPENDENCY_LATENCY = REGISTRY.histogram(
+    "dependency_duration_seconds", "Latency of db.py calls, upstream APIs, Redis and the model",
+    ("dependency", "operation"))
+DEPENDENCY_ERRORS = REGISTRY.counter(
+    "dependency_errors_total", "Dependency calls that raised",
+    ("dependency", "operation"))
+POOL_WAIT = REGISTRY.histogram(
+    "db_pool_wait_seconds", "Time to check a connection out of the SQLAlchemy pool",
+    ("pool",))
+POOL_CHECKED_OUT = REGISTRY.gauge(
+    "db_pool_checked_out", "Connections currently checked out of the pool",
+    ("pool",))
+CACHE_REQUESTS = REGISTRY.counter(
+    "cache_requests_total", "Cache lookups by outcome",
+    ("cache", "result"))
+
+
+class track:
+    """Context manager timing a block as a dependency call"""
+    __slots__ = ("dependency", "operation", "start")
+
+    def __init__(self, dependency, operation):
+        self.dependency, self.operation = dependency, operation
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        DEPENDENCY_LATENCY.observe(time.perf_counter() - self.start, self.dependency, self.operation)
+        if exc_type is not None:
+            DEPENDENCY_ERRORS.inc(self.dependency, self.operation)
+        return False
+
+
+def timed(dependency, operation=None):
+    """Decorator recording each call's latency; operation defaults to the function name"""
+    def decorator(fn):
+        op = operation or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with track(dependency, op):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_cache(cache, hit, count=1):
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss", amount=count)
+
+
+def instrument_flask(app):
+    """Record per-route latency for every request"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_latency(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - start,
+                                 request.method, route, response.status_code)
+        return response
+
+
+def accepting_args(handler):
+    """
+    handler, made to accept the event arguments. Flask-SocketIO passes connect
+    handlers the auth payload and retries without it after a TypeError; a
+    wrapper around a zero-argument handler drops the arguments up front
+    instead, so the failed first call isn't recorded as an error.
+    """
+    if inspect.signature(inspect.unwrap(handler)).parameters:
+        return handler
+    return lambda *args, **kwargs: handler()
+
+
+def instrument_socketio(socketio):
+    """Time every handler registered through socketio.on from now on"""
+    register = socketio.on
+
+    def on(message, namespace=None):
+        add_handler = register(message, namespace)
+
+        def decorator(handler):
+            call = accepting_args(handler)
+
+            @wraps(handler)
+            def timed_handler(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return call(*args, **kwargs)
+                except Exception:
+                    SOCKET_ERRORS.inc(message)
+                    raise
+                finally:
+                    SOCKET_LATENCY.observe(time.perf_counter() - start, message)
+            add_handler(timed_handler)
+            return handler
+        return decorator
+
+    socketio.on = on
+
+
+def instrument_pool(engine, name):
+    """Measure connection checkout time and expose checked-out connections"""
+    pool = engine.pool
+    checkout = pool.connect
+
+    def timed_checkout():
+        start = time.perf_counter()
+        try:
+            return checkout()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start, name)
+
+    pool.connect = timed_checkout
+    if hasattr(pool, "checkedout"):
+        POOL_CHECKED_OUT.set_function(pool.checkedout, name)
+
+
+class InstrumentedRedis(redis.Redis):
+    """redis.Redis that times every command"""
+
+    def execute_command(self, *args, **options):
+        with track("redis", str(args[0]).lower()):
+            return super().execute_command(*args, **options)
+
+
+def render():
+    return REGISTRY.render()
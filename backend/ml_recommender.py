@@ -6,43 +6,84 @@ Adapted for PostgreSQL/Supabase with Flask-SQLAlchemy
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import GradientBoostingClassifier
-from sklearn.model_selection import train_test_split
 import joblib
 import math
+import copy
 from datetime import datetime
 import os
+import logging
+
+from metrics import track
+
+log = logging.getLogger(__name__)
+
+
+# Ride statuses used as training labels
+TRAINING_STATUSES = ['accepted', 'rejected', 'completed', 'cancelled']
+POSITIVE_STATUSES = ['accepted', 'completed']
+POSITIVE_STATUS_CODES = [TRAINING_STATUSES.index(s) for s in POSITIVE_STATUSES]
+
+MODEL_PATH = os.path.join("models", "driver_recommender.pkl")
+
+# Rides fetched per round trip when streaming the training extract
+TRAINING_CHUNK_SIZE = int(os.getenv("TRAINING_CHUNK_SIZE", "5000"))
+
+# Trees added per incremental retrain, and the ensemble size that forces a full refit
+INCREMENTAL_ESTIMATORS = int(os.getenv("INCREMENTAL_ESTIMATORS", "10"))
+MAX_MODEL_ESTIMATORS = int(os.getenv("MAX_MODEL_ESTIMATORS", "200"))
+
+# Most recent rides held out of a full fit (at most a fifth of the extract).
+# The full fit is tested on them, and incremental fits are validated on the
+# same rides until the next full fit
+HOLDOUT_SIZE = int(os.getenv("MODEL_HOLDOUT_SIZE", "500"))
+
+# Column layout of the training extract (status is an index into TRAINING_STATUSES)
+TRAINING_COLUMNS = [
+    ('ride_id', np.int64),
+    ('driver_id', np.int64),
+    ('pickup_latitude', np.float64),
+    ('pickup_longitude', np.float64),
+    ('drop_latitude', np.float64),
+    ('drop_longitude', np.float64),
+    ('fare', np.float64),
+    ('distance_km', np.float64),
+    ('status', np.int8),
+    ('driver_rating', np.float64),
+]
 
 
 class DriverRecommender:
-    def __init__(self):
+    def __init__(self, autoload=True):
       self.model = None
       self.driver_stats = {}
       self.feature_names = []
+      self.high_water_mark = None   # last ride folded into the model
+      self.holdout = None           # ride columns held out for validation
 
-      model_path = os.path.join("models", "driver_recommender.pkl")
+      model_path = MODEL_PATH
 
     # Auto-load model if exists
-      if os.path.exists(model_path):
+      if autoload and os.path.exists(model_path):
         try:
             self.load_model(model_path)
-            print("✓ ML Model Loaded Successfully")
+            log.info("ML model loaded")
         except Exception as e:
-            print("⚠ Model file corrupted — retraining required.")
+            log.warning("Model file corrupted — retraining required: %s", e)
             self.model = None
-      else:
-        print("⚠ No model found. It will be trained automatically on first request.")
+      elif autoload:
+        log.warning("No model found. It will be trained automatically on first request.")
 
     def ensure_model_trained(self, db):
       """Automatically train the model if missing."""
       if self.model is None:
-        print("⚠ Model not trained — training now...")
+        log.warning("Model not trained — training now")
         result = self.train_from_database(db)
 
         if not result["success"]:
-            print("❌ Auto-training failed:", result["message"])
+            log.error("Auto-training failed: %s", result["message"])
             return False
 
-        print("✓ Model trained automatically.")
+        log.info("Model trained automatically")
         return True
 
       return True
@@ -60,64 +101,86 @@ class DriverRecommender:
 
         return R * c
 
-    def train_from_database(self, db):
-        """Train model using historical ride data from PostgreSQL"""
-        print("=" * 60)
-        print("TRAINING ML MODEL FROM DATABASE")
-        print("=" * 60)
+    def train_from_database(self, db, snapshot_path=None, use_snapshot=False):
+        """
+        Train model using historical ride data from PostgreSQL.
 
-        from models import Ride, Driver
+        Rides are streamed in chunks into column arrays (see load_training_rides).
+        If snapshot_path is given the extract is written there; with use_snapshot
+        an existing snapshot is reused instead of querying the database again.
+        """
+        log.info("Training ML model from database")
 
-        # Load rides with accepted/rejected/completed status
-        rides = db.session.query(
-            Ride.ride_id,
-            Ride.user_id,
-            Ride.driver_id,
-            Ride.pickup_latitude,
-            Ride.pickup_longitude,
-            Ride.drop_latitude,
-            Ride.drop_longitude,
-            Ride.fare,
-            Ride.distance_km,
-            Ride.status,
-            Ride.ride_date,
-            Driver.rating_avg.label('driver_rating')
-        ).join(Driver, Ride.driver_id == Driver.driver_id) \
-            .filter(Ride.status.in_(['accepted', 'rejected', 'completed', 'cancelled'])) \
-            .filter(Ride.driver_id.isnot(None)) \
-            .all()
+        rides = self.load_training_extract(db, snapshot_path, use_snapshot)
+        result = self.fit_from_rides(rides)
+
+        if result['success']:
+            self.save_model(MODEL_PATH)
+            log.info("Model saved to %s", MODEL_PATH)
+
+        return result
+
+    def train_incremental(self, db):
+        """
+        Fold rides added since the last training run into the model.
+        Falls back to a full train_from_database when there is no model or
+        high-water mark yet, or when the ensemble has grown too large.
+        """
+        if not self.can_train_incremental():
+            return self.train_from_database(db)
+
+        rides = self.load_training_rides(db, after_ride_id=self.high_water_mark['ride_id'])
+        result = self.update_from_rides(rides)
+
+        if result['success'] and result['new_rides']:
+            self.save_model(MODEL_PATH)
+            log.info("Model saved to %s", MODEL_PATH)
+
+        return result
 
-        if not rides or len(rides) < 3:
+    def can_train_incremental(self):
+        return (
+            self.model is not None
+            and self.high_water_mark is not None
+            and self.holdout is not None
+            and len(self.holdout['ride_id']) > 0
+            and self.model.n_estimators + INCREMENTAL_ESTIMATORS <= MAX_MODEL_ESTIMATORS
+        )
+
+    def load_training_extract(self, db, snapshot_path=None, use_snapshot=False):
+        """Load the training rides from a snapshot or the database"""
+        if use_snapshot and snapshot_path and os.path.exists(snapshot_path):
+            rides = self.load_training_snapshot(snapshot_path)
+            log.info("Loaded training snapshot from %s", snapshot_path)
+        else:
+            rides = self.load_training_rides(db)
+            if snapshot_path:
+                self.save_training_snapshot(rides, snapshot_path)
+                log.info("Training snapshot saved to %s", snapshot_path)
+        return rides
+
+    def fit_from_rides(self, rides):
+        """
+        Fit the model on a training extract. Does not touch the database or disk,
+        so it can run in a worker thread (see training_jobs.py).
+        """
+        num_rides = len(rides['ride_id'])
+        if num_rides < 3:
             return {
                 'success': False,
-                'message': f'Insufficient training data. Need at least 10 rides with driver assignments, found {len(rides) if rides else 0}'
+                'message': f'Insufficient training data. Need at least 10 rides with driver assignments, found {num_rides}'
             }
 
-        # Convert to DataFrame
-        rides_df = pd.DataFrame([{
-            'ride_id': r.ride_id,
-            'user_id': r.user_id,
-            'driver_id': r.driver_id,
-            'pickup_latitude': r.pickup_latitude,
-            'pickup_longitude': r.pickup_longitude,
-            'drop_latitude': r.drop_latitude,
-            'drop_longitude': r.drop_longitude,
-            'fare': float(r.fare) if r.fare else 0,
-            'distance_km': r.distance_km or 0,
-            'status': r.status,
-            'ride_date': r.ride_date,
-            'driver_rating': r.driver_rating or 3.0
-        } for r in rides])
-
-        print(f"✓ Loaded {len(rides_df)} historical rides")
+        log.debug("Loaded %d historical rides", num_rides)
 
         # Calculate driver statistics
-        self.driver_stats = self._calculate_driver_stats(rides_df)
-        print(f"✓ Calculated stats for {len(self.driver_stats)} drivers")
+        self.driver_stats = self._calculate_driver_stats(rides)
+        self.high_water_mark = self._high_water_mark(rides)
+        log.debug("Calculated stats for %d drivers", len(self.driver_stats))
 
         # Prepare training data
-        X, y = self._prepare_training_data(rides_df)
-        print(f"✓ Prepared {len(X)} training examples")
+        X, y = self._prepare_training_data(rides)
+        log.debug("Prepared %d training examples", len(X))
 
         if len(X) < 3:
             return {
@@ -125,14 +188,16 @@ class DriverRecommender:
                 'message': 'Not enough valid training examples'
             }
 
-        # Split data
-        test_size = 0.0 if len(X) < 5 else min(0.2, 5 / len(X)) # At least 5 samples for test, or 20%
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=test_size, random_state=42
-        )
+        # Hold out the newest rides (the extract is ordered by ride_id)
+        num_test = 0 if len(X) < 5 else min(HOLDOUT_SIZE, len(X) // 5)
+        split = len(X) - num_test
+        X_train, X_test, y_train, y_test = X.iloc[:split], X.iloc[split:], y[:split], y[split:]
+        if len(np.unique(y_train)) < 2:
+            X_train, y_train = X, y
+        self.holdout = self._recent_rides(rides, num_test)
 
         # Train model
-        print("✓ Training Gradient Boosting model...")
+        log.debug("Training Gradient Boosting model")
         self.model = GradientBoostingClassifier(
             n_estimators=50,
             learning_rate=0.1,
@@ -145,119 +210,321 @@ class DriverRecommender:
         train_acc = self.model.score(X_train, y_train)
         test_acc = self.model.score(X_test, y_test) if len(X_test) > 0 else train_acc
 
-        print(f"\n{'=' * 60}")
-        print(f"MODEL PERFORMANCE:")
-        print(f"{'=' * 60}")
-        print(f"Training Accuracy: {train_acc:.3f}")
-        print(f"Test Accuracy: {test_acc:.3f}")
-        print(f"Total samples: {len(X)}")
-
-        # Save model
-        os.makedirs('models', exist_ok=True)
-        self.save_model('models/driver_recommender.pkl')
-        print(f"\n✓ Model saved to models/driver_recommender.pkl")
+        log.info("Model trained: train accuracy %.3f, test accuracy %.3f, %d samples",
+                 train_acc, test_acc, len(X))
 
         return {
             'success': True,
             'train_accuracy': float(train_acc),
             'test_accuracy': float(test_acc),
             'training_samples': len(X),
+            'holdout_samples': num_test,
             'num_drivers': len(self.driver_stats)
         }
 
-    def _calculate_driver_stats(self, rides_df):
+    def update_from_rides(self, rides):
+        """
+        Warm-start the existing model on rides newer than the high-water mark.
+
+        Driver stats are folded incrementally and INCREMENTAL_ESTIMATORS trees are
+        boosted on top of the current ensemble using all of the new rides, so the
+        cost is proportional to the new data. A batch is usually too small to
+        split, so test accuracy is measured on the holdout kept by the last full
+        fit. Rides below the mark that reach a terminal status later are only
+        picked up by the next full retrain.
+        """
+        num_new = len(rides['ride_id'])
+        result = {
+            'success': True,
+            'incremental': True,
+            'new_rides': num_new,
+            'refitted': False,
+            'num_drivers': len(self.driver_stats)
+        }
+        if num_new == 0:
+            log.info("No new rides since last training")
+            return result
+
+        self.driver_stats = self._merge_driver_stats(
+            self.driver_stats, self._calculate_driver_stats(rides)
+        )
+        self.high_water_mark = self._high_water_mark(rides)
+        result['num_drivers'] = len(self.driver_stats)
+        log.debug("Folded %d new rides into driver stats", num_new)
+
+        X, y = self._prepare_training_data(rides)
+
+        # Boosting a binary model needs both labels in the batch
+        if len(X) < 3 or len(np.unique(y)) < 2:
+            log.info("Not enough labelled variety in new rides — stats updated only")
+            return result
+
+        self.model.set_params(
+            warm_start=True,
+            n_estimators=self.model.n_estimators + INCREMENTAL_ESTIMATORS
+        )
+        self.model.fit(X, y)
+
+        train_acc = self.model.score(X, y)
+        X_test, y_test = self._prepare_training_data(self.holdout)
+        test_acc = self.model.score(X_test, y_test)
+        log.info("Added %d trees (%d total), test accuracy %.3f",
+                 INCREMENTAL_ESTIMATORS, self.model.n_estimators, test_acc)
+
+        result.update({
+            'refitted': True,
+            'train_accuracy': float(train_acc),
+            'test_accuracy': float(test_acc),
+            'training_samples': len(X),
+            'holdout_samples': len(X_test)
+        })
+        return result
+
+    def clone(self):
+        """Independent copy of the trained state, safe to warm-start off-line"""
+        other = DriverRecommender(autoload=False)
+        other.model = copy.deepcopy(self.model)
+        other.driver_stats = copy.deepcopy(self.driver_stats)
+        other.feature_names = list(self.feature_names)
+        other.high_water_mark = copy.copy(self.high_water_mark)
+        other.holdout = self.holdout
+        return other
+
+    def adopt(self, other):
+        """
+        Take over the trained state of another recommender.
+        The attributes are reassigned without yielding, so under eventlet no
+        request greenlet can observe a half-swapped model.
+        """
+        self.model, self.driver_stats, self.feature_names, self.high_water_mark, self.holdout = \
+            other.model, other.driver_stats, other.feature_names, other.high_water_mark, other.holdout
+
+    def load_training_rides(self, db, chunk_size=TRAINING_CHUNK_SIZE, after_ride_id=None):
+        """
+        Stream rides with a terminal status from the database into column arrays.
+
+        Uses a server-side cursor (yield_per) so only one chunk of ORM rows is
+        alive at a time; the arrays are preallocated from a COUNT(*) and grown
+        only if rides arrive while the extract is running.
+        With after_ride_id only rides newer than that id are read.
+        Returns dict of column name -> numpy array (see TRAINING_COLUMNS).
+        """
+        from models import Ride, Driver
+        from sqlalchemy import select, func
+
+        filters = (
+            Ride.status.in_(TRAINING_STATUSES),
+            Ride.driver_id.isnot(None),
+        )
+        if after_ride_id is not None:
+            filters += (Ride.ride_id > after_ride_id,)
+
+        total = db.session.execute(
+            select(func.count(Ride.ride_id))
+            .join(Driver, Ride.driver_id == Driver.driver_id)
+            .where(*filters)
+        ).scalar() or 0
+
+        columns = {name: np.empty(total, dtype=dtype) for name, dtype in TRAINING_COLUMNS}
+
+        stmt = select(
+            Ride.ride_id,
+            Ride.driver_id,
+            Ride.pickup_latitude,
+            Ride.pickup_longitude,
+            Ride.drop_latitude,
+            Ride.drop_longitude,
+            Ride.fare,
+            Ride.distance_km,
+            Ride.status,
+            Driver.rating_avg.label('driver_rating')
+        ).join(Driver, Ride.driver_id == Driver.driver_id) \
+            .where(*filters) \
+            .order_by(Ride.ride_id)
+
+        status_codes = {status: code for code, status in enumerate(TRAINING_STATUSES)}
+        filled = 0
+
+        result = db.session.execute(stmt, execution_options={'yield_per': chunk_size})
+        for rows in result.partitions():
+            n = len(rows)
+            if filled + n > len(columns['ride_id']):
+                # Rides committed after the count; grow instead of failing
+                grow = max(n, chunk_size)
+                for name, dtype in TRAINING_COLUMNS:
+                    columns[name] = np.concatenate([columns[name], np.empty(grow, dtype=dtype)])
+
+            window = slice(filled, filled + n)
+            columns['ride_id'][window] = [r.ride_id for r in rows]
+            columns['driver_id'][window] = [r.driver_id for r in rows]
+            columns['pickup_latitude'][window] = np.array([r.pickup_latitude for r in rows], dtype=np.float64)
+            columns['pickup_longitude'][window] = np.array([r.pickup_longitude for r in rows], dtype=np.float64)
+            columns['drop_latitude'][window] = np.array([r.drop_latitude for r in rows], dtype=np.float64)
+            columns['drop_longitude'][window] = np.array([r.drop_longitude for r in rows], dtype=np.float64)
+            columns['fare'][window] = [float(r.fare) if r.fare else 0 for r in rows]
+            columns['distance_km'][window] = [r.distance_km or 0 for r in rows]
+            columns['status'][window] = [status_codes[r.status] for r in rows]
+            columns['driver_rating'][window] = [r.driver_rating or 3.0 for r in rows]
+            filled += n
+
+        return {name: values[:filled] for name, values in columns.items()}
+
+    def save_training_snapshot(self, rides, filepath):
+        """Write a training extract to disk so repeat runs can skip the database"""
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez(filepath, **rides)
+
+    def load_training_snapshot(self, filepath):
+        """Load a training extract written by save_training_snapshot"""
+        with np.load(filepath) as data:
+            return {name: data[name] for name, _ in TRAINING_COLUMNS}
+
+    def _calculate_driver_stats(self, rides):
         """Calculate driver acceptance rates"""
+        driver_ids, inverse = np.unique(rides['driver_id'], return_inverse=True)
+
+        # Count accepted and completed as positive
+        positive = np.isin(rides['status'], POSITIVE_STATUS_CODES)
+        totals = np.bincount(inverse, minlength=len(driver_ids))
+        accepted = np.bincount(inverse, weights=positive, minlength=len(driver_ids))
+        fare_sums = np.bincount(inverse, weights=rides['fare'], minlength=len(driver_ids))
+
         stats = {}
+        for i, driver_id in enumerate(driver_ids):
+            total = int(totals[i])
+            stats[int(driver_id)] = {
+                'acceptance_rate': accepted[i] / total if total > 0 else 0.5,
+                'total_rides': total,
+                'avg_fare': fare_sums[i] / total if total > 0 else 0,
+                'accepted_rides': int(accepted[i]),
+                'fare_sum': float(fare_sums[i])
+            }
 
-        for driver_id in rides_df['driver_id'].unique():
-            driver_rides = rides_df[rides_df['driver_id'] == driver_id]
+        return stats
 
-            total = len(driver_rides)
-            # Count accepted and completed as positive
-            accepted = len(driver_rides[driver_rides['status'].isin(['accepted', 'completed'])])
-            acceptance_rate = accepted / total if total > 0 else 0.5
+    def _merge_driver_stats(self, stats, new_stats):
+        """Fold stats computed over new rides into existing per-driver stats"""
+        merged = dict(stats)
+        for driver_id, new in new_stats.items():
+            old = stats.get(driver_id)
+            if not old:
+                merged[driver_id] = new
+                continue
 
-            # Average fare
-            avg_fare = driver_rides['fare'].mean()
+            # Models saved before incremental training only kept the ratios
+            old_accepted = old.get('accepted_rides', round(old['acceptance_rate'] * old['total_rides']))
+            old_fare_sum = old.get('fare_sum', old['avg_fare'] * old['total_rides'])
 
-            stats[driver_id] = {
-                'acceptance_rate': acceptance_rate,
+            total = old['total_rides'] + new['total_rides']
+            accepted = old_accepted + new['accepted_rides']
+            fare_sum = old_fare_sum + new['fare_sum']
+            merged[driver_id] = {
+                'acceptance_rate': accepted / total if total > 0 else 0.5,
                 'total_rides': total,
-                'avg_fare': avg_fare
+                'avg_fare': fare_sum / total if total > 0 else 0,
+                'accepted_rides': accepted,
+                'fare_sum': fare_sum
             }
+        return merged
 
-        return stats
+    def _high_water_mark(self, rides):
+        return {
+            'ride_id': int(rides['ride_id'].max()),
+            'trained_at': datetime.now().isoformat()
+        }
 
-    def _prepare_training_data(self, rides_df):
-        """Extract features and labels"""
-        X_list = []
-        y_list = []
+    def _valid_rides(self, rides):
+        """Mask of rides with the coordinates needed for features"""
+        return ~(np.isnan(rides['pickup_latitude']) | np.isnan(rides['pickup_longitude']))
 
-        for _, ride in rides_df.iterrows():
-            # Skip if missing critical data
-            if pd.isna(ride['pickup_latitude']) or pd.isna(ride['pickup_longitude']):
-                continue
+    def _recent_rides(self, rides, n):
+        """Columns of the n newest valid rides, i.e. the rows behind the last n rows of X"""
+        rows = np.flatnonzero(self._valid_rides(rides))
+        rows = rows[len(rows) - n:]
+        return {name: values[rows] for name, values in rides.items()}
 
-            features = self._extract_features_from_ride(ride)
-            X_list.append(features)
+    def _prepare_training_data(self, rides):
+        """Extract features and labels"""
+        # Skip if missing critical data
+        valid = self._valid_rides(rides)
+        rides = {name: values[valid] for name, values in rides.items()}
 
-            # Label: 1 if accepted/completed, 0 if rejected/cancelled
-            label = 1 if ride['status'] in ['accepted', 'completed'] else 0
-            y_list.append(label)
+        X = self._extract_features(rides)
 
-        X = pd.DataFrame(X_list)
-        y = np.array(y_list)
+        # Label: 1 if accepted/completed, 0 if rejected/cancelled
+        y = np.isin(rides['status'], POSITIVE_STATUS_CODES).astype(int)
 
         self.feature_names = X.columns.tolist()
         return X, y
 
-    def _extract_features_from_ride(self, ride):
-        """Extract features from a ride record"""
-        driver_id = ride['driver_id']
-        stats = self.driver_stats.get(driver_id, {
-            'acceptance_rate': 0.5,
-            'total_rides': 0,
-            'avg_fare': 0
-        })
+    def _extract_features(self, rides):
+        """Extract feature columns from ride arrays"""
+        default = {'acceptance_rate': 0.5, 'total_rides': 0, 'avg_fare': 0}
+        stats = [self.driver_stats.get(int(d), default) for d in rides['driver_id']]
 
         # Calculate distance if not available
-        distance = ride['distance_km']
-        if distance == 0 or pd.isna(distance):
-            if not pd.isna(ride['drop_latitude']) and not pd.isna(ride['drop_longitude']):
-                distance = self.haversine_distance(
-                    ride['pickup_latitude'], ride['pickup_longitude'],
-                    ride['drop_latitude'], ride['drop_longitude']
-                )
+        distance = rides['distance_km'].copy()
+        missing = (distance == 0) | np.isnan(distance)
+        missing &= ~(np.isnan(rides['drop_latitude']) | np.isnan(rides['drop_longitude']))
+        if missing.any():
+            distance[missing] = self._haversine_vector(
+                rides['pickup_latitude'][missing], rides['pickup_longitude'][missing],
+                rides['drop_latitude'][missing], rides['drop_longitude'][missing]
+            )
 
-        fare = ride['fare'] if ride['fare'] > 0 else 100
+        fare = np.where(rides['fare'] > 0, rides['fare'], 100)
 
-        return {
+        return pd.DataFrame({
             'fare': fare,
             'distance_km': distance,
-            'fare_per_km': fare / max(distance, 0.1),
-            'driver_rating': ride['driver_rating'],
-            'driver_acceptance_rate': stats['acceptance_rate'],
-            'driver_total_rides': stats['total_rides']
-        }
+            'fare_per_km': fare / np.maximum(distance, 0.1),
+            'driver_rating': rides['driver_rating'],
+            'driver_acceptance_rate': np.array([s['acceptance_rate'] for s in stats], dtype=np.float64),
+            'driver_total_rides': np.array([s['total_rides'] for s in stats], dtype=np.int64)
+        })
+
+    def _haversine_vector(self, lat1, lon1, lat2, lon2):
+        """Array version of haversine_distance"""
+        R = 6371  # Earth's radius in km
+
+        lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+        dlat = lat2 - lat1
+        dlon = lon2 - lon1
+
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+        c = 2 * np.arcsin(np.sqrt(a))
+
+        return R * c
 
     # Replace the recommend_drivers method in your ml_recommender.py
 
-    def recommend_drivers(self, pickup_lat, pickup_lon, available_drivers_df, db=None):
+    def recommend_drivers(self, pickup_lat, pickup_lon, available_drivers_df, db=None, live_stats=None,
+                          pickup_distances_km=None):
         """
-        Recommend drivers based on ML predictions
+        Recommend drivers based on ML predictions.
+        live_stats ({driver_id: row} from db.get_driver_stats) takes precedence
+        over the driver stats frozen into the model at training time.
+        pickup_distances_km (one per row, e.g. road distances from
+        RouteService.get_matrix) replaces the straight-line distance to the
+        pickup; NaN entries fall back to it.
         """
         if self.model is None:
             if db is not None:
                 trained = self.ensure_model_trained(db)
                 if not trained:
-                    print("❌ Cannot recommend drivers — model cannot be trained yet")
+                    log.error("Cannot recommend drivers — model cannot be trained yet")
                     return []
             else:
-                print("❌ Model not trained and no database connection provided")
+                log.error("Model not trained and no database connection provided")
                 return []
 
+        # Snapshot the trained state so a concurrent hot-swap can't mix models
+        model, driver_stats, feature_names = self.model, self.driver_stats, self.feature_names
+
         if available_drivers_df.empty:
-            print("⚠ No drivers in DataFrame")
+            log.debug("No drivers in DataFrame")
             return []
 
         # ✅ FIX: Use correct column names (case-sensitive)
@@ -267,18 +534,26 @@ class DriverRecommender:
                 row['Latitude'], row['Longitude']  # ✅ Capital L
             ), axis=1
         )
+        if pickup_distances_km is not None:
+            road = np.asarray(pickup_distances_km, dtype=np.float64)
+            available_drivers_df['distance_to_pickup'] = np.where(
+                np.isnan(road), available_drivers_df['distance_to_pickup'], road
+            )
 
-        print(f"✓ Calculated distances for {len(available_drivers_df)} drivers")
+        log.debug("Calculated distances for %d drivers", len(available_drivers_df))
 
         # Prepare features for prediction
         features_list = []
         for _, driver in available_drivers_df.iterrows():
             driver_id = driver['driver_id']
-            stats = self.driver_stats.get(driver_id, {
-                'acceptance_rate': driver.get('acceptance_probablity', 0.5),
-                'total_rides': 10,
-                'avg_fare': 200
-            })
+            if live_stats and live_stats.get(driver_id, {}).get('total_rides'):
+                stats = self._stats_from_row(live_stats[driver_id])
+            else:
+                stats = driver_stats.get(driver_id, {
+                    'acceptance_rate': driver.get('acceptance_probablity', 0.5),
+                    'total_rides': 10,
+                    'avg_fare': 200
+                })
 
             # Estimate fare based on distance
             estimated_distance = driver['distance_to_pickup'] * 2
@@ -295,15 +570,16 @@ class DriverRecommender:
             features_list.append(features)
 
         # Create feature DataFrame
-        X = pd.DataFrame(features_list)[self.feature_names]
+        X = pd.DataFrame(features_list)[feature_names]
         if X.empty:
-            print("⚠ No features generated")
+            log.debug("No features generated")
             return []
 
         # Predict acceptance probability
-        acceptance_probs = self.model.predict_proba(X)[:, 1]
+        with track("model", "predict_proba"):
+            acceptance_probs = model.predict_proba(X)[:, 1]
 
-        print(f"✓ Predicted acceptance probabilities: {acceptance_probs[:3]}")
+        log.debug("Predicted acceptance probabilities: %s", acceptance_probs[:3])
 
         # Calculate final score
         max_distance = available_drivers_df['distance_to_pickup'].max()
@@ -330,34 +606,42 @@ class DriverRecommender:
         # Sort by score
         recommended = available_drivers_df.sort_values('recommendation_score', ascending=False)
 
-        print(f"✓ Top 3 scores: {recommended['recommendation_score'].head(3).tolist()}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Top 3 scores: %s", recommended['recommendation_score'].head(3).tolist())
 
-        return recommended[[
+        columns = [
             'driver_id', 'name', 'rating_avg', 'distance_to_pickup',
             'ml_acceptance_probability', 'recommendation_score',
             'vehicle_type', 'vehicle_number'
-        ]].to_dict('records')
+        ]
+        if 'pickup_eta_min' in recommended:
+            columns.append('pickup_eta_min')
+        return recommended[columns].to_dict('records')
+
+    def _stats_from_row(self, row):
+        """Convert a driver_stats table row into the model's stats dict"""
+        total = row['total_rides']
+        return {
+            'acceptance_rate': row['accepted_rides'] / total if total > 0 else 0.5,
+            'total_rides': total,
+            'avg_fare': float(row['avg_fare'] or 0)
+        }
 
     def update_driver_acceptance_probability(self, db, driver_id):
         """
         Update driver's acceptance probability after a ride decision
         This is called after accept/reject to update the DB
         """
-        from models import Ride, Driver
-        from sqlalchemy import func
+        from models import Driver, DriverStats
 
-        # Get driver's ride history
-        rides = db.session.query(Ride).filter(
-            Ride.driver_id == driver_id,
-            Ride.status.in_(['accepted', 'completed', 'rejected', 'cancelled'])
-        ).all()
+        # Counters are kept current by triggers on ride (sql/driver_stats.sql)
+        stats = db.session.get(DriverStats, driver_id)
 
-        if len(rides) == 0:
+        if stats is None or stats.total_rides == 0:
             return 0.5  # Default
 
         # Calculate acceptance rate
-        accepted = sum(1 for r in rides if r.status in ['accepted', 'completed'])
-        acceptance_rate = accepted / len(rides)
+        acceptance_rate = stats.accepted_rides / stats.total_rides
 
         # Update in database
         driver = db.session.query(Driver).filter(Driver.driver_id == driver_id).first()
@@ -374,10 +658,15 @@ class DriverRecommender:
 
     def save_model(self, filepath):
         """Save model to disk"""
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
         joblib.dump({
             'model': self.model,
             'driver_stats': self.driver_stats,
-            'feature_names': self.feature_names
+            'feature_names': self.feature_names,
+            'high_water_mark': self.high_water_mark,
+            'holdout': self.holdout
         }, filepath)
 
     def load_model(self, filepath):
@@ -386,3 +675,6 @@ class DriverRecommender:
         self.model = data['model']
         self.driver_stats = data['driver_stats']
         self.feature_names = data['feature_names']
+        self.high_water_mark = data.get('high_water_mark')
+        # Models saved without one get it back from the next full fit
+        self.holdout = data.get('holdout')
@@ -16,6 +16,8 @@ class Driver(db.Model):
     acceptance_probablity = db.Column(db.Float, default=0.5)
 
     discount = db.Column(db.Float, default=0.0)
+    # Heartbeat-maintained, see presence.py and sql/driver_presence.sql
+    online = db.Column(db.Boolean, default=False, server_default=db.false(), nullable=False)
 
     last_updated = db.Column(
         db.DateTime,
@@ -89,4 +91,20 @@ class Weather(db.Model):
     is_safe = db.Column(db.Boolean, default=True)
     
     # Relationship to Ride (weak entity relationship)
-    ride = db.relationship('Ride', backref='weather_checks')
\ No newline at end of file
+    ride = db.relationship('Ride', backref='weather_checks')
+
+class DriverStats(db.Model):
+    """Per-driver ride counters maintained by triggers (see sql/driver_stats.sql)"""
+    __tablename__ = 'driver_stats'
+    driver_id       = db.Column(db.Integer, db.ForeignKey('driver.driver_id', ondelete='CASCADE'), primary_key=True)
+    total_rides     = db.Column(db.Integer, nullable=False, default=0)
+    accepted_rides  = db.Column(db.Integer, nullable=False, default=0)
+    completed_rides = db.Column(db.Integer, nullable=False, default=0)
+    cancelled_rides = db.Column(db.Integer, nullable=False, default=0)
+    rejected_rides  = db.Column(db.Integer, nullable=False, default=0)
+    fare_sum        = db.Column(db.Numeric(14,2), nullable=False, default=0)
+    rating_sum      = db.Column(db.Float, nullable=False, default=0)
+    rating_count    = db.Column(db.Integer, nullable=False, default=0)
+    avg_fare        = db.Column(db.Numeric(10,2), db.Computed('CASE WHEN total_rides > 0 THEN fare_sum / total_rides END'))
+    avg_rating      = db.Column(db.Float, db.Computed('CASE WHEN rating_count > 0 THEN rating_sum / rating_count END'))
+    updated_at      = db.Column(db.DateTime, server_default=func.now())
@@ -0,0 +1,194 @@
+"""
+Per-ride motion model for live tracking.
+
+Each ride in progress on this worker gets a constant-velocity Kalman
+filter, fed by driver_location_update. The filter runs in metres on a local
+tangent plane around the ride's first fix, with the east and north axes
+filtered independently (position, velocity). It gives us:
+
+  * smoothed positions: ride_location carries the filtered position instead
+    of the raw GPS fix, so jitter of a few metres no longer makes the car
+    hop around the passenger's map
+  * dead reckoning: between pings, InterpolationBroadcaster emits the
+    position predicted from the filtered velocity every
+    MOTION_BROADCAST_INTERVAL seconds, marked "predicted": true, for up to
+    MOTION_MAX_EXTRAPOLATION seconds after the last fix
+
+So maps stay smooth at the much lower ping rates ping_rate asks drivers for.
+A driver's socket stays on one worker, so the filter state is per-process.
+"""
+
+import os
+import math
+import time
+import logging
+import datetime
+
+import eventlet
+
+from metrics import REGISTRY
+from ping_rate import PING_INTERVAL_RIDE_MAX
+
+log = logging.getLogger(__name__)
+
+MOTION_GPS_SIGMA_M = float(os.getenv("MOTION_GPS_SIGMA_M", "8"))
+# How hard a car can plausibly accelerate or turn between pings
+MOTION_ACCEL_SIGMA = float(os.getenv("MOTION_ACCEL_SIGMA", "1"))
+MOTION_BROADCAST_INTERVAL = float(os.getenv("MOTION_BROADCAST_INTERVAL", "1"))
+# Stop predicting this long after the last fix; a little over the slowest ride ping rate
+MOTION_MAX_EXTRAPOLATION = float(os.getenv("MOTION_MAX_EXTRAPOLATION", str(PING_INTERVAL_RIDE_MAX * 1.5)))
+# A fix this far from the prediction restarts the track (GPS glitch, tunnel exit)
+MOTION_RESET_M = float(os.getenv("MOTION_RESET_M", "500"))
+# Rides not heard from in this long are dropped
+MOTION_TRACK_TTL = 600.0
+
+# Prior speed uncertainty for a new track, (m/s)^2
+INITIAL_SPEED_VAR = 15.0 ** 2
+M_PER_DEG = 111320.0
+
+MOTION_TRACKS = REGISTRY.gauge(
+    "motion_tracks", "Rides with a motion model on this worker")
+MOTION_PREDICTIONS = REGISTRY.counter(
+    "motion_predicted_broadcasts_total", "Dead-reckoned ride_location broadcasts between pings")
+MOTION_RESETS = REGISTRY.counter(
+    "motion_track_resets_total", "Tracks restarted after a fix far from the prediction")
+
+
+class _Axis:
+    """1-D constant-velocity Kalman filter: position, velocity and their covariance"""
+    __slots__ = ("pos", "vel", "p_pp", "p_pv", "p_vv")
+
+    def __init__(self, pos, pos_var):
+        self.pos, self.vel = pos, 0.0
+        self.p_pp, self.p_pv, self.p_vv = pos_var, 0.0, INITIAL_SPEED_VAR
+
+    def predict(self, dt, accel_var):
+        self.pos += self.vel * dt
+        # P = F P F' + Q, with Q for white-noise acceleration
+        self.p_pp += 2 * dt * self.p_pv + dt * dt * self.p_vv + accel_var * dt ** 4 / 4
+        self.p_pv += dt * self.p_vv + accel_var * dt ** 3 / 2
+        self.p_vv += accel_var * dt * dt
+
+    def update(self, z, meas_var):
+        s = self.p_pp + meas_var
+        k_pos, k_vel = self.p_pp / s, self.p_pv / s
+        residual = z - self.pos
+        self.pos += k_pos * residual
+        self.vel += k_vel * residual
+        self.p_vv -= k_vel * self.p_pv
+        self.p_pv *= 1 - k_pos
+        self.p_pp *= 1 - k_pos
+
+
+class Track:
+    def __init__(self, lat, lon, now, gps_var):
+        self.lat0, self.lon0 = lat, lon
+        self.m_per_deg_lon = M_PER_DEG * math.cos(math.radians(lat))
+        self.east = _Axis(0.0, gps_var)
+        self.north = _Axis(0.0, gps_var)
+        self.updated_at = now
+        self.broadcast_at = now
+
+    def to_local(self, lat, lon):
+        return (lon - self.lon0) * self.m_per_deg_lon, (lat - self.lat0) * M_PER_DEG
+
+    def to_latlon(self, east, north):
+        return self.lat0 + north / M_PER_DEG, self.lon0 + east / self.m_per_deg_lon
+
+    def position(self, now):
+        """Filtered position dead-reckoned to now, as (lat, lon)"""
+        dt = max(0.0, now - self.updated_at)
+        return self.to_latlon(self.east.pos + self.east.vel * dt,
+                              self.north.pos + self.north.vel * dt)
+
+
+class MotionTracker:
+    def __init__(self, gps_sigma_m=MOTION_GPS_SIGMA_M, accel_sigma=MOTION_ACCEL_SIGMA,
+                 max_extrapolation=MOTION_MAX_EXTRAPOLATION):
+        self.gps_var = gps_sigma_m ** 2
+        self.accel_var = accel_sigma ** 2
+        self.max_extrapolation = max_extrapolation
+        self.tracks = {}     # ride_id -> Track
+        MOTION_TRACKS.set_function(lambda: len(self.tracks))
+
+    def update(self, ride_id, lat, lon, now=None):
+        """Feed a ping; returns the smoothed (lat, lon) to broadcast"""
+        now = now or time.time()
+        track = self.tracks.get(ride_id)
+        if track is None or now - track.updated_at > MOTION_TRACK_TTL:
+            self.tracks[ride_id] = Track(lat, lon, now, self.gps_var)
+            return lat, lon
+
+        dt = max(0.0, now - track.updated_at)
+        east, north = track.to_local(lat, lon)
+        track.east.predict(dt, self.accel_var)
+        track.north.predict(dt, self.accel_var)
+        if math.hypot(east - track.east.pos, north - track.north.pos) > MOTION_RESET_M:
+            MOTION_RESETS.inc()
+            self.tracks[ride_id] = Track(lat, lon, now, self.gps_var)
+            return lat, lon
+
+        track.east.update(east, self.gps_var)
+        track.north.update(north, self.gps_var)
+        track.updated_at = track.broadcast_at = now
+        return track.to_latlon(track.east.pos, track.north.pos)
+
+    def predict(self, ride_id, now=None):
+        """Predicted (lat, lon) for the ride, or None if there is no recent fix"""
+        now = now or time.time()
+        track = self.tracks.get(ride_id)
+        if track is None or now - track.updated_at > self.max_extrapolation:
+            return None
+        return track.position(now)
+
+    def due(self, interval, now=None):
+        """(ride_id, lat, lon) for every track with nothing broadcast for interval seconds"""
+        now = now or time.time()
+        positions, expired = [], []
+        for ride_id, track in self.tracks.items():
+            since_fix = now - track.updated_at
+            if since_fix > MOTION_TRACK_TTL:
+                expired.append(ride_id)
+            elif since_fix <= self.max_extrapolation and now - track.broadcast_at >= interval:
+                track.broadcast_at = now
+                positions.append((ride_id, *track.position(now)))
+        for ride_id in expired:
+            del self.tracks[ride_id]
+        return positions
+
+    def forget(self, ride_id):
+        self.tracks.pop(ride_id, None)
+
+
+class InterpolationBroadcaster:
+    """Emits dead-reckoned ride_location updates between driver pings"""
+
+    def __init__(self, tracker, emit, interval=MOTION_BROADCAST_INTERVAL):
+        """emit(ride_id, payload) sends a ride_location event to the ride's room"""
+        self.tracker = tracker
+        self.emit = emit
+        self.interval = interval
+        self._worker = None
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        if self._worker is None or self._worker.dead:
+            self._worker = eventlet.spawn(self._run)
+
+    def _run(self):
+        while True:
+            try:
+                self.broadcast_once()
+            except Exception:
+                log.exception("Interpolated broadcast failed")
+            eventlet.sleep(self.interval)
+
+    def broadcast_once(self):
+        positions = self.tracker.due(self.interval)
+        timestamp = datetime.datetime.now().isoformat()
+        for ride_id, lat, lon in positions:
+            self.emit(ride_id, {"lat": lat, "lon": lon, "timestamp": timestamp, "predicted": True})
+        if positions:
+            MOTION_PREDICTIONS.inc(amount=len(positions))
+        return len(positions)
@@ -0,0 +1,144 @@
+"""
+Server-driven location ping intervals.
+
+Drivers used to ping at whatever rate their client picked. PingRatePolicy
+works out how often each driver should ping from what the server knows:
+
+  * ride state: idle drivers only need to stay online (the presence
+    heartbeat); drivers heading to a pickup or on a trip need tracking
+  * speed, from consecutive pings: the interval aims for a fix every
+    PING_SPACING_M metres, so a parked car pings slowly and a fast one
+    quickly
+  * distance to the pickup/drop: within PING_NEAR_TARGET_M the fastest
+    rate is used so arrival shows up promptly
+  * load: when this worker ingests more than PING_LOAD_TARGET pings/s,
+    every interval is stretched by the overshoot
+
+The result goes to the driver as a 'ping_interval' socket event, only when
+it moves by more than PING_CHANGE_RATIO from what the driver was last told.
+"""
+
+import os
+import math
+import time
+
+from metrics import REGISTRY
+
+PING_INTERVAL_MIN = float(os.getenv("PING_INTERVAL_MIN", "2"))
+# Slowest rate during a ride (stopped at a light, waiting at pickup)
+PING_INTERVAL_RIDE_MAX = float(os.getenv("PING_INTERVAL_RIDE_MAX", "10"))
+# Dead reckoning (motion_model) covers the gaps between fixes this far apart
+PING_SPACING_M = float(os.getenv("PING_SPACING_M", "120"))
+PING_NEAR_TARGET_M = float(os.getenv("PING_NEAR_TARGET_M", "300"))
+PING_LOAD_TARGET = float(os.getenv("PING_LOAD_TARGET", "500"))
+PING_CHANGE_RATIO = 0.2
+
+# Below this a driver is treated as stationary (GPS drift is a few m/s at most)
+STATIONARY_MPS = 1.0
+LOAD_WINDOW_SECONDS = 5.0
+# Drivers not heard from in this long are forgotten
+DRIVER_STATE_TTL = 600.0
+
+IDLE, TO_PICKUP, ON_TRIP = "idle", "to_pickup", "on_trip"
+
+PING_INTERVAL_PUSHES = REGISTRY.counter(
+    "ping_interval_pushes_total", "ping_interval events sent to drivers", ("state",))
+PING_INGEST_RATE = REGISTRY.gauge(
+    "ping_ingest_rate", "Location pings per second over the last load window")
+
+
+def _distance_m(a_lat, a_lon, b_lat, b_lon):
+    lat1, lon1, lat2, lon2 = map(math.radians, (a_lat, a_lon, b_lat, b_lon))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(h))
+
+
+class PingRatePolicy:
+    def __init__(self, idle_interval, idle_max):
+        """
+        idle_interval: presence heartbeat interval advertised to idle drivers
+        idle_max: longest idle interval allowed under load (keep it well
+        inside the presence TTL)
+        """
+        self.idle_interval = idle_interval
+        self.idle_max = idle_max
+
+        self._drivers = {}    # driver_id -> [lat, lon, seen_at, speed_mps, advertised]
+        self._window_start = time.time()
+        self._window_count = 0
+        self.ingest_rate = 0.0
+        PING_INGEST_RATE.set_function(lambda: self.ingest_rate)
+
+    def interval(self, state, speed_mps=None, distance_to_target_m=None):
+        """Recommended seconds between pings"""
+        load = max(1.0, self.ingest_rate / PING_LOAD_TARGET)
+        if state == IDLE:
+            return round(min(self.idle_interval * load, self.idle_max), 1)
+
+        if distance_to_target_m is not None and distance_to_target_m <= PING_NEAR_TARGET_M:
+            base = PING_INTERVAL_MIN
+        elif speed_mps is None or speed_mps < STATIONARY_MPS:
+            base = PING_INTERVAL_RIDE_MAX
+        else:
+            base = min(max(PING_SPACING_M / speed_mps, PING_INTERVAL_MIN), PING_INTERVAL_RIDE_MAX)
+        return round(min(base * load, PING_INTERVAL_RIDE_MAX * 2), 1)
+
+    def observe(self, driver_id, lat, lon, state, target=None, now=None):
+        """
+        Record a ping. Returns the interval to push to the driver, or None
+        if what they were last told is still close enough.
+        target: (lat, lon) of the pickup or drop the driver is heading to
+        """
+        now = now or time.time()
+        self.count(now)
+
+        entry = self._drivers.get(driver_id)
+        speed = None
+        if entry is not None and entry[0] is not None:
+            elapsed = now - entry[2]
+            if elapsed > 0:
+                speed = _distance_m(entry[0], entry[1], lat, lon) / elapsed
+                # Light smoothing so one noisy fix doesn't flip the rate
+                if entry[3] is not None:
+                    speed = 0.5 * speed + 0.5 * entry[3]
+
+        distance = _distance_m(lat, lon, *target) if target else None
+        interval = self.interval(state, speed, distance)
+
+        advertised = entry[4] if entry is not None else None
+        self._drivers[driver_id] = [lat, lon, now, speed, advertised]
+        if advertised is not None and abs(interval - advertised) <= advertised * PING_CHANGE_RATIO:
+            return None
+        return self.advertise(driver_id, state, interval)
+
+    def advertise(self, driver_id, state, interval=None):
+        """
+        Mark interval (default: the state's base rate) as sent and return it.
+        Going idle ends the ride's tracking, so the driver's state is dropped.
+        """
+        if interval is None:
+            interval = self.interval(state)
+        if state == IDLE:
+            self.forget(driver_id)
+        else:
+            entry = self._drivers.setdefault(driver_id, [None, None, time.time(), None, None])
+            entry[4] = interval
+        PING_INTERVAL_PUSHES.inc(state)
+        return interval
+
+    def forget(self, driver_id):
+        self._drivers.pop(driver_id, None)
+
+    def count(self, now=None):
+        """Count one ping towards the ingest rate (idle pings call this directly)"""
+        now = now or time.time()
+        self._window_count += 1
+        elapsed = now - self._window_start
+        if elapsed < LOAD_WINDOW_SECONDS:
+            return
+        self.ingest_rate = self._window_count / elapsed
+        self._window_start, self._window_count = now, 0
+        # Drop drivers that went quiet without completing or cancelling
+        stale = [d for d, entry in self._drivers.items() if now - entry[2] > DRIVER_STATE_TTL]
+        for driver_id in stale:
+            del self._drivers[driver_id]
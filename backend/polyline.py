@@ -0,0 +1,203 @@
+"""
+Route geometry simplification and compact encodings.
+
+Points are (lon, lat) pairs, the order ORS and RouteService use.
+
+Simplification, with the tolerance in metres (computed on a local
+equirectangular projection, exact enough at city scale):
+
+  * simplify_dp: Douglas-Peucker; every dropped point lies within
+    tolerance_m of the simplified line
+  * simplify_vw: Visvalingam-Whyatt; repeatedly drops the point whose
+    triangle with its neighbours has the smallest area, until every
+    remaining triangle is at least tolerance_m^2. An area threshold is
+    gentler than DP's distance one, so it keeps more points at the same
+    tolerance; it smooths small wiggles instead of cutting corners
+
+Encodings, both at 1e-5 degree precision (about a metre):
+
+  * encode/decode: Google encoded polyline text (lat, lon order as the
+    format specifies), for JSON payloads; Leaflet and the Maps SDKs
+    decode it directly
+  * pack/unpack: binary form for storage and caches: a version byte, the
+    point count, then the lat and lon columns as zigzag varint deltas
+    (the same varints as trip_trace)
+"""
+
+import heapq
+import math
+from itertools import accumulate
+
+import numpy as np
+
+from trip_trace import zigzag, unzigzag, write_varint, read_varints
+
+PACK_FORMAT_VERSION = 1
+PRECISION = 5
+M_PER_DEG = 111320.0
+
+
+def _to_metres(points):
+    """n x 2 array of (east, north) metres relative to the first point"""
+    xy = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    lon0, lat0 = xy[0]
+    return np.column_stack((
+        (xy[:, 0] - lon0) * M_PER_DEG * math.cos(math.radians(lat0)),
+        (xy[:, 1] - lat0) * M_PER_DEG,
+    ))
+
+
+def _segment_distances(p, a, b):
+    """Distance of each row of p to the segment a-b"""
+    ab = b - a
+    length2 = float(ab @ ab)
+    if length2 == 0.0:
+        return np.hypot(*(p - a).T)
+    t = np.clip((p - a) @ ab / length2, 0.0, 1.0)
+    return np.hypot(*(p - (a + t[:, None] * ab)).T)
+
+
+def simplify_dp(points, tolerance_m):
+    """Douglas-Peucker simplification; returns a sub-list of points"""
+    n = len(points)
+    if n < 3 or tolerance_m <= 0:
+        return list(points)
+    xy = _to_metres(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(xy[first + 1:last], xy[first], xy[last])
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance_m:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return [points[i] for i in np.flatnonzero(keep)]
+
+
+def simplify_vw(points, tolerance_m):
+    """Visvalingam-Whyatt simplification; returns a sub-list of points"""
+    n = len(points)
+    if n < 3 or tolerance_m <= 0:
+        return list(points)
+    xy = _to_metres(points).tolist()
+    min_area = tolerance_m ** 2
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    removed = [False] * n
+
+    def area(i):
+        (ax, ay), (bx, by), (cx, cy) = xy[prev[i]], xy[i], xy[nxt[i]]
+        return abs((bx - ax) * (cy - ay) - (cx - ax) * (by - ay)) / 2
+
+    areas = [math.inf] * n
+    heap = []
+    for i in range(1, n - 1):
+        areas[i] = area(i)
+        heap.append((areas[i], i))
+    heapq.heapify(heap)
+
+    while heap:
+        a, i = heapq.heappop(heap)
+        if removed[i] or a != areas[i]:
+            continue       # superseded by a recomputed area
+        if a >= min_area:
+            break
+        removed[i] = True
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        for j in (p, q):
+            if 0 < j < n - 1:
+                # A neighbour's area never drops below the one just removed,
+                # so points are eliminated in increasing order of area
+                areas[j] = max(area(j), a)
+                heapq.heappush(heap, (areas[j], j))
+    return [point for point, gone in zip(points, removed) if not gone]
+
+
+def simplify(points, tolerance_m, method="dp"):
+    if method == "dp":
+        return simplify_dp(points, tolerance_m)
+    if method == "vw":
+        return simplify_vw(points, tolerance_m)
+    raise ValueError(f"Unknown simplification method {method!r}")
+
+
+def _quantized(points):
+    scale = 10 ** PRECISION
+    return [(round(lat * scale), round(lon * scale)) for lon, lat in points]
+
+
+def encode(points):
+    """Google encoded polyline of (lon, lat) points"""
+    out = []
+    last_lat = last_lon = 0
+    for lat, lon in _quantized(points):
+        for delta in (lat - last_lat, lon - last_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        last_lat, last_lon = lat, lon
+    return "".join(out)
+
+
+def decode(text):
+    """[[lon, lat], ...] from a Google encoded polyline"""
+    scale = 10 ** PRECISION
+    values, value, shift = [], 0, 0
+    for char in text:
+        chunk = ord(char) - 63
+        if not 0 <= chunk < 64:
+            raise ValueError(f"Invalid polyline character {char!r}")
+        value |= (chunk & 0x1F) << shift
+        if chunk & 0x20:
+            shift += 5
+        else:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    if shift or len(values) % 2:
+        raise ValueError("Truncated polyline")
+
+    points, lat, lon = [], 0, 0
+    for i in range(0, len(values), 2):
+        lat += values[i]
+        lon += values[i + 1]
+        points.append([lon / scale, lat / scale])
+    return points
+
+
+def pack(points):
+    """Binary form of (lon, lat) points (see module docstring)"""
+    out = bytearray([PACK_FORMAT_VERSION])
+    quantized = _quantized(points)
+    write_varint(out, len(quantized))
+    for column in (0, 1):
+        last = 0
+        for point in quantized:
+            write_varint(out, zigzag(point[column] - last))
+            last = point[column]
+    return bytes(out)
+
+
+def unpack(blob):
+    """[[lon, lat], ...] from pack()"""
+    if not blob or blob[0] != PACK_FORMAT_VERSION:
+        raise ValueError("Not a packed polyline")
+    values = list(read_varints(blob[1:]))
+    count = values[0] if values else 0
+    if len(values) != 1 + 2 * count:
+        raise ValueError(f"Expected {count} points, got {len(values) - 1} values")
+
+    scale = 10 ** PRECISION
+    deltas = [unzigzag(v) for v in values[1:]]
+    lats = accumulate(deltas[:count])
+    lons = accumulate(deltas[count:])
+    return [[lon / scale, lat / scale] for lat, lon in zip(lats, lons)]
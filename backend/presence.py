@@ -0,0 +1,204 @@
+"""
+Shared driver presence in Redis.
+
+Every worker on every node sees the same presence state:
+
+  presence:idle       GEO set of idle drivers at their last ping
+  presence:busy       GEO set of drivers on a ride
+  presence:seen       sorted set of driver -> last heartbeat (unix time);
+                      the online set every availability lookup checks
+
+Drivers are told to send a heartbeat every PRESENCE_HEARTBEAT_INTERVAL
+seconds; after PRESENCE_TTL_SECONDS of silence they are offline. Idle pings
+(/driver/<id>/current_loc) and ride pings (driver_location_update) call
+heartbeat(). accept moves a driver to the busy set; complete and cancel
+move them back at the position they were last seen.
+
+Members of a sorted set can't expire on their own. nearest() checks the
+last-seen time of whatever GEOSEARCH returns, so a silent driver is never
+offered, and PresenceSweeper periodically removes silent drivers from every
+set with one range query and marks them offline in the database.
+
+Writes are best effort: a Redis hiccup is logged and never fails the ping or
+ride action that triggered it. nearest() raises redis errors so dispatch can
+fall back to the database.
+"""
+
+import os
+import time
+import logging
+from functools import wraps
+
+import redis
+import eventlet
+
+from metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+# Advertised to drivers; the TTL should allow a few missed heartbeats
+PRESENCE_HEARTBEAT_INTERVAL = int(os.getenv("PRESENCE_HEARTBEAT_INTERVAL", "20"))
+PRESENCE_TTL_SECONDS = int(os.getenv("PRESENCE_TTL_SECONDS", "90"))
+# 0 disables the sweeper
+PRESENCE_SWEEP_INTERVAL = float(os.getenv("PRESENCE_SWEEP_INTERVAL", "30"))
+
+IDLE_KEY = "presence:idle"
+BUSY_KEY = "presence:busy"
+SEEN_KEY = "presence:seen"
+
+PRESENCE_PRUNED = REGISTRY.counter(
+    "presence_pruned_total", "Silent drivers removed from the presence sets")
+PRESENCE_ERRORS = REGISTRY.counter(
+    "presence_errors_total", "Presence writes that failed", ("op",))
+PRESENCE_ONLINE = REGISTRY.gauge(
+    "presence_online_drivers", "Drivers with a heartbeat inside the TTL, as of the last sweep")
+
+
+def _best_effort(fn):
+    @wraps(fn)
+    def wrapper(self, driver_id, *args, **kwargs):
+        try:
+            return fn(self, driver_id, *args, **kwargs)
+        except redis.exceptions.RedisError as e:
+            PRESENCE_ERRORS.inc(fn.__name__)
+            log.warning("Presence %s failed: %s", fn.__name__, e,
+                        extra={"driver_id": driver_id, "sample_rate": 0.01})
+            return None
+    return wrapper
+
+
+class PresenceStore:
+    def __init__(self, redis_client, ttl=PRESENCE_TTL_SECONDS,
+                 heartbeat_interval=PRESENCE_HEARTBEAT_INTERVAL):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+
+    # ---------- writes ----------
+
+    @_best_effort
+    def heartbeat(self, driver_id, lat, lon, busy=False):
+        """Record a ping; busy pings come from drivers on a ride"""
+        member = str(driver_id)
+        target, other = (BUSY_KEY, IDLE_KEY) if busy else (IDLE_KEY, BUSY_KEY)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.geoadd(target, (lon, lat, member))
+        pipe.zrem(other, member)
+        pipe.zadd(SEEN_KEY, {member: time.time()})
+        pipe.execute()
+
+    @_best_effort
+    def mark_busy(self, driver_id):
+        self._move(str(driver_id), IDLE_KEY, BUSY_KEY)
+
+    @_best_effort
+    def mark_idle(self, driver_id):
+        self._move(str(driver_id), BUSY_KEY, IDLE_KEY)
+
+    @_best_effort
+    def remove(self, driver_id):
+        member = str(driver_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrem(IDLE_KEY, member)
+        pipe.zrem(BUSY_KEY, member)
+        pipe.zrem(SEEN_KEY, member)
+        pipe.execute()
+
+    def _move(self, member, source, target):
+        # A GEO set is a sorted set scored by geohash, so copying the score
+        # moves the driver without re-encoding their position
+        score = self.redis.zscore(source, member)
+        if score is None:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd(target, {member: score})
+        pipe.zrem(source, member)
+        pipe.execute()
+
+    # ---------- reads ----------
+
+    def nearest(self, lat, lon, radius_m, count):
+        """
+        Up to count idle drivers seen within the TTL and radius_m of
+        (lat, lon), nearest first, as (driver_id, distance_m, lat, lon).
+        """
+        results = self.redis.geosearch(
+            IDLE_KEY, longitude=lon, latitude=lat, radius=radius_m, unit="m",
+            sort="ASC", count=count, withdist=True, withcoord=True
+        )
+        if not results:
+            return []
+
+        cutoff = time.time() - self.ttl
+        seen = self.redis.zmscore(SEEN_KEY, [member for member, _, _ in results])
+
+        drivers, silent = [], []
+        for (member, dist, (m_lon, m_lat)), last_seen in zip(results, seen):
+            if last_seen is not None and last_seen >= cutoff:
+                drivers.append((int(member), float(dist), float(m_lat), float(m_lon)))
+            else:
+                silent.append(member)
+        if silent:
+            self.redis.zrem(IDLE_KEY, *silent)
+            PRESENCE_PRUNED.inc(amount=len(silent))
+        return drivers
+
+    def sweep(self, now=None):
+        """Drop drivers silent for longer than the TTL; returns their ids"""
+        cutoff = (now or time.time()) - self.ttl
+        silent = self.redis.zrangebyscore(SEEN_KEY, "-inf", f"({cutoff}")
+        pipe = self.redis.pipeline(transaction=False)
+        if silent:
+            pipe.zrem(IDLE_KEY, *silent)
+            pipe.zrem(BUSY_KEY, *silent)
+        # By score, so a driver who pinged since the range read survives;
+        # if they lost their GEO entry meanwhile, their next ping restores it
+        pipe.zremrangebyscore(SEEN_KEY, "-inf", f"({cutoff}")
+        pipe.zcard(SEEN_KEY)
+        online = pipe.execute()[-1]
+
+        PRESENCE_ONLINE.set(online)
+        if silent:
+            PRESENCE_PRUNED.inc(amount=len(silent))
+        return [int(member) for member in silent]
+
+
+class PresenceSweeper:
+    """
+    Every PRESENCE_SWEEP_INTERVAL seconds, remove silent drivers from the
+    presence sets and mark them offline in the database, along with any
+    driver whose last location update is older than the TTL (covers pings
+    that never reached Redis).
+    """
+
+    def __init__(self, presence, set_offline, interval=PRESENCE_SWEEP_INTERVAL):
+        """set_offline(driver_ids, silence_seconds) -> ids marked offline"""
+        self.presence = presence
+        self.set_offline = set_offline
+        self.interval = interval
+        self._worker = None
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        if self._worker is None or self._worker.dead:
+            self._worker = eventlet.spawn(self._run)
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep_once()
+            except Exception:
+                log.exception("Presence sweep failed")
+            eventlet.sleep(self.interval)
+
+    def sweep_once(self):
+        try:
+            silent = self.presence.sweep()
+        except redis.exceptions.RedisError as e:
+            log.warning("Presence sweep skipped Redis: %s", e)
+            silent = []
+        offline = self.set_offline(silent, self.presence.ttl)
+        if offline:
+            log.info("Marked %d silent drivers offline", len(offline))
+        return offline
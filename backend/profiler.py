@@ -0,0 +1,205 @@
+"""
+Opt-in sampling profiler for request and socket-event paths.
+
+A configurable fraction of Flask requests and Socket.IO events is profiled.
+While one is being profiled, interval timers deliver signals:
+
+  * SIGALRM (ITIMER_REAL, wall clock) samples the profiled greenlet's stack
+    whether or not it is running. When another greenlet holds the hub, the
+    stack is recorded with an "[off-cpu]" leaf, so time spent waiting on the
+    database, Redis or an upstream API shows up.
+  * SIGPROF (ITIMER_PROF, process CPU time) only records the stack when the
+    profiled greenlet itself is on the CPU.
+
+Samples are aggregated per endpoint ("POST /recommend_drivers",
+"socket driver_location_update") in Brendan Gregg's collapsed-stack format,
+which flamegraph.pl and speedscope read directly.
+
+Only one request is profiled at a time, since the process has one set of
+interval timers. Sampled requests that arrive while another is being
+profiled run unprofiled. With PROFILE_SAMPLE_RATE=0 (the default) no hooks
+are installed at all. The timers are process-wide, so nothing else in the
+process may use SIGALRM or SIGPROF while profiling is enabled.
+"""
+
+import os
+import random
+import signal
+import logging
+from collections import Counter
+from functools import wraps
+
+from greenlet import getcurrent
+
+from metrics import accepting_args
+
+log = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# Deepest stack recorded per sample, and distinct stacks kept per endpoint
+MAX_STACK_DEPTH = 64
+MAX_STACKS_PER_ENDPOINT = 5000
+
+MODES = ("wall", "cpu")
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _Session:
+    """Raw samples for the request currently being profiled"""
+    __slots__ = ("key", "greenlet", "samples")
+
+    def __init__(self, key, glet):
+        self.key = key
+        self.greenlet = glet
+        self.samples = []   # (mode, (code, ...) leaf first, off_cpu)
+
+    def add(self, mode, frame, off_cpu=False):
+        codes = []
+        while frame is not None and len(codes) < MAX_STACK_DEPTH:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        self.samples.append((mode, tuple(codes), off_cpu))
+
+
+class SamplingProfiler:
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, interval_ms=PROFILE_INTERVAL_MS):
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000.0
+        self.installed = False
+
+        self._session = None
+        self._stacks = {}     # (endpoint, mode) -> Counter(collapsed stack -> samples)
+        self._requests = Counter()   # endpoint -> profiled requests
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    # ---------- hooks ----------
+
+    def instrument(self, app, socketio):
+        """Install request/event hooks and signal handlers; no-op when disabled"""
+        if not self.enabled or self.installed:
+            return
+        try:
+            signal.signal(signal.SIGALRM, self._on_signal)
+            signal.signal(signal.SIGPROF, self._on_signal)
+        except ValueError:
+            # Not the interpreter's main thread; eventlet greenlets all run on it
+            log.warning("Profiler not installed: signal handlers need the main thread")
+            return
+        self._instrument_flask(app)
+        self._instrument_socketio(socketio)
+        self.installed = True
+        log.info("Sampling profiler enabled for %.1f%% of requests every %.1f ms",
+                 self.sample_rate * 100, self.interval * 1000)
+
+    def _instrument_flask(self, app):
+        from flask import g, request
+
+        @app.before_request
+        def _start_profile():
+            if random.random() < self.sample_rate:
+                rule = request.url_rule.rule if request.url_rule else "unmatched"
+                g._profiling = self.start(f"{request.method} {rule}")
+
+        @app.teardown_request
+        def _stop_profile(exc):
+            if g.pop("_profiling", False):
+                self.stop()
+
+    def _instrument_socketio(self, socketio):
+        register = socketio.on
+
+        def on(message, namespace=None):
+            add_handler = register(message, namespace)
+
+            def decorator(handler):
+                call = accepting_args(handler)
+
+                @wraps(handler)
+                def profiled_handler(*args, **kwargs):
+                    if random.random() >= self.sample_rate or not self.start(f"socket {message}"):
+                        return call(*args, **kwargs)
+                    try:
+                        return call(*args, **kwargs)
+                    finally:
+                        self.stop()
+                add_handler(profiled_handler)
+                return handler
+            return decorator
+
+        socketio.on = on
+
+    # ---------- sessions ----------
+
+    def start(self, key):
+        """Begin profiling the current greenlet; False if another profile is running"""
+        if self._session is not None:
+            return False
+        self._session = _Session(key, getcurrent())
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return True
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        session, self._session = self._session, None
+        if session is not None:
+            self._aggregate(session)
+
+    def _on_signal(self, signum, frame):
+        session = self._session
+        if session is None:
+            return
+        current = getcurrent()
+        if signum == signal.SIGPROF:
+            if current is session.greenlet:
+                session.add("cpu", frame)
+        elif current is session.greenlet:
+            session.add("wall", frame)
+        elif session.greenlet.gr_frame is not None:
+            session.add("wall", session.greenlet.gr_frame, off_cpu=True)
+
+    def _aggregate(self, session):
+        self._requests[session.key] += 1
+        for mode, codes, off_cpu in session.samples:
+            stacks = self._stacks.setdefault((session.key, mode), Counter())
+            collapsed = ";".join(_frame_name(code) for code in reversed(codes))
+            if off_cpu:
+                collapsed += ";[off-cpu]"
+            if collapsed not in stacks and len(stacks) >= MAX_STACKS_PER_ENDPOINT:
+                collapsed = "[truncated]"
+            stacks[collapsed] += 1
+
+    # ---------- reporting ----------
+
+    def summary(self):
+        """Per endpoint: profiled requests and samples per mode"""
+        endpoints = {}
+        for key, count in self._requests.items():
+            endpoints[key] = {
+                "requests": count,
+                **{f"{mode}_samples": sum(self._stacks.get((key, mode), {}).values()) for mode in MODES}
+            }
+        return {
+            "enabled": self.installed,
+            "sample_rate": self.sample_rate,
+            "interval_ms": self.interval * 1000,
+            "endpoints": endpoints
+        }
+
+    def collapsed(self, endpoint, mode="wall"):
+        """Collapsed stacks ("frame;frame;frame count" per line) for flamegraph tools"""
+        stacks = self._stacks.get((endpoint, mode), {})
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+    def reset(self):
+        self._stacks.clear()
+        self._requests.clear()
@@ -0,0 +1,140 @@
+"""
+Server-side fare quotes.
+
+/estimate_fare stores the computed route, fare and weather verdict in Redis
+under a random nonce and hands the client a signed quote id:
+
+    <nonce>.<HMAC-SHA256(secret, nonce:user_id)>
+
+/create_ride_request redeems the id instead of trusting client-supplied
+fare, distance and duration; it is the only way to book. The signature
+rejects forged or other users' ids without a Redis round trip, the quote
+itself never leaves the server, so it cannot be edited, and redeeming
+claims it atomically, so one quote books one ride. Repeated estimates for the same trip by
+the same user return the live quote instead of re-querying ORS and
+WeatherAPI.
+"""
+
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+
+from metrics import record_cache
+
+QUOTE_TTL_SECONDS = int(os.getenv("QUOTE_TTL_SECONDS", "300"))
+
+# Coordinates are rounded to ~1 m when matching a repeated estimate
+QUOTE_COORD_DECIMALS = 5
+
+
+class QuoteService:
+    def __init__(self, redis_client, route_service, fare_calc, weather_service,
+                 secret, ttl=QUOTE_TTL_SECONDS):
+        self.redis = redis_client
+        self.route_service = route_service
+        self.fare_calc = fare_calc
+        self.weather_service = weather_service
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.ttl = ttl
+
+    def quote(self, user_id, pickup_lat, pickup_lon, drop_lat, drop_lon):
+        """Return a quote dict (with quote_id) for this trip, reusing a live one"""
+        lookup_key = self._lookup_key(user_id, pickup_lat, pickup_lon, drop_lat, drop_lon)
+        quote_id = self.redis.get(lookup_key)
+        if quote_id:
+            cached = self._load(quote_id)
+            if cached is not None:
+                record_cache("fare_quote", hit=True)
+                return cached
+        record_cache("fare_quote", hit=False)
+
+        is_safe, alert_msg, weather_details = self.weather_service.check_weather_safety(
+            pickup_lat, pickup_lon
+        )
+        route = self.route_service.get_route(
+            (pickup_lon, pickup_lat),
+            (drop_lon, drop_lat)
+        )
+        distance_km, duration_min, _ = route
+        surge = self.fare_calc.surge_at((pickup_lat, pickup_lon))
+        fare = self.fare_calc.compute(distance_km, duration_min, pickup=(pickup_lat, pickup_lon))
+
+        nonce = secrets.token_urlsafe(12)
+        now = time.time()
+        quote = {
+            "quote_id": f"{nonce}.{self._sign(nonce, user_id)}",
+            "user_id": user_id,
+            "pickup_lat": pickup_lat,
+            "pickup_lon": pickup_lon,
+            "drop_lat": drop_lat,
+            "drop_lon": drop_lon,
+            "distance_km": distance_km,
+            "duration_min": duration_min,
+            "estimated_fare": fare,
+            "surge_multiplier": surge,
+            "route_stale": getattr(route, "stale", False),
+            "route_polyline": getattr(route, "polyline", None),
+            "weather_safe": is_safe,
+            "weather_alert": alert_msg,
+            "weather_details": weather_details,
+            "created_at": now,
+            "expires_at": now + self.ttl
+        }
+
+        pipe = self.redis.pipeline()
+        pipe.set(self._quote_key(nonce), json.dumps(quote), ex=self.ttl)
+        pipe.set(lookup_key, quote["quote_id"], ex=self.ttl)
+        pipe.execute()
+        return quote
+
+    def redeem(self, quote_id, user_id):
+        """
+        Claim a valid, unexpired quote issued to user_id: returns (quote, None)
+        and removes the quote, so an id books at most one ride even under
+        concurrent requests. Hand it back with restore() if the booking fails.
+        Returns (None, reason) otherwise.
+        """
+        if not isinstance(quote_id, str):
+            return None, "Invalid quote"
+        nonce, _, signature = quote_id.partition(".")
+        expected = self._sign(nonce, user_id)
+        if not nonce or not hmac.compare_digest(signature.encode(), expected.encode()):
+            return None, "Invalid quote"
+
+        # GETDEL: of two requests redeeming the same id only one gets the quote
+        raw = self.redis.getdel(self._quote_key(nonce))
+        if not raw:
+            return None, "Quote expired, please estimate the fare again"
+        quote = json.loads(raw)
+        if quote["user_id"] != user_id:
+            self.restore(quote)
+            return None, "Invalid quote"
+        return quote, None
+
+    def restore(self, quote):
+        """Put back a quote claimed by redeem() for a booking that failed"""
+        ttl = int(quote["expires_at"] - time.time())
+        if ttl > 0:
+            nonce = quote["quote_id"].partition(".")[0]
+            self.redis.set(self._quote_key(nonce), json.dumps(quote), ex=ttl, nx=True)
+
+    def _load(self, quote_id):
+        raw = self.redis.get(self._quote_key(quote_id.partition(".")[0]))
+        return json.loads(raw) if raw else None
+
+    def _sign(self, nonce, user_id):
+        digest = hmac.new(self.secret, f"{nonce}:{user_id}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    @staticmethod
+    def _quote_key(nonce):
+        return f"quote:{nonce}"
+
+    @staticmethod
+    def _lookup_key(user_id, *coords):
+        rounded = ",".join(f"{c:.{QUOTE_COORD_DECIMALS}f}" for c in coords)
+        return f"quote:trip:{user_id}:{rounded}"
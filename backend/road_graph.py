@@ -0,0 +1,406 @@
+"""
+In-process road graph for offline routing.
+
+The graph is built once from an OpenStreetMap XML extract of the city and
+stored as compact CSR arrays in an .npz file:
+
+    node_lat, node_lon   float64[N]   node coordinates
+    indptr               int32[N+1]   outgoing edges of node i are
+    indices              int32[E]       indices[indptr[i]:indptr[i+1]]
+    length_m             float32[E]   edge length
+    time_s               float32[E]   free-flow travel time
+
+Queries snap both points to the nearest node (cKDTree over a local
+equirectangular projection) and run A* on travel time, with straight-line
+distance at the network's top speed as the admissible heuristic.
+
+Build the file with:
+    python road_graph.py build karachi.osm models/road_graph.npz
+"""
+
+import os
+import sys
+import math
+import heapq
+import logging
+import argparse
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+
+log = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371000.0
+
+# Points further than this from any road node are rejected
+MAX_SNAP_M = float(os.getenv("ROUTING_MAX_SNAP_M", "2000"))
+# Speed assumed for the straight-line legs between a point and its snapped node
+ACCESS_SPEED_KMH = 15.0
+# matrix() stops each search at this travel time; pairs further apart are NaN.
+# Dispatch looks for drivers within DISPATCH_SEARCH_RADIUS_M (15 km), well
+# inside 45 minutes at city speeds
+MATRIX_MAX_TRIP_MIN = float(os.getenv("ROUTING_MATRIX_MAX_TRIP_MIN", "45"))
+# Searches per scipy call in matrix(); each returns two arrays over every node
+MATRIX_ROOT_CHUNK = 16
+
+# Default speeds (km/h) by OSM highway class, used when maxspeed is missing
+HIGHWAY_SPEEDS_KMH = {
+    "motorway": 90, "motorway_link": 50,
+    "trunk": 70, "trunk_link": 40,
+    "primary": 50, "primary_link": 35,
+    "secondary": 40, "secondary_link": 30,
+    "tertiary": 35, "tertiary_link": 25,
+    "unclassified": 30, "residential": 25,
+    "living_street": 10, "service": 15, "road": 25,
+}
+
+
+class RouteNotFound(ValueError):
+    """No drivable path between the points, or a point is off the network"""
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class RoadGraph:
+    def __init__(self, node_lat, node_lon, indptr, indices, length_m, time_s):
+        self.node_lat = np.asarray(node_lat, dtype=np.float64)
+        self.node_lon = np.asarray(node_lon, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int32)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.length_m = np.asarray(length_m, dtype=np.float32)
+        self.time_s = np.asarray(time_s, dtype=np.float32)
+
+        # Snapping: equirectangular projection around the graph's centre
+        self._lat0 = float(self.node_lat.mean()) if len(self.node_lat) else 0.0
+        self._kx = math.cos(math.radians(self._lat0))
+        self._tree = cKDTree(self._project(self.node_lat, self.node_lon))
+
+        # A* runs in pure Python; list indexing is much cheaper than numpy scalars
+        self._adj_ptr = self.indptr.tolist()
+        self._adj_to = self.indices.tolist()
+        self._adj_len = self.length_m.tolist()
+        self._adj_time = self.time_s.tolist()
+        self._lat_rad = np.radians(self.node_lat).tolist()
+        self._lon_rad = np.radians(self.node_lon).tolist()
+
+        speeds = self.length_m / np.maximum(self.time_s, 1e-3)
+        self.max_speed_ms = float(speeds.max()) if len(speeds) else 1.0
+        self._time_matrix = None
+        self._reverse_time_matrix = None
+
+    @property
+    def num_nodes(self):
+        return len(self.node_lat)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    # ---------- persistence ----------
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            graph = cls(data["node_lat"], data["node_lon"], data["indptr"],
+                        data["indices"], data["length_m"], data["time_s"])
+        log.info("Loaded road graph from %s: %d nodes, %d edges", path, graph.num_nodes, graph.num_edges)
+        return graph
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez_compressed(path, node_lat=self.node_lat, node_lon=self.node_lon,
+                            indptr=self.indptr, indices=self.indices,
+                            length_m=self.length_m, time_s=self.time_s)
+
+    @classmethod
+    def from_edges(cls, node_lat, node_lon, src, dst, length_m, time_s):
+        """Build CSR arrays from an edge list, keeping the largest strongly connected component"""
+        n = len(node_lat)
+        src, dst = np.asarray(src), np.asarray(dst)
+        adjacency = csr_matrix((np.ones(len(src), dtype=np.int8), (src, dst)), shape=(n, n))
+        _, labels = connected_components(adjacency, directed=True, connection="strong")
+        keep = labels == np.bincount(labels).argmax()
+
+        remap = np.full(n, -1, dtype=np.int64)
+        remap[keep] = np.arange(keep.sum())
+        edge_keep = keep[src] & keep[dst]
+        src, dst = remap[src[edge_keep]], remap[dst[edge_keep]]
+        length_m = np.asarray(length_m)[edge_keep]
+        time_s = np.asarray(time_s)[edge_keep]
+
+        order = np.lexsort((dst, src))
+        src, dst, length_m, time_s = src[order], dst[order], length_m[order], time_s[order]
+        indptr = np.zeros(int(keep.sum()) + 1, dtype=np.int64)
+        np.add.at(indptr, src + 1, 1)
+        return cls(np.asarray(node_lat)[keep], np.asarray(node_lon)[keep],
+                   np.cumsum(indptr), dst, length_m, time_s)
+
+    # ---------- queries ----------
+
+    def _project(self, lat, lon):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        return np.column_stack((np.radians(lon) * self._kx, np.radians(lat))) * EARTH_RADIUS_M
+
+    def snap(self, lat, lon):
+        """(node index, snap distance in metres) of the nearest road node"""
+        distance, node = self._tree.query(self._project([lat], [lon])[0])
+        return int(node), float(distance)
+
+    def snap_many(self, lats, lons):
+        distance, nodes = self._tree.query(self._project(lats, lons))
+        return nodes.astype(np.int64), distance
+
+    def route(self, start, end):
+        """
+        start/end: (lon, lat), matching RouteService.get_route.
+        Returns (distance_km, duration_min, [[lon, lat], ...]).
+        """
+        source, source_snap = self.snap(start[1], start[0])
+        target, target_snap = self.snap(end[1], end[0])
+        if max(source_snap, target_snap) > MAX_SNAP_M:
+            raise RouteNotFound("Point is too far from the road network")
+
+        path, length_m, time_s = self.astar(source, target)
+
+        access_m = source_snap + target_snap
+        distance_km = (length_m + access_m) / 1000
+        duration_min = time_s / 60 + (access_m / 1000) / ACCESS_SPEED_KMH * 60
+        coords = [[start[0], start[1]]]
+        coords += [[float(self.node_lon[i]), float(self.node_lat[i])] for i in path]
+        coords.append([end[0], end[1]])
+        return distance_km, duration_min, coords
+
+    def matrix(self, origins, destinations, max_trip_min=MATRIX_MAX_TRIP_MIN):
+        """
+        Fastest-path distance (km) and duration (min) for every origin x
+        destination pair; points are (lon, lat). NaN where unreachable within
+        max_trip_min or a point is off the network.
+
+        scipy's C Dijkstra runs once per distinct snapped node on the smaller
+        side (on the reversed graph when that side is the destinations),
+        stopping at max_trip_min so a search doesn't cover the whole city, and
+        lengths are summed along the resulting shortest-path trees. Roots are
+        searched MATRIX_ROOT_CHUNK at a time to bound the per-node arrays.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+        src_nodes, src_snap = self.snap_many(origins[:, 1], origins[:, 0])
+        dst_nodes, dst_snap = self.snap_many(destinations[:, 1], destinations[:, 0])
+
+        forward = len(np.unique(src_nodes)) <= len(np.unique(dst_nodes))
+        roots, leaves = (src_nodes, dst_nodes) if forward else (dst_nodes, src_nodes)
+        unique_roots, root_index = np.unique(roots, return_inverse=True)
+
+        weights = self._weights(reverse=not forward)
+        times = np.empty((len(unique_roots), len(leaves)))
+        lengths = np.empty((len(unique_roots), len(leaves)))
+        for start in range(0, len(unique_roots), MATRIX_ROOT_CHUNK):
+            chunk = unique_roots[start:start + MATRIX_ROOT_CHUNK]
+            chunk_times, predecessors = dijkstra(weights, directed=True, indices=chunk,
+                                                 return_predecessors=True, limit=max_trip_min * 60)
+            times[start:start + len(chunk)] = chunk_times[:, leaves]
+            for r, root in enumerate(chunk):
+                for j, leaf in enumerate(leaves):
+                    lengths[start + r, j] = self._tree_length(predecessors[r], root, leaf, forward)
+
+        time_s = times[root_index]
+        length_m = lengths[root_index]
+        if not forward:
+            time_s, length_m = time_s.T, length_m.T
+
+        access_m = src_snap[:, None] + dst_snap[None, :]
+        distance_km = (length_m + access_m) / 1000
+        duration_min = time_s / 60 + (access_m / 1000) / ACCESS_SPEED_KMH * 60
+
+        unroutable = ~np.isfinite(time_s)
+        unroutable |= (src_snap[:, None] > MAX_SNAP_M) | (dst_snap[None, :] > MAX_SNAP_M)
+        distance_km[unroutable] = np.nan
+        duration_min[unroutable] = np.nan
+        return distance_km, duration_min
+
+    def _weights(self, reverse=False):
+        if reverse:
+            if self._reverse_time_matrix is None:
+                self._reverse_time_matrix = self._weights().T.tocsr()
+            return self._reverse_time_matrix
+        if self._time_matrix is None:
+            # scipy would sum parallel edges and drop zero weights; keep the
+            # fastest edge per node pair and a tiny floor on travel time
+            n = self.num_nodes
+            src = np.repeat(np.arange(n), np.diff(self.indptr))
+            order = np.lexsort((self.time_s, self.indices, src))
+            src, dst, time_s = src[order], self.indices[order], self.time_s[order]
+            first = np.ones(len(src), dtype=bool)
+            first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+            self._time_matrix = csr_matrix(
+                (np.maximum(time_s[first].astype(np.float64), 1e-3), (src[first], dst[first])),
+                shape=(n, n)
+            )
+        return self._time_matrix
+
+    def _tree_length(self, predecessors, root, leaf, forward):
+        """Metres along the shortest-path tree between root and leaf"""
+        if leaf == root:
+            return 0.0
+        if predecessors[leaf] < 0:
+            return np.inf
+        total = 0.0
+        node = leaf
+        while node != root:
+            parent = predecessors[node]
+            # The tree edge runs parent -> node on the graph Dijkstra searched
+            u, v = (parent, node) if forward else (node, parent)
+            total += self._edge_length(u, v)
+            node = parent
+        return total
+
+    def _edge_length(self, u, v):
+        """Length of the fastest u -> v edge (parallel edges are possible)"""
+        best_time, best_len = np.inf, 0.0
+        for e in range(self._adj_ptr[u], self._adj_ptr[u + 1]):
+            if self._adj_to[e] == v and self._adj_time[e] < best_time:
+                best_time, best_len = self._adj_time[e], self._adj_len[e]
+        return best_len
+
+    def astar(self, source, target):
+        """Fastest path; returns (node list, length_m, time_s)"""
+        if source == target:
+            return [source], 0.0, 0.0
+
+        adj_ptr, adj_to = self._adj_ptr, self._adj_to
+        adj_len, adj_time = self._adj_len, self._adj_time
+        lat_rad, lon_rad = self._lat_rad, self._lon_rad
+        target_lat, target_lon = lat_rad[target], lon_rad[target]
+        cos_target = math.cos(target_lat)
+        inv_speed = 1.0 / self.max_speed_ms
+
+        def heuristic(node):
+            lat = lat_rad[node]
+            a = (math.sin((target_lat - lat) / 2) ** 2
+                 + math.cos(lat) * cos_target * math.sin((target_lon - lon_rad[node]) / 2) ** 2)
+            return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a))) * inv_speed
+
+        best_time = {source: 0.0}
+        best_len = {source: 0.0}
+        parent = {source: -1}
+        closed = set()
+        frontier = [(heuristic(source), 0.0, source)]
+
+        while frontier:
+            _, time_so_far, node = heapq.heappop(frontier)
+            if node == target:
+                break
+            if node in closed:
+                continue
+            closed.add(node)
+
+            for e in range(adj_ptr[node], adj_ptr[node + 1]):
+                neighbour = adj_to[e]
+                if neighbour in closed:
+                    continue
+                candidate = time_so_far + adj_time[e]
+                if candidate < best_time.get(neighbour, math.inf):
+                    best_time[neighbour] = candidate
+                    best_len[neighbour] = best_len[node] + adj_len[e]
+                    parent[neighbour] = node
+                    heapq.heappush(frontier, (candidate + heuristic(neighbour), candidate, neighbour))
+        else:
+            raise RouteNotFound("No drivable path between the points")
+
+        path = [target]
+        while path[-1] != source:
+            path.append(parent[path[-1]])
+        path.reverse()
+        return path, best_len[target], best_time[target]
+
+
+# ---------- building from OSM ----------
+
+def _speed_kmh(tags):
+    maxspeed = tags.get("maxspeed", "")
+    try:
+        value = float(maxspeed.split()[0])
+        return value * 1.609 if "mph" in maxspeed else value
+    except (ValueError, IndexError):
+        return HIGHWAY_SPEEDS_KMH[tags["highway"]]
+
+
+def _direction(tags):
+    """(forward, backward) traversal allowed for a way"""
+    oneway = tags.get("oneway")
+    if oneway == "-1":
+        return False, True
+    if oneway in ("yes", "true", "1"):
+        return True, False
+    # Roundabouts and motorways are one-way unless tagged otherwise
+    if oneway is None and (tags.get("junction") == "roundabout"
+                           or tags["highway"] in ("motorway", "motorway_link")):
+        return True, False
+    return True, True
+
+
+def build_from_osm(path):
+    """Parse an OSM XML extract into a RoadGraph of drivable ways"""
+    node_coords = {}
+    ways = []
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "node":
+            node_coords[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+            if tags.get("highway") in HIGHWAY_SPEEDS_KMH and tags.get("access") not in ("no", "private"):
+                refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                ways.append((refs, _speed_kmh(tags), _direction(tags)))
+            elem.clear()
+
+    index = {}
+    src, dst, speeds = [], [], []
+    for refs, speed, (forward, backward) in ways:
+        refs = [ref for ref in refs if ref in node_coords]
+        for a, b in zip(refs, refs[1:]):
+            ia = index.setdefault(a, len(index))
+            ib = index.setdefault(b, len(index))
+            if forward:
+                src.append(ia)
+                dst.append(ib)
+                speeds.append(speed)
+            if backward:
+                src.append(ib)
+                dst.append(ia)
+                speeds.append(speed)
+
+    node_ids = np.fromiter(index.keys(), dtype=np.int64, count=len(index))
+    coords = np.array([node_coords[i] for i in node_ids], dtype=np.float64).reshape(-1, 2)
+    src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+    length_m = haversine_m(coords[src, 0], coords[src, 1], coords[dst, 0], coords[dst, 1])
+    time_s = length_m / (np.asarray(speeds) / 3.6)
+    return RoadGraph.from_edges(coords[:, 0], coords[:, 1], src, dst, length_m, time_s)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Road graph tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="build a CSR graph from an OSM XML extract")
+    build.add_argument("osm_path")
+    build.add_argument("out_path")
+    args = parser.parse_args()
+
+    graph = build_from_osm(args.osm_path)
+    graph.save(args.out_path)
+    print(f"✓ {graph.num_nodes} nodes, {graph.num_edges} edges written to {args.out_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
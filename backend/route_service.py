@@ -1,22 +1,142 @@
 import os
+from collections import OrderedDict
+
+import numpy as np
 import requests
+from eventlet import tpool
 import folium
 from fare_calculator import FareCalculator
+from metrics import track, record_cache
+from circuit_breaker import CircuitBreaker, CircuitOpenError, StaleCache, STALE_SERVED
+from polyline import simplify, pack, unpack, encode
+
+# "ors" (OpenRouteService over HTTP) or "local" (in-process road graph)
+ROUTING_BACKEND = os.getenv("ROUTING_BACKEND", "ors")
+ROAD_GRAPH_PATH = os.getenv("ROAD_GRAPH_PATH", os.path.join("models", "road_graph.npz"))
+
+# ORS caps sources x destinations per matrix request
+ORS_MATRIX_MAX_CELLS = int(os.getenv("ORS_MATRIX_MAX_CELLS", "3500"))
+# Matrix cells kept in the LRU cache; points are rounded to ~100 m for the key
+ROUTE_MATRIX_CACHE_SIZE = int(os.getenv("ROUTE_MATRIX_CACHE_SIZE", "50000"))
+MATRIX_CACHE_DECIMALS = 3
+
+ORS_TIMEOUT = float(os.getenv("ORS_TIMEOUT", "5"))
+# Last good ORS route per (pickup, drop) pair, keyed to ~1 m so only the same
+# trip reuses it, and served stale while ORS is failing. During an outage a
+# trip with no route of its own gets one between points within ~100 m
+ROUTE_CACHE_DECIMALS = 5
+ROUTE_FRESH_SECONDS = float(os.getenv("ROUTE_FRESH_SECONDS", "600"))
+ROUTE_STALE_SECONDS = float(os.getenv("ROUTE_STALE_SECONDS", "86400"))
+
+# Route geometry is simplified to this many metres ("dp" Douglas-Peucker or
+# "vw" Visvalingam-Whyatt, see polyline.py); 0 keeps every point
+ROUTE_SIMPLIFY_TOLERANCE_M = float(os.getenv("ROUTE_SIMPLIFY_TOLERANCE_M", "5"))
+ROUTE_SIMPLIFY_METHOD = os.getenv("ROUTE_SIMPLIFY_METHOD", "dp")
+
+
+class RouteUnavailableError(Exception):
+    """ORS failed or its breaker is open, and no earlier route is cached"""
+
+
+class RouteResult:
+    """
+    A computed route. Unpacks like the (distance_km, duration_min, coordinates)
+    tuple get_route has always returned; source names the backend and stale
+    is set when a cached route was served because ORS was unavailable.
+
+    The geometry is kept only in packed form (polyline.pack), simplified to
+    ROUTE_SIMPLIFY_TOLERANCE_M when the route is built, so cached routes
+    stay small. coordinates decodes it on access; polyline is the Google
+    encoded form for payloads.
+    """
+    __slots__ = ("distance_km", "duration_min", "geometry", "source", "stale")
+
+    def __init__(self, distance_km, duration_min, geometry, source, stale=False):
+        self.distance_km = distance_km
+        self.duration_min = duration_min
+        self.geometry = geometry
+        self.source = source
+        self.stale = stale
+
+    @classmethod
+    def from_coordinates(cls, distance_km, duration_min, coordinates, source):
+        simplified = simplify(coordinates, ROUTE_SIMPLIFY_TOLERANCE_M, ROUTE_SIMPLIFY_METHOD)
+        return cls(distance_km, duration_min, pack(simplified), source)
+
+    @property
+    def coordinates(self):
+        """[[lon, lat], ...]"""
+        return unpack(self.geometry)
+
+    @property
+    def polyline(self):
+        return encode(self.coordinates)
+
+    def __iter__(self):
+        return iter((self.distance_km, self.duration_min, self.coordinates))
+
 
 class RouteService:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, backend=None, graph_path=None):
         self.api_key = api_key or os.getenv("ORS_API_KEY","eyJvcmciOiI1YjNjZTM1OTc4NTExMTAwMDFjZjYyNDgiLCJpZCI6ImEwOWY2YjhjNTcwOTQwMzZhZTM1YzJhYmNmYWFiOWY4IiwiaCI6Im11cm11cjY0In0=")
         self.base_url = "https://api.openrouteservice.org/v2/directions/driving-car"
+        self.matrix_url = "https://api.openrouteservice.org/v2/matrix/driving-car"
+        self.backend = backend or ROUTING_BACKEND
+        self.graph = None
+        self._matrix_cache = OrderedDict()   # (origin key, destination key) -> (km, min)
+        self.breaker = CircuitBreaker("ors", slow_call_seconds=ORS_TIMEOUT / 2)
+        # Large matrices are legitimately slow, so only errors trip this one
+        self.matrix_breaker = CircuitBreaker("ors_matrix")
+        self._route_cache = StaleCache("route", ROUTE_FRESH_SECONDS, ROUTE_STALE_SECONDS)
+        self._nearby_routes = StaleCache("route_nearby", 0, ROUTE_STALE_SECONDS)
+
+        if self.backend == "local":
+            from road_graph import RoadGraph
+            self.graph = RoadGraph.load(graph_path or ROAD_GRAPH_PATH)
+        elif self.backend != "ors":
+            raise ValueError(f"Unknown routing backend {self.backend!r}")
 
     def get_route(self, start, end):
         """
         start/end: (lon, lat)
-        returns (distance_km, duration_min, coordinates)
+        returns RouteResult, which unpacks as (distance_km, duration_min, coordinates)
+        raises RouteUnavailableError when ORS is down and nothing is cached
         """
+        if self.backend == "local":
+            return self._local_route(start, end)
+
+        key = (self._route_key(start), self._route_key(end))
+        nearby_key = (self._matrix_key(start), self._matrix_key(end))
+
+        def fetch():
+            route = self.breaker.call(self._ors_route, start, end)
+            self._nearby_routes.put(nearby_key, route)
+            return route
+
+        try:
+            route, stale = self._route_cache.get(key, fetch)
+        except (CircuitOpenError, requests.exceptions.RequestException) as e:
+            route, _ = self._nearby_routes.peek(nearby_key)
+            if route is None:
+                raise RouteUnavailableError("Routing is temporarily unavailable, please try again shortly") from e
+            STALE_SERVED.inc("route_nearby")
+            stale = True
+        if stale:
+            route = RouteResult(route.distance_km, route.duration_min, route.geometry, route.source, stale=True)
+        return route
+
+    def _local_route(self, start, end):
+        with track("road_graph", "route"):
+            # A* is pure Python; run it in a native thread so it doesn't stall the hub
+            distance_km, duration_min, coords = tpool.execute(self.graph.route, start, end)
+        return RouteResult.from_coordinates(distance_km, duration_min, coords, "local")
+
+    def _ors_route(self, start, end):
         headers = {"Authorization": self.api_key}
         params = {"start": f"{start[0]},{start[1]}", "end": f"{end[0]},{end[1]}"}
-        r = requests.get(self.base_url, headers=headers, params=params, timeout=10)
-        r.raise_for_status()
+        with track("ors", "directions"):
+            r = requests.get(self.base_url, headers=headers, params=params, timeout=ORS_TIMEOUT)
+            r.raise_for_status()
         data = r.json()
 
         seg = data["features"][0]["properties"]["segments"][0]
@@ -24,7 +144,97 @@ class RouteService:
 
         distance_km = seg["distance"] / 1000
         duration_min = seg["duration"] / 60
-        return distance_km, duration_min, coords
+        return RouteResult.from_coordinates(distance_km, duration_min, coords, "ors")
+
+    def get_matrix(self, origins, destinations):
+        """
+        origins/destinations: lists of (lon, lat)
+        returns (distance_km, duration_min) float arrays of shape
+        [len(origins), len(destinations)], NaN where there is no route.
+        Cached cells are reused; only rows/columns with a miss are computed.
+        """
+        origin_keys = [self._matrix_key(p) for p in origins]
+        destination_keys = [self._matrix_key(p) for p in destinations]
+        distance_km = np.full((len(origins), len(destinations)), np.nan)
+        duration_min = np.full((len(origins), len(destinations)), np.nan)
+
+        missing = np.zeros(distance_km.shape, dtype=bool)
+        for i, ok in enumerate(origin_keys):
+            for j, dk in enumerate(destination_keys):
+                cell = self._matrix_cache.get((ok, dk))
+                if cell is None:
+                    missing[i, j] = True
+                else:
+                    self._matrix_cache.move_to_end((ok, dk))
+                    distance_km[i, j], duration_min[i, j] = cell
+
+        misses = int(missing.sum())
+        record_cache("route_matrix", hit=True, count=missing.size - misses)
+        if not misses:
+            return distance_km, duration_min
+        record_cache("route_matrix", hit=False, count=misses)
+
+        rows = np.flatnonzero(missing.any(axis=1))
+        cols = np.flatnonzero(missing.any(axis=0))
+        sub_origins = [origins[i] for i in rows]
+        sub_destinations = [destinations[j] for j in cols]
+        if self.backend == "local":
+            with track("road_graph", "matrix"):
+                sub_distance, sub_duration = tpool.execute(self.graph.matrix, sub_origins, sub_destinations)
+        else:
+            try:
+                sub_distance, sub_duration = self.matrix_breaker.call(self._ors_matrix, sub_origins, sub_destinations)
+            except (CircuitOpenError, requests.exceptions.RequestException) as e:
+                raise RouteUnavailableError("Routing is temporarily unavailable") from e
+
+        distance_km[np.ix_(rows, cols)] = sub_distance
+        duration_min[np.ix_(rows, cols)] = sub_duration
+        for a, i in enumerate(rows):
+            for b, j in enumerate(cols):
+                self._matrix_cache[(origin_keys[i], destination_keys[j])] = (
+                    float(sub_distance[a, b]), float(sub_duration[a, b])
+                )
+        while len(self._matrix_cache) > ROUTE_MATRIX_CACHE_SIZE:
+            self._matrix_cache.popitem(last=False)
+        return distance_km, duration_min
+
+    def _ors_matrix(self, origins, destinations):
+        """ORS matrix endpoint, split into blocks of at most ORS_MATRIX_MAX_CELLS"""
+        distance_km = np.full((len(origins), len(destinations)), np.nan)
+        duration_min = np.full((len(origins), len(destinations)), np.nan)
+        col_step = min(len(destinations), ORS_MATRIX_MAX_CELLS)
+        row_step = max(1, ORS_MATRIX_MAX_CELLS // col_step)
+        headers = {"Authorization": self.api_key}
+
+        for r0 in range(0, len(origins), row_step):
+            for c0 in range(0, len(destinations), col_step):
+                block_origins = origins[r0:r0 + row_step]
+                block_destinations = destinations[c0:c0 + col_step]
+                body = {
+                    "locations": [list(p) for p in block_origins] + [list(p) for p in block_destinations],
+                    "sources": list(range(len(block_origins))),
+                    "destinations": list(range(len(block_origins),
+                                               len(block_origins) + len(block_destinations))),
+                    "metrics": ["distance", "duration"],
+                    "units": "km"
+                }
+                with track("ors", "matrix"):
+                    r = requests.post(self.matrix_url, headers=headers, json=body, timeout=15)
+                    r.raise_for_status()
+                data = r.json()
+                # Unroutable cells come back as null
+                block = (slice(r0, r0 + len(block_origins)), slice(c0, c0 + len(block_destinations)))
+                distance_km[block] = np.array(data["distances"], dtype=np.float64)
+                duration_min[block] = np.array(data["durations"], dtype=np.float64) / 60
+        return distance_km, duration_min
+
+    @staticmethod
+    def _matrix_key(point):
+        return round(point[0], MATRIX_CACHE_DECIMALS), round(point[1], MATRIX_CACHE_DECIMALS)
+
+    @staticmethod
+    def _route_key(point):
+        return round(point[0], ROUTE_CACHE_DECIMALS), round(point[1], ROUTE_CACHE_DECIMALS)
 
 
 # if __name__ == "__main__":
@@ -0,0 +1,52 @@
+-- Spatially indexed driver locations for nearest-driver dispatch.
+--
+-- driver.location is a PostGIS geography point kept in sync with the
+-- existing "Latitude"/"Longitude" columns by a trigger, so the location
+-- update paths in db.py (update_driver_location,
+-- update_driver_and_ride_location) don't change. A partial GiST index
+-- covers idle drivers (is_active = false) only, which is the set dispatch
+-- searches. db.get_available_drivers(pickup=...) uses it for
+--   WHERE is_active = false AND ST_DWithin(location, pickup, radius)
+--   ORDER BY location <-> pickup LIMIT k
+-- so the database returns the k nearest candidates whatever the fleet size.
+--
+-- Apply with: psql "$DATABASE_URL" -f backend/sql/driver_location_gist.sql
+
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+ALTER TABLE public.driver ADD COLUMN IF NOT EXISTS location geography(Point, 4326);
+
+
+CREATE OR REPLACE FUNCTION public.driver_location_sync() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW."Latitude" IS NULL OR NEW."Longitude" IS NULL THEN
+        NEW.location := NULL;
+    ELSE
+        NEW.location := ST_SetSRID(ST_MakePoint(NEW."Longitude", NEW."Latitude"), 4326)::geography;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS driver_location_sync ON public.driver;
+CREATE TRIGGER driver_location_sync
+    BEFORE INSERT OR UPDATE OF "Latitude", "Longitude" ON public.driver
+    FOR EACH ROW EXECUTE FUNCTION public.driver_location_sync();
+
+
+-- Backfill rows written before the trigger existed
+UPDATE public.driver
+SET location = ST_SetSRID(ST_MakePoint("Longitude", "Latitude"), 4326)::geography
+WHERE "Latitude" IS NOT NULL AND "Longitude" IS NOT NULL
+  AND location IS NULL;
+
+CREATE INDEX IF NOT EXISTS driver_idle_location_gist
+    ON public.driver USING gist (location)
+    WHERE is_active = false;
+
+ANALYZE public.driver;
+
+COMMIT;
@@ -0,0 +1,33 @@
+-- Driver online flag maintained from presence heartbeats.
+--
+-- A driver is online while their pings keep arriving. The location
+-- updates in db.py set online = true; PresenceSweeper (presence.py) sets it
+-- back to false for drivers silent longer than PRESENCE_TTL_SECONDS, using
+-- the Redis presence set and, as a backstop, last_updated. Every
+-- availability query filters on it, so drivers who closed the app days ago
+-- are no longer offered rides.
+--
+-- Apply after driver_location_gist.sql:
+--   psql "$DATABASE_URL" -f backend/sql/driver_presence.sql
+
+BEGIN;
+
+ALTER TABLE public.driver ADD COLUMN IF NOT EXISTS online boolean NOT NULL DEFAULT false;
+
+-- Drivers heard from recently start online; the rest wait for their next ping
+UPDATE public.driver
+SET online = true
+WHERE last_updated > now() - interval '90 seconds';
+
+-- The dispatch KNN index now covers idle *and* online drivers only
+DROP INDEX IF EXISTS public.driver_idle_location_gist;
+CREATE INDEX driver_idle_location_gist
+    ON public.driver USING gist (location)
+    WHERE is_active = false AND online = true;
+
+-- The sweeper's backstop scans online drivers by last_updated
+CREATE INDEX IF NOT EXISTS driver_online_last_updated
+    ON public.driver (last_updated)
+    WHERE online = true;
+
+COMMIT;
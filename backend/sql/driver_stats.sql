@@ -0,0 +1,174 @@
+-- Materialized per-driver ride statistics.
+--
+-- Kept current by row triggers on ride and rating, so every state transition
+-- (book_ride, accept_ride, reject_ride, start/complete_ride_transaction,
+-- cancel) updates it without the procedures having to know about it.
+-- Read by /driver/<id>/stats and the driver recommender (db.get_driver_stats).
+--
+-- Apply with: psql "$DATABASE_URL" -f backend/sql/driver_stats.sql
+
+CREATE TABLE IF NOT EXISTS public.driver_stats (
+    driver_id        integer PRIMARY KEY REFERENCES public.driver (driver_id) ON DELETE CASCADE,
+    total_rides      integer          NOT NULL DEFAULT 0,  -- rides in a terminal status
+    accepted_rides   integer          NOT NULL DEFAULT 0,  -- accepted or completed
+    completed_rides  integer          NOT NULL DEFAULT 0,
+    cancelled_rides  integer          NOT NULL DEFAULT 0,
+    rejected_rides   integer          NOT NULL DEFAULT 0,
+    fare_sum         numeric(14, 2)   NOT NULL DEFAULT 0,
+    rating_sum       double precision NOT NULL DEFAULT 0,
+    rating_count     integer          NOT NULL DEFAULT 0,
+    avg_fare         numeric(10, 2) GENERATED ALWAYS AS
+                         (CASE WHEN total_rides > 0 THEN fare_sum / total_rides END) STORED,
+    avg_rating       double precision GENERATED ALWAYS AS
+                         (CASE WHEN rating_count > 0 THEN rating_sum / rating_count END) STORED,
+    updated_at       timestamp        NOT NULL DEFAULT now()
+);
+
+
+-- Add (p_sign = 1) or remove (p_sign = -1) one ride's contribution
+CREATE OR REPLACE FUNCTION public.driver_stats_apply_ride(
+    p_driver_id integer, p_status text, p_fare numeric, p_sign integer
+) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF p_driver_id IS NULL
+       OR p_status IS NULL
+       OR p_status NOT IN ('accepted', 'rejected', 'completed', 'cancelled') THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO public.driver_stats AS s (
+        driver_id, total_rides, accepted_rides, completed_rides,
+        cancelled_rides, rejected_rides, fare_sum
+    )
+    VALUES (
+        p_driver_id,
+        p_sign,
+        p_sign * (p_status IN ('accepted', 'completed'))::int,
+        p_sign * (p_status = 'completed')::int,
+        p_sign * (p_status = 'cancelled')::int,
+        p_sign * (p_status = 'rejected')::int,
+        p_sign * COALESCE(p_fare, 0)
+    )
+    ON CONFLICT (driver_id) DO UPDATE SET
+        total_rides     = s.total_rides     + EXCLUDED.total_rides,
+        accepted_rides  = s.accepted_rides  + EXCLUDED.accepted_rides,
+        completed_rides = s.completed_rides + EXCLUDED.completed_rides,
+        cancelled_rides = s.cancelled_rides + EXCLUDED.cancelled_rides,
+        rejected_rides  = s.rejected_rides  + EXCLUDED.rejected_rides,
+        fare_sum        = s.fare_sum        + EXCLUDED.fare_sum,
+        updated_at      = now();
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION public.driver_stats_ride_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND NEW.status IS NOT DISTINCT FROM OLD.status
+       AND NEW.driver_id IS NOT DISTINCT FROM OLD.driver_id
+       AND NEW.fare IS NOT DISTINCT FROM OLD.fare THEN
+        RETURN NULL;  -- location pings etc. don't touch the stats
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM public.driver_stats_apply_ride(OLD.driver_id, OLD.status, OLD.fare, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM public.driver_stats_apply_ride(NEW.driver_id, NEW.status, NEW.fare, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_driver_stats_ride ON public.ride;
+CREATE TRIGGER trg_driver_stats_ride
+    AFTER INSERT OR UPDATE OF status, driver_id, fare OR DELETE ON public.ride
+    FOR EACH ROW EXECUTE FUNCTION public.driver_stats_ride_trigger();
+
+
+CREATE OR REPLACE FUNCTION public.driver_stats_rating_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_driver_id integer;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.score IS NOT NULL THEN
+        SELECT driver_id INTO v_driver_id FROM public.ride WHERE ride_id = OLD.ride_id;
+        IF v_driver_id IS NOT NULL THEN
+            INSERT INTO public.driver_stats AS s (driver_id, rating_sum, rating_count)
+            VALUES (v_driver_id, -OLD.score, -1)
+            ON CONFLICT (driver_id) DO UPDATE SET
+                rating_sum   = s.rating_sum   + EXCLUDED.rating_sum,
+                rating_count = s.rating_count + EXCLUDED.rating_count,
+                updated_at   = now();
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.score IS NOT NULL THEN
+        SELECT driver_id INTO v_driver_id FROM public.ride WHERE ride_id = NEW.ride_id;
+        IF v_driver_id IS NOT NULL THEN
+            INSERT INTO public.driver_stats AS s (driver_id, rating_sum, rating_count)
+            VALUES (v_driver_id, NEW.score, 1)
+            ON CONFLICT (driver_id) DO UPDATE SET
+                rating_sum   = s.rating_sum   + EXCLUDED.rating_sum,
+                rating_count = s.rating_count + EXCLUDED.rating_count,
+                updated_at   = now();
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_driver_stats_rating ON public.rating;
+CREATE TRIGGER trg_driver_stats_rating
+    AFTER INSERT OR UPDATE OF score, ride_id OR DELETE ON public.rating
+    FOR EACH ROW EXECUTE FUNCTION public.driver_stats_rating_trigger();
+
+
+-- Full rebuild from ride/rating; run once after creating the table and any
+-- time the counters need to be reconciled.
+CREATE OR REPLACE FUNCTION public.refresh_driver_stats() RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    LOCK TABLE public.driver_stats IN EXCLUSIVE MODE;
+    DELETE FROM public.driver_stats;
+
+    INSERT INTO public.driver_stats (
+        driver_id, total_rides, accepted_rides, completed_rides,
+        cancelled_rides, rejected_rides, fare_sum, rating_sum, rating_count
+    )
+    SELECT d.driver_id,
+           COALESCE(r.total_rides, 0),
+           COALESCE(r.accepted_rides, 0),
+           COALESCE(r.completed_rides, 0),
+           COALESCE(r.cancelled_rides, 0),
+           COALESCE(r.rejected_rides, 0),
+           COALESCE(r.fare_sum, 0),
+           COALESCE(g.rating_sum, 0),
+           COALESCE(g.rating_count, 0)
+    FROM public.driver d
+    LEFT JOIN (
+        SELECT driver_id,
+               count(*)                                                   AS total_rides,
+               count(*) FILTER (WHERE status IN ('accepted', 'completed')) AS accepted_rides,
+               count(*) FILTER (WHERE status = 'completed')               AS completed_rides,
+               count(*) FILTER (WHERE status = 'cancelled')               AS cancelled_rides,
+               count(*) FILTER (WHERE status = 'rejected')                AS rejected_rides,
+               sum(COALESCE(fare, 0))                                     AS fare_sum
+        FROM public.ride
+        WHERE driver_id IS NOT NULL
+          AND status IN ('accepted', 'rejected', 'completed', 'cancelled')
+        GROUP BY driver_id
+    ) r ON r.driver_id = d.driver_id
+    LEFT JOIN (
+        SELECT ri.driver_id, sum(ra.score) AS rating_sum, count(ra.score) AS rating_count
+        FROM public.rating ra
+        JOIN public.ride ri ON ri.ride_id = ra.ride_id
+        WHERE ri.driver_id IS NOT NULL
+        GROUP BY ri.driver_id
+    ) g ON g.driver_id = d.driver_id;
+END;
+$$;
+
+SELECT public.refresh_driver_stats();
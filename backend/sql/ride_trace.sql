@@ -0,0 +1,27 @@
+-- Recorded location trace of each completed ride.
+--
+-- One row per ride, written with the ride's completion
+-- (db.complete_ride_transaction). trace holds every driver location ping
+-- of the ride, delta-encoded and compressed by trip_trace.TraceBuffer;
+-- decode it with trip_trace.decode_trace() or through
+-- GET /admin/ride/<id>/trace. A typical trip stores a few bytes per ping, so
+-- the table stays small enough to keep traces for disputes, fare audits
+-- and replay.
+--
+-- Apply with: psql "$DATABASE_URL" -f backend/sql/ride_trace.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.ride_trace (
+    ride_id      integer   PRIMARY KEY REFERENCES public.ride (ride_id) ON DELETE CASCADE,
+    points       integer   NOT NULL,
+    started_at   timestamp NOT NULL,   -- first and last ping, UTC
+    ended_at     timestamp NOT NULL,
+    trace        bytea     NOT NULL,
+    created_at   timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- The blob is already compressed; don't let TOAST try again
+ALTER TABLE public.ride_trace ALTER COLUMN trace SET STORAGE EXTERNAL;
+
+COMMIT;
@@ -0,0 +1,252 @@
+-- Time-partitioned weather checks with hourly per-cell rollups.
+--
+-- public.weather becomes a table partitioned by month on checked_at
+-- (weather_yYYYYmMM), with a default partition as a safety net. Raw checks
+-- are kept for WEATHER_KEEP_MONTHS full months; before a month is dropped
+-- its rows are rolled up into public.weather_hourly, one row per pickup
+-- grid cell and hour, with the outcome of the rides that were checked.
+-- Analytics read
+-- weather_hourly (db.get_weather_hourly, GET /admin/weather/hourly)
+-- instead of scanning raw checks.
+--
+-- public.weather_maintenance() creates upcoming partitions, rolls up recent
+-- hours and drops expired months. It takes a transaction-level advisory
+-- lock, so when several app workers (or a worker and pg_cron) run it at once
+-- only one does the work and the others return {"skipped": true}; the
+-- partition DDL of concurrent runs would otherwise collide. The app runs it every
+-- WEATHER_MAINTENANCE_INTERVAL seconds; with pg_cron it can run in the
+-- database instead:
+--   SELECT cron.schedule('weather-maintenance', '5 * * * *',
+--                        'SELECT public.weather_maintenance()');
+--
+-- Checks outside every monthly partition (a skewed clock, or a late
+-- write-behind flush for a month already dropped) land in weather_default.
+-- Creating a month whose range holds such rows would fail, so
+-- weather_create_partitions moves them into the new partition. Rows older
+-- than the retention window stay in weather_default until removed by hand.
+--
+-- Apply with: psql "$DATABASE_URL" -f backend/sql/weather_partitioning.sql
+-- The conversion of an existing unpartitioned table runs once, in this
+-- transaction; re-running the file only refreshes the functions.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.weather_hourly (
+    cell_lat          double precision NOT NULL,   -- cell centre, WEATHER_AREA_DEG grid
+    cell_lon          double precision NOT NULL,
+    hour              timestamp        NOT NULL,
+    checks            integer          NOT NULL,
+    unsafe_checks     integer          NOT NULL,
+    rides             integer          NOT NULL,
+    completed_rides   integer          NOT NULL,
+    cancelled_rides   integer          NOT NULL,
+    avg_temperature   double precision,
+    max_wind_speed    double precision,
+    min_visibility    double precision,
+    avg_humidity      double precision,
+    PRIMARY KEY (hour, cell_lat, cell_lon)
+);
+
+
+-- Name of the monthly partition holding p_month
+CREATE OR REPLACE FUNCTION public.weather_partition_name(p_month timestamp) RETURNS text
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT 'weather_' || to_char(date_trunc('month', p_month), '"y"YYYY"m"MM');
+$$;
+
+
+-- Create partitions from p_from's month through p_months_ahead months after now
+CREATE OR REPLACE FUNCTION public.weather_create_partitions(
+    p_months_ahead integer DEFAULT 2, p_from timestamp DEFAULT now()
+) RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_month   timestamp := date_trunc('month', LEAST(p_from, now()::timestamp));
+    v_last    timestamp := date_trunc('month', now()::timestamp) + make_interval(months => p_months_ahead);
+    v_name    text;
+    v_created integer := 0;
+BEGIN
+    WHILE v_month <= v_last LOOP
+        v_name := public.weather_partition_name(v_month);
+        IF to_regclass('public.' || v_name) IS NULL THEN
+            -- The CREATE fails if weather_default holds rows of this month;
+            -- set them aside and put them back into the new partition
+            CREATE TEMP TABLE IF NOT EXISTS weather_default_moved (LIKE public.weather) ON COMMIT DROP;
+            WITH moved AS (
+                DELETE FROM public.weather_default
+                WHERE checked_at >= v_month AND checked_at < v_month + interval '1 month'
+                RETURNING *
+            )
+            INSERT INTO weather_default_moved SELECT * FROM moved;
+
+            EXECUTE format(
+                'CREATE TABLE public.%I PARTITION OF public.weather FOR VALUES FROM (%L) TO (%L)',
+                v_name, v_month, v_month + interval '1 month'
+            );
+            INSERT INTO public.weather SELECT * FROM weather_default_moved;
+            TRUNCATE weather_default_moved;
+            v_created := v_created + 1;
+        END IF;
+        v_month := v_month + interval '1 month';
+    END LOOP;
+    RETURN v_created;
+END;
+$$;
+
+
+-- Roll raw checks in [p_from, p_to) up into weather_hourly. Whole hours
+-- are recomputed, so running it again over the same range is harmless.
+CREATE OR REPLACE FUNCTION public.weather_downsample(
+    p_from timestamp, p_to timestamp, p_cell_deg double precision DEFAULT 0.05
+) RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_rows integer;
+BEGIN
+    p_from := date_trunc('hour', p_from);
+    p_to   := date_trunc('hour', p_to);
+
+    INSERT INTO public.weather_hourly AS h (
+        cell_lat, cell_lon, hour, checks, unsafe_checks, rides, completed_rides,
+        cancelled_rides, avg_temperature, max_wind_speed, min_visibility, avg_humidity
+    )
+    SELECT
+        round(r.pickup_latitude  / p_cell_deg) * p_cell_deg,
+        round(r.pickup_longitude / p_cell_deg) * p_cell_deg,
+        date_trunc('hour', w.checked_at),
+        count(*),
+        count(*) FILTER (WHERE NOT w.is_safe),
+        count(DISTINCT w.ride_id),
+        count(DISTINCT w.ride_id) FILTER (WHERE r.status = 'completed'),
+        count(DISTINCT w.ride_id) FILTER (WHERE r.status = 'cancelled'),
+        avg(w.temperature),
+        max(w.wind_speed),
+        min(w.visibility),
+        avg(w.humidity)
+    FROM public.weather w
+    JOIN public.ride r ON r.ride_id = w.ride_id
+    WHERE w.checked_at >= p_from AND w.checked_at < p_to
+      AND r.pickup_latitude IS NOT NULL AND r.pickup_longitude IS NOT NULL
+    GROUP BY 1, 2, 3
+    ON CONFLICT (hour, cell_lat, cell_lon) DO UPDATE SET
+        checks          = EXCLUDED.checks,
+        unsafe_checks   = EXCLUDED.unsafe_checks,
+        rides           = EXCLUDED.rides,
+        completed_rides = EXCLUDED.completed_rides,
+        cancelled_rides = EXCLUDED.cancelled_rides,
+        avg_temperature = EXCLUDED.avg_temperature,
+        max_wind_speed  = EXCLUDED.max_wind_speed,
+        min_visibility  = EXCLUDED.min_visibility,
+        avg_humidity    = EXCLUDED.avg_humidity;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$;
+
+
+-- Roll up and drop monthly partitions older than p_keep_months full months
+CREATE OR REPLACE FUNCTION public.weather_drop_partitions(
+    p_keep_months integer DEFAULT 3, p_cell_deg double precision DEFAULT 0.05
+) RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_cutoff  timestamp := date_trunc('month', now()::timestamp) - make_interval(months => p_keep_months);
+    v_part    record;
+    v_month   timestamp;
+    v_dropped integer := 0;
+BEGIN
+    FOR v_part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'public.weather'::regclass
+          AND c.relname ~ '^weather_y[0-9]{4}m[0-9]{2}$'
+        ORDER BY c.relname
+    LOOP
+        v_month := to_date(substr(v_part.relname, 10, 4) || substr(v_part.relname, 15, 2), 'YYYYMM')::timestamp;
+        EXIT WHEN v_month >= v_cutoff;
+
+        PERFORM public.weather_downsample(v_month, v_month + interval '1 month', p_cell_deg);
+        EXECUTE format('ALTER TABLE public.weather DETACH PARTITION public.%I', v_part.relname);
+        EXECUTE format('DROP TABLE public.%I', v_part.relname);
+        v_dropped := v_dropped + 1;
+    END LOOP;
+    RETURN v_dropped;
+END;
+$$;
+
+
+-- Periodic job: upcoming partitions, recent rollups, retention.
+-- Re-rolls the last p_rollup_hours complete hours so late (write-behind)
+-- checks are picked up. Runs at most once at a time (see the header).
+CREATE OR REPLACE FUNCTION public.weather_maintenance(
+    p_keep_months integer DEFAULT 3, p_months_ahead integer DEFAULT 2,
+    p_rollup_hours integer DEFAULT 3, p_cell_deg double precision DEFAULT 0.05
+) RETURNS jsonb
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_hour    timestamp := date_trunc('hour', now()::timestamp);
+    v_created integer;
+    v_rolled  integer;
+    v_dropped integer;
+BEGIN
+    -- Held until the caller's transaction ends
+    IF NOT pg_try_advisory_xact_lock(hashtext('public.weather_maintenance')) THEN
+        RETURN jsonb_build_object('skipped', true);
+    END IF;
+
+    v_created := public.weather_create_partitions(p_months_ahead);
+    v_rolled  := public.weather_downsample(v_hour - make_interval(hours => p_rollup_hours), v_hour, p_cell_deg);
+    v_dropped := public.weather_drop_partitions(p_keep_months, p_cell_deg);
+    RETURN jsonb_build_object(
+        'partitions_created', v_created,
+        'hourly_rows', v_rolled,
+        'partitions_dropped', v_dropped
+    );
+END;
+$$;
+
+
+-- One-time conversion of the original unpartitioned table
+DO $$
+DECLARE
+    v_oldest timestamp;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'public.weather'::regclass) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE public.weather RENAME TO weather_unpartitioned;
+    ALTER TABLE public.weather_unpartitioned RENAME CONSTRAINT weather_pkey TO weather_unpartitioned_pkey;
+
+    CREATE TABLE public.weather (
+        ride_id       integer   NOT NULL REFERENCES public.ride (ride_id) ON DELETE CASCADE,
+        checked_at    timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        temperature   double precision,
+        wind_speed    double precision,
+        visibility    double precision,
+        humidity      double precision,
+        weather_code  integer,
+        condition     varchar(100),
+        is_safe       boolean DEFAULT true,
+        PRIMARY KEY (ride_id, checked_at)
+    ) PARTITION BY RANGE (checked_at);
+
+    CREATE TABLE public.weather_default PARTITION OF public.weather DEFAULT;
+    CREATE INDEX ON public.weather (checked_at);
+
+    SELECT min(checked_at) INTO v_oldest FROM public.weather_unpartitioned;
+    PERFORM public.weather_create_partitions(2, COALESCE(v_oldest, now()::timestamp));
+
+    INSERT INTO public.weather SELECT
+        ride_id, checked_at, temperature, wind_speed, visibility,
+        humidity, weather_code, condition, is_safe
+    FROM public.weather_unpartitioned;
+    DROP TABLE public.weather_unpartitioned;
+END;
+$$;
+
+SELECT public.weather_maintenance();
+
+COMMIT;
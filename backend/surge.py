@@ -0,0 +1,141 @@
+"""
+Surge multipliers from live supply and demand per grid cell.
+
+The city is bucketed into SURGE_CELL_DEG x SURGE_CELL_DEG cells (~1.1 km at
+the default 0.01). Events arrive as they happen:
+
+  * supply: driver_seen() on each idle-driver location ping, driver_busy()
+    when a driver takes a ride; a driver counts in the cell of their last
+    ping for SURGE_SUPPLY_WINDOW seconds
+  * demand: record_request() for every ride request; requests count for
+    SURGE_DEMAND_WINDOW seconds
+
+Every SURGE_INTERVAL seconds a greenlet turns the windows into a raw
+multiplier per cell, smooths it with an EWMA against the previous value
+and publishes a new {cell: multiplier} dict in one assignment. multiplier()
+is a dict lookup, so FareCalculator never touches the database. Cells with
+no surge are omitted and read as 1.0. State is per process; with several
+workers each one computes its own map from the events it sees.
+"""
+
+import os
+import time
+import math
+import logging
+from collections import deque
+
+import eventlet
+
+from metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+SURGE_CELL_DEG = float(os.getenv("SURGE_CELL_DEG", "0.01"))
+SURGE_INTERVAL = float(os.getenv("SURGE_INTERVAL", "30"))
+SURGE_SUPPLY_WINDOW = float(os.getenv("SURGE_SUPPLY_WINDOW", "180"))
+SURGE_DEMAND_WINDOW = float(os.getenv("SURGE_DEMAND_WINDOW", "600"))
+# Requests per idle driver over the demand window before surge kicks in
+SURGE_THRESHOLD = float(os.getenv("SURGE_THRESHOLD", "1.0"))
+# Multiplier added per unit of demand/supply ratio above the threshold
+SURGE_SENSITIVITY = float(os.getenv("SURGE_SENSITIVITY", "0.25"))
+SURGE_MAX = float(os.getenv("SURGE_MAX", "2.5"))
+# EWMA weight of the newest raw multiplier
+SURGE_SMOOTHING = float(os.getenv("SURGE_SMOOTHING", "0.3"))
+
+SURGE_ACTIVE_CELLS = REGISTRY.gauge("surge_active_cells", "Grid cells with a multiplier above 1.0")
+
+
+def cell_of(lat, lon, cell_deg=SURGE_CELL_DEG):
+    return math.floor(lat / cell_deg), math.floor(lon / cell_deg)
+
+
+class SurgeEngine:
+    def __init__(self, cell_deg=SURGE_CELL_DEG, interval=SURGE_INTERVAL,
+                 supply_window=SURGE_SUPPLY_WINDOW, demand_window=SURGE_DEMAND_WINDOW):
+        self.cell_deg = cell_deg
+        self.interval = interval
+        self.supply_window = supply_window
+        self.demand_window = demand_window
+
+        self._drivers = {}        # driver_id -> (cell, last_seen)
+        self._requests = {}       # cell -> deque of request timestamps
+        self._smoothed = {}       # cell -> unrounded EWMA state
+        self._multipliers = {}    # cell -> published multiplier (> 1.0 only)
+        self._worker = None
+        SURGE_ACTIVE_CELLS.set_function(lambda: len(self._multipliers))
+
+    # ---------- events ----------
+
+    def driver_seen(self, driver_id, lat, lon, now=None):
+        self._drivers[driver_id] = (cell_of(lat, lon, self.cell_deg), now or time.time())
+
+    def driver_busy(self, driver_id):
+        self._drivers.pop(driver_id, None)
+
+    def record_request(self, lat, lon, now=None):
+        cell = cell_of(lat, lon, self.cell_deg)
+        self._requests.setdefault(cell, deque()).append(now or time.time())
+
+    # ---------- lookup ----------
+
+    def multiplier(self, lat, lon):
+        return self._multipliers.get(cell_of(lat, lon, self.cell_deg), 1.0)
+
+    def snapshot(self):
+        """Published multipliers keyed by the cell's south-west corner"""
+        return [
+            {"lat": row * self.cell_deg, "lon": col * self.cell_deg, "multiplier": m}
+            for (row, col), m in self._multipliers.items()
+        ]
+
+    # ---------- computation ----------
+
+    def start(self):
+        if self._worker is None or self._worker.dead:
+            self._worker = eventlet.spawn(self._run)
+
+    def _run(self):
+        while True:
+            try:
+                self.recompute()
+            except Exception:
+                log.exception("Surge recompute failed")
+            eventlet.sleep(self.interval)
+
+    def recompute(self, now=None):
+        now = now or time.time()
+
+        supply = {}
+        stale = []
+        for driver_id, (cell, seen) in self._drivers.items():
+            if now - seen > self.supply_window:
+                stale.append(driver_id)
+            else:
+                supply[cell] = supply.get(cell, 0) + 1
+        for driver_id in stale:
+            del self._drivers[driver_id]
+
+        demand = {}
+        for cell in list(self._requests):
+            times = self._requests[cell]
+            while times and now - times[0] > self.demand_window:
+                times.popleft()
+            if times:
+                demand[cell] = len(times)
+            else:
+                del self._requests[cell]
+
+        previous = self._smoothed
+        smoothed, published = {}, {}
+        for cell in demand.keys() | previous.keys():
+            ratio = demand.get(cell, 0) / max(supply.get(cell, 0), 1)
+            raw = min(SURGE_MAX, max(1.0, 1.0 + SURGE_SENSITIVITY * (ratio - SURGE_THRESHOLD)))
+            value = SURGE_SMOOTHING * raw + (1 - SURGE_SMOOTHING) * previous.get(cell, 1.0)
+            # Drop cells once they have decayed to a displayed 1.00
+            if round(value, 2) > 1.0:
+                smoothed[cell] = value
+                published[cell] = round(value, 2)
+
+        self._smoothed = smoothed
+        self._multipliers = published
+        return published
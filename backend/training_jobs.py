@@ -0,0 +1,168 @@
+"""
+Background training for the driver recommender.
+
+Training requests are queued and handled one at a time by a worker greenlet.
+The ride extract is read from the database inside the greenlet (cooperative
+I/O), the CPU-bound GradientBoosting fit runs in eventlet's native thread pool,
+and the new model is only swapped into the serving recommender once it has
+been validated, so requests never wait on a fit.
+"""
+
+import os
+import logging
+import itertools
+from collections import OrderedDict
+from datetime import datetime
+
+import eventlet
+from eventlet import tpool
+from eventlet.queue import LightQueue
+
+from ml_recommender import DriverRecommender, MODEL_PATH
+
+log = logging.getLogger(__name__)
+
+# A retrained model replacing an existing one must reach this accuracy on the
+# newest rides held out of the last full fit (ml_recommender.HOLDOUT_SIZE)
+MODEL_MIN_ACCURACY = float(os.getenv("MODEL_MIN_ACCURACY", "0.5"))
+
+# Finished jobs kept around for the status endpoint
+MAX_JOB_HISTORY = 20
+
+
+class TrainingJobQueue:
+    def __init__(self, app, db, recommender, min_accuracy=MODEL_MIN_ACCURACY):
+        self.app = app
+        self.db = db
+        self.recommender = recommender
+        self.min_accuracy = min_accuracy
+
+        self.jobs = OrderedDict()   # job_id -> job dict
+        self._ids = itertools.count(1)
+        self._queue = LightQueue()
+        self._worker = None
+
+    def submit(self, snapshot_path=None, use_snapshot=False, incremental=False):
+        """
+        Queue a training job and return its status dict.
+        Incremental jobs warm-start the serving model on rides newer than its
+        high-water mark, falling back to a full fit when that isn't possible.
+        If a job is already queued or running it is returned instead of
+        stacking up another full fit.
+        """
+        pending = self.pending_job()
+        if pending:
+            return pending
+
+        job_id = next(self._ids)
+        job = {
+            'job_id': job_id,
+            'status': 'queued',
+            'incremental': incremental,
+            'submitted_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None,
+            'swapped_in': False,
+            'result': None,
+            'error': None,
+            '_options': (snapshot_path, use_snapshot, incremental)
+        }
+        self.jobs[job_id] = job
+        self._trim_history()
+
+        if self._worker is None or self._worker.dead:
+            self._worker = eventlet.spawn(self._run)
+        self._queue.put(job_id)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def pending_job(self):
+        for job in self.jobs.values():
+            if job['status'] in ('queued', 'running'):
+                return job
+        return None
+
+    def public(self, job):
+        """Job dict without internal fields, for JSON responses"""
+        return {k: v for k, v in job.items() if not k.startswith('_')}
+
+    def _trim_history(self):
+        while len(self.jobs) > MAX_JOB_HISTORY:
+            oldest_id, oldest = next(iter(self.jobs.items()))
+            if oldest['status'] in ('queued', 'running'):
+                break
+            del self.jobs[oldest_id]
+
+    def _run(self):
+        while True:
+            job = self.jobs.get(self._queue.get())
+            if job is None:
+                continue
+
+            job['status'] = 'running'
+            job['started_at'] = datetime.now().isoformat()
+            try:
+                self._train(job)
+            except Exception as e:
+                log.exception("Training job %d failed", job['job_id'])
+                job['status'] = 'failed'
+                job['error'] = str(e)
+            job['finished_at'] = datetime.now().isoformat()
+
+    def _train(self, job):
+        snapshot_path, use_snapshot, incremental = job['_options']
+        incremental = incremental and self.recommender.can_train_incremental()
+        job['incremental'] = incremental
+
+        if incremental:
+            # Warm start mutates the model, so work on a copy of the serving one
+            candidate = self.recommender.clone()
+            after_ride_id = candidate.high_water_mark['ride_id']
+        else:
+            candidate = DriverRecommender(autoload=False)
+
+        with self.app.app_context():
+            try:
+                if incremental:
+                    rides = candidate.load_training_rides(self.db, after_ride_id=after_ride_id)
+                else:
+                    rides = candidate.load_training_extract(self.db, snapshot_path, use_snapshot)
+            finally:
+                self.db.session.remove()
+
+        # The fit holds the CPU for seconds; keep it off the hub
+        fit = candidate.update_from_rides if incremental else candidate.fit_from_rides
+        result = tpool.execute(fit, rides)
+        job['result'] = result
+
+        if not result['success']:
+            job['status'] = 'failed'
+            job['error'] = result['message']
+            return
+
+        ok, reason = self._validate(result)
+        if not ok:
+            job['status'] = 'rejected'
+            job['error'] = reason
+            log.warning("Training job %d not deployed: %s", job['job_id'], reason)
+            return
+
+        tpool.execute(candidate.save_model, MODEL_PATH)
+        self.recommender.adopt(candidate)
+        job['status'] = 'completed'
+        job['swapped_in'] = True
+        log.info("Training job %d deployed new model", job['job_id'])
+
+    def _validate(self, result):
+        # Cold start: any successful fit beats having no model at all
+        if self.recommender.model is None:
+            return True, None
+        # Incremental run that only folded driver stats; the trees are unchanged
+        if result.get('incremental') and not result.get('refitted'):
+            return True, None
+        if result['test_accuracy'] < self.min_accuracy:
+            return False, (f"test accuracy {result['test_accuracy']:.3f} below "
+                           f"minimum {self.min_accuracy:.3f}")
+        return True, None
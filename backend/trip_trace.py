@@ -0,0 +1,235 @@
+"""
+Compact per-ride location traces.
+
+While a ride is active every driver_location_update is appended to a
+per-ride Redis list (trace:<ride_id>): the position quantized to
+TRACE_COORD_SCALE (1e-5 deg, about a metre) and the time to whole seconds,
+as "lat,lon,t" integers. The list lives in Redis rather than on the worker,
+so a ride whose pings and completion reach different workers still has its
+whole trace. When the ride completes the list is read into a TraceBuffer
+(deltas from the previous ping in three integer arrays), encoded once into
+a blob and stored in public.ride_trace (sql/ride_trace.sql) with the
+completion transaction.
+
+Blob layout (TRACE_FORMAT_VERSION 1):
+
+    byte 0        format version
+    bytes 1..     zlib stream of unsigned LEB128 varints:
+                  point count, then the lat column, the lon column and the
+                  time column, each zigzag-encoded; the first value of a
+                  column is absolute, the rest are deltas
+
+Consecutive pings move a few hundred units at most, so most deltas take one
+or two bytes, and grouping the columns lets zlib fold the near-constant
+time deltas. decode_trace() turns a blob back into (lat, lon, unix_time)
+points.
+
+Redis access is best effort, like presence: a failed append loses that
+ping, and a failed read completes the ride without a trace.
+"""
+
+import os
+import time
+import zlib
+import logging
+import datetime
+from array import array
+from functools import wraps
+
+import redis
+
+from metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+TRACE_FORMAT_VERSION = 1
+TRACE_COORD_SCALE = 100_000
+# Longest trace kept per ride; about 14 hours at the fastest ping rate
+TRACE_MAX_POINTS = int(os.getenv("TRACE_MAX_POINTS", "25000"))
+# Traces of rides not heard from in this long expire (ride abandoned)
+TRACE_IDLE_SECONDS = int(os.getenv("TRACE_IDLE_SECONDS", "3600"))
+
+TRACE_POINTS_DROPPED = REGISTRY.counter(
+    "trip_trace_points_dropped_total", "Pings not recorded because the ride's trace was full")
+TRACE_MISSING = REGISTRY.counter(
+    "trip_trace_missing_total", "Rides completed without a recorded trace")
+TRACE_ERRORS = REGISTRY.counter(
+    "trip_trace_errors_total", "Trace reads and writes that failed", ("op",))
+
+
+class TraceDecodeError(ValueError):
+    pass
+
+
+# Varint helpers, also used by polyline.pack()
+
+def zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def write_varint(out, n):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varints(data):
+    value, shift = 0, 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value, shift = 0, 0
+    if shift:
+        raise ValueError("Truncated varint")
+
+
+class TraceBuffer:
+    """Delta-encoded (lat, lon, t) points for one ride"""
+    __slots__ = ("first", "last", "dlat", "dlon", "dt")
+
+    def __init__(self):
+        self.first = None        # quantized (lat, lon, t) of the first point
+        self.last = None
+        self.dlat = array("i")
+        self.dlon = array("i")
+        self.dt = array("i")
+
+    def __len__(self):
+        return 0 if self.first is None else len(self.dt) + 1
+
+    def append(self, lat, lon, t):
+        self.append_quantized((round(lat * TRACE_COORD_SCALE), round(lon * TRACE_COORD_SCALE), round(t)))
+
+    def append_quantized(self, point):
+        if self.first is None:
+            self.first = self.last = point
+            return
+        self.dlat.append(point[0] - self.last[0])
+        self.dlon.append(point[1] - self.last[1])
+        self.dt.append(point[2] - self.last[2])
+        self.last = point
+
+    @property
+    def started_at(self):
+        return None if self.first is None else self.first[2]
+
+    @property
+    def ended_at(self):
+        return None if self.last is None else self.last[2]
+
+    def encode(self):
+        """The trace as a compressed blob (see module docstring)"""
+        out = bytearray()
+        write_varint(out, len(self))
+        if self.first is not None:
+            for start, deltas in zip(self.first, (self.dlat, self.dlon, self.dt)):
+                write_varint(out, zigzag(start))
+                for delta in deltas:
+                    write_varint(out, zigzag(delta))
+        return bytes([TRACE_FORMAT_VERSION]) + zlib.compress(bytes(out), 9)
+
+    def to_row(self, ride_id):
+        """Row for db.complete_ride_transaction(trace=...)"""
+        def as_timestamp(t):
+            return datetime.datetime.fromtimestamp(t, datetime.timezone.utc).replace(tzinfo=None)
+        return {
+            "ride_id": ride_id,
+            "points": len(self),
+            "started_at": as_timestamp(self.started_at),
+            "ended_at": as_timestamp(self.ended_at),
+            "trace": self.encode(),
+        }
+
+
+def decode_trace(blob):
+    """[(lat, lon, unix_time), ...] from a blob made by TraceBuffer.encode()"""
+    if not blob:
+        raise TraceDecodeError("Empty trace")
+    if blob[0] != TRACE_FORMAT_VERSION:
+        raise TraceDecodeError(f"Unknown trace format {blob[0]}")
+    try:
+        values = list(read_varints(zlib.decompress(bytes(blob[1:]))))
+    except (zlib.error, ValueError) as e:
+        raise TraceDecodeError(str(e)) from e
+
+    count = values[0] if values else 0
+    if len(values) != 1 + 3 * count:
+        raise TraceDecodeError(f"Expected {count} points, got {len(values) - 1} values")
+
+    columns = []
+    for c in range(3):
+        total, column = 0, []
+        for value in values[1 + c * count:1 + (c + 1) * count]:
+            total += unzigzag(value)
+            column.append(total)
+        columns.append(column)
+    return [(lat / TRACE_COORD_SCALE, lon / TRACE_COORD_SCALE, t) for lat, lon, t in zip(*columns)]
+
+
+def _best_effort(fn):
+    @wraps(fn)
+    def wrapper(self, ride_id, *args, **kwargs):
+        try:
+            return fn(self, ride_id, *args, **kwargs)
+        except redis.exceptions.RedisError as e:
+            TRACE_ERRORS.inc(fn.__name__)
+            log.warning("Trip trace %s failed: %s", fn.__name__, e,
+                        extra={"ride_id": ride_id, "sample_rate": 0.01})
+            return None
+    return wrapper
+
+
+class TripTraceRecorder:
+    """Per-ride ping lists in Redis; get() turns one into a TraceBuffer"""
+
+    def __init__(self, redis_client, max_points=TRACE_MAX_POINTS, idle_seconds=TRACE_IDLE_SECONDS):
+        self.redis = redis_client
+        self.max_points = max_points
+        self.idle_seconds = idle_seconds
+
+    @_best_effort
+    def append(self, ride_id, lat, lon, now=None):
+        now = now or time.time()
+        key = self._key(ride_id)
+        point = f"{round(lat * TRACE_COORD_SCALE)},{round(lon * TRACE_COORD_SCALE)},{round(now)}"
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.rpush(key, point)
+        # Keeps the first max_points pings; every ping pushes the expiry back
+        pipe.ltrim(key, 0, self.max_points - 1)
+        pipe.expire(key, self.idle_seconds)
+        length = pipe.execute()[0]
+        if length > self.max_points:
+            TRACE_POINTS_DROPPED.inc()
+
+    @_best_effort
+    def get(self, ride_id):
+        """The ride's TraceBuffer, or None if no ping was recorded or Redis failed"""
+        points = self.redis.lrange(self._key(ride_id), 0, -1)
+        if not points:
+            return None
+        buffer = TraceBuffer()
+        for point in points:
+            lat, lon, t = point.split(",")
+            buffer.append_quantized((int(lat), int(lon), int(t)))
+        return buffer
+
+    @_best_effort
+    def forget(self, ride_id):
+        self.redis.delete(self._key(ride_id))
+
+    def missing(self, ride_id):
+        """Note a ride completed without a trace"""
+        TRACE_MISSING.inc()
+        log.warning("Ride completed without a location trace", extra={"ride_id": ride_id})
+
+    @staticmethod
+    def _key(ride_id):
+        return f"trace:{ride_id}"
@@ -0,0 +1,148 @@
+"""
+Background weather refresh for the service area.
+
+WEATHER_BBOX ("min_lat,min_lon,max_lat,max_lon") is split into the same
+WEATHER_AREA_DEG cells WeatherService caches by. Every
+WEATHER_PREFETCH_INTERVAL seconds a greenlet refreshes the cells that are
+due and stores a ready-made safety verdict for each, so
+check_weather_safety inside the box is a dict lookup and riders never wait
+on WeatherAPI.
+
+The calls per cycle are capped by WEATHER_API_QUOTA_PER_HOUR, less whatever
+live lookups (outside the box, or for expired verdicts) used since the last
+cycle. When the budget doesn't cover every due cell, the cells with the
+most recent lookups go first, then the oldest verdicts, so quiet cells are
+refreshed less often rather than not at all.
+"""
+
+import os
+import time
+import logging
+
+import eventlet
+
+from metrics import REGISTRY
+from circuit_breaker import CircuitOpenError
+from WeatherService import WEATHER_AREA_DEG
+
+log = logging.getLogger(__name__)
+
+# "min_lat,min_lon,max_lat,max_lon"; empty disables prefetching
+WEATHER_BBOX = os.getenv("WEATHER_BBOX", "")
+WEATHER_PREFETCH_INTERVAL = float(os.getenv("WEATHER_PREFETCH_INTERVAL", "300"))
+WEATHER_API_QUOTA_PER_HOUR = int(os.getenv("WEATHER_API_QUOTA_PER_HOUR", "1000"))
+WEATHER_PREFETCH_CONCURRENCY = int(os.getenv("WEATHER_PREFETCH_CONCURRENCY", "4"))
+# Demand counts are multiplied by this every cycle, so priority follows recent lookups
+DEMAND_DECAY = 0.5
+
+PREFETCH_CELLS = REGISTRY.gauge("weather_prefetch_cells", "Service-area cells with a precomputed verdict")
+PREFETCH_REFRESHES = REGISTRY.counter(
+    "weather_prefetch_refreshes_total", "Background weather refreshes", ("result",))
+
+
+def parse_bbox(value):
+    if not value:
+        return None
+    min_lat, min_lon, max_lat, max_lon = (float(v) for v in value.split(","))
+    if min_lat > max_lat or min_lon > max_lon:
+        raise ValueError(f"WEATHER_BBOX corners are swapped: {value!r}")
+    return min_lat, min_lon, max_lat, max_lon
+
+
+class WeatherPrefetcher:
+    def __init__(self, weather_service, bbox=WEATHER_BBOX, interval=WEATHER_PREFETCH_INTERVAL,
+                 quota_per_hour=WEATHER_API_QUOTA_PER_HOUR):
+        self.weather_service = weather_service
+        self.bbox = parse_bbox(bbox) if isinstance(bbox, str) else bbox
+        self.interval = interval
+        self.quota_per_hour = quota_per_hour
+        self.cells = self._grid() if self.bbox else []
+        self._calls_seen = weather_service.api_calls
+        self._worker = None
+
+        weather_service.prefetch_areas = set(self.cells)
+        PREFETCH_CELLS.set_function(lambda: len(self.weather_service.verdicts))
+
+    def _grid(self):
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        rows = int(round((max_lat - min_lat) / WEATHER_AREA_DEG)) + 1
+        cols = int(round((max_lon - min_lon) / WEATHER_AREA_DEG)) + 1
+        cells = {
+            self.weather_service.area_key(min_lat + i * WEATHER_AREA_DEG, min_lon + j * WEATHER_AREA_DEG)
+            for i in range(rows) for j in range(cols)
+        }
+        return sorted(cells)
+
+    # ---------- scheduling ----------
+
+    def start(self):
+        if not self.cells:
+            return
+        if self._worker is None or self._worker.dead:
+            log.info("Prefetching weather for %d cells every %ss", len(self.cells), self.interval)
+            self._worker = eventlet.spawn(self._run)
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh_once()
+            except Exception:
+                log.exception("Weather prefetch failed")
+            eventlet.sleep(self.interval)
+
+    def budget(self):
+        """Calls this cycle may make, after live lookups since the last one"""
+        per_cycle = int(self.quota_per_hour * self.interval / 3600)
+        live_calls = self.weather_service.api_calls - self._calls_seen
+        return max(0, per_cycle - live_calls)
+
+    def due_cells(self, now=None):
+        """Cells needing a refresh, most looked-up first, then oldest first"""
+        now = now or time.time()
+        verdicts = self.weather_service.verdicts
+        demand = self.weather_service.demand
+
+        ages = {}
+        for key in self.cells:
+            verdict = verdicts.get(key)
+            age = now - verdict[3] if verdict else float("inf")
+            # A little slack so cells refreshed last cycle are due again this one
+            if age >= self.interval * 0.9:
+                ages[key] = age
+        return sorted(ages, key=lambda key: (-demand.get(key, 0), -ages[key]))
+
+    def refresh_once(self, now=None):
+        cells = self.due_cells(now)[:self.budget()]
+        refreshed = failed = 0
+        pool = eventlet.GreenPool(WEATHER_PREFETCH_CONCURRENCY)
+        for ok in pool.imap(self._refresh, cells):
+            if ok:
+                refreshed += 1
+            else:
+                failed += 1
+
+        self._calls_seen = self.weather_service.api_calls
+        demand = self.weather_service.demand
+        for key in list(demand):
+            demand[key] *= DEMAND_DECAY
+            if demand[key] < 0.1:
+                del demand[key]
+
+        if failed:
+            log.warning("Weather prefetch refreshed %d cells, %d failed", refreshed, failed)
+        else:
+            log.debug("Weather prefetch refreshed %d cells", refreshed)
+        return refreshed
+
+    def _refresh(self, key):
+        try:
+            self.weather_service.refresh_area(key)
+        except CircuitOpenError:
+            PREFETCH_REFRESHES.inc("rejected")
+            return False
+        except Exception as e:
+            log.debug("Weather prefetch for %s failed: %s", key, e)
+            PREFETCH_REFRESHES.inc("error")
+            return False
+        PREFETCH_REFRESHES.inc("ok")
+        return True
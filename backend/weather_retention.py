@@ -0,0 +1,56 @@
+"""
+Periodic upkeep of the partitioned weather table.
+
+Every WEATHER_MAINTENANCE_INTERVAL seconds a greenlet calls
+public.weather_maintenance() (sql/weather_partitioning.sql), which creates
+the next WEATHER_PARTITIONS_AHEAD monthly partitions, rolls the last few
+hours of raw checks into weather_hourly and, after rolling them up, drops
+months older than WEATHER_KEEP_MONTHS. Every worker schedules it; the
+function takes an advisory lock, so while one run is in progress the
+others return {"skipped": true} instead of racing its partition DDL. Set
+WEATHER_MAINTENANCE_INTERVAL=0 when pg_cron runs it instead.
+"""
+
+import os
+import logging
+
+import eventlet
+
+from WeatherService import WEATHER_AREA_DEG
+
+log = logging.getLogger(__name__)
+
+WEATHER_MAINTENANCE_INTERVAL = float(os.getenv("WEATHER_MAINTENANCE_INTERVAL", "3600"))
+WEATHER_KEEP_MONTHS = int(os.getenv("WEATHER_KEEP_MONTHS", "3"))
+WEATHER_PARTITIONS_AHEAD = int(os.getenv("WEATHER_PARTITIONS_AHEAD", "2"))
+
+
+class WeatherMaintenance:
+    def __init__(self, run_maintenance, interval=WEATHER_MAINTENANCE_INTERVAL,
+                 keep_months=WEATHER_KEEP_MONTHS, months_ahead=WEATHER_PARTITIONS_AHEAD):
+        """run_maintenance(keep_months, months_ahead, cell_deg) -> summary dict"""
+        self.run_maintenance = run_maintenance
+        self.interval = interval
+        self.keep_months = keep_months
+        self.months_ahead = months_ahead
+        self.last_summary = None
+        self._worker = None
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        if self._worker is None or self._worker.dead:
+            self._worker = eventlet.spawn(self._run)
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("Weather maintenance failed")
+            eventlet.sleep(self.interval)
+
+    def run_once(self):
+        self.last_summary = self.run_maintenance(self.keep_months, self.months_ahead, WEATHER_AREA_DEG)
+        log.info("Weather maintenance: %s", self.last_summary)
+        return self.last_summary
@@ -0,0 +1,169 @@
+"""
+Write-behind persistence for weather checks.
+
+/accept_ride and /request_driver used to add a Weather row and commit
+before answering the driver. They now hand the record to WeatherWriter,
+which appends it to an in-memory queue and returns. A greenlet flushes the
+queue with multi-row INSERTs every WEATHER_WRITE_INTERVAL seconds, or as
+soon as WEATHER_WRITE_BATCH records are waiting.
+
+The queue holds at most WEATHER_WRITE_QUEUE_MAX records. Past that, new
+records are dropped and counted rather than growing memory while the
+database is unavailable. A failed flush puts its rows back at the front of
+the queue for the next attempt, and inserts skip rows that already exist,
+so a retry can't duplicate them.
+
+What failed decides what happens next. When the database rejected a row
+(IntegrityError, DataError: a ride deleted since the check, a value out of
+range) the batch is inserted in halves, then halves of the failing halves,
+down to single rows; the rows rejected on their own are dropped so a bad
+record can't block the queue. Any other error (OperationalError,
+DisconnectionError, a pool timeout) means the database can't be reached,
+and whatever hasn't been written goes back to the queue. close() (registered with atexit) flushes whatever is left on a graceful
+shutdown.
+"""
+
+import os
+import atexit
+import logging
+import datetime
+import threading
+from collections import deque
+
+import eventlet
+from sqlalchemy.exc import IntegrityError, DataError
+
+from metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+WEATHER_WRITE_INTERVAL = float(os.getenv("WEATHER_WRITE_INTERVAL", "2"))
+WEATHER_WRITE_BATCH = int(os.getenv("WEATHER_WRITE_BATCH", "500"))
+WEATHER_WRITE_QUEUE_MAX = int(os.getenv("WEATHER_WRITE_QUEUE_MAX", "10000"))
+# Errors caused by a row rather than by the database being unavailable
+BAD_ROW_ERRORS = (IntegrityError, DataError)
+
+WEATHER_QUEUE_DEPTH = REGISTRY.gauge("weather_write_queue_depth", "Weather checks waiting to be written")
+WEATHER_WRITES = REGISTRY.counter(
+    "weather_writes_total", "Weather check records by outcome", ("result",))
+WEATHER_FLUSH_ROWS = REGISTRY.histogram(
+    "weather_write_flush_rows", "Records per weather flush", buckets=(1, 10, 50, 100, 500, 1000, 5000))
+
+
+class WeatherWriter:
+    def __init__(self, insert_rows, interval=WEATHER_WRITE_INTERVAL, batch_size=WEATHER_WRITE_BATCH,
+                 max_queue=WEATHER_WRITE_QUEUE_MAX):
+        """insert_rows(list_of_dicts) writes one batch, raising on failure"""
+        self.insert_rows = insert_rows
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+
+        self._queue = deque()
+        self._wake = threading.Event()
+        self._worker = None
+        self._closed = False
+        WEATHER_QUEUE_DEPTH.set_function(lambda: len(self._queue))
+
+    def submit(self, ride_id, weather_details, is_safe):
+        """Queue one weather check; returns False if it was dropped"""
+        if len(self._queue) >= self.max_queue:
+            WEATHER_WRITES.inc("dropped")
+            log.warning("Weather write queue full, dropping check", extra={"ride_id": ride_id, "sample_rate": 0.01})
+            return False
+
+        self._queue.append({
+            "ride_id": ride_id,
+            # Stamped now, not at flush time, and in UTC like current_timestamp
+            "checked_at": datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None),
+            "temperature": weather_details.get("temperature"),
+            "wind_speed": weather_details.get("wind_speed_ms"),
+            "visibility": weather_details.get("visibility_m"),
+            "humidity": weather_details.get("humidity"),
+            "weather_code": weather_details.get("weather_code"),
+            "condition": weather_details.get("condition"),
+            "is_safe": is_safe
+        })
+        if len(self._queue) >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def start(self):
+        if self._worker is None or self._worker.dead:
+            self._worker = eventlet.spawn(self._run)
+            atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self.flush():
+                # Database trouble: back off a full interval before retrying
+                eventlet.sleep(self.interval)
+
+    def flush(self):
+        """Write everything queued so far; returns False if a batch failed"""
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                self.insert_rows(batch)
+            except BAD_ROW_ERRORS as e:
+                log.warning("Weather flush of %d records hit a bad row, writing around it: %s", len(batch), e)
+                unwritten = self._write_around_bad_rows(batch)
+                if unwritten:
+                    self._requeue(unwritten)
+                    return False
+            except Exception:
+                log.exception("Weather flush of %d records failed", len(batch))
+                self._requeue(batch)
+                return False
+            else:
+                WEATHER_WRITES.inc("written", amount=len(batch))
+                WEATHER_FLUSH_ROWS.observe(len(batch))
+        return True
+
+    def _requeue(self, batch):
+        WEATHER_WRITES.inc("retried", amount=len(batch))
+        # Back to the front, keeping order; the newest overflow is dropped
+        room = max(0, self.max_queue - len(self._queue))
+        if room < len(batch):
+            WEATHER_WRITES.inc("dropped", amount=len(batch) - room)
+        self._queue.extendleft(reversed(batch[:room]))
+
+    def _write_around_bad_rows(self, batch):
+        """
+        Insert a batch the database rejected in halves, then halves of the
+        rejected halves, down to single rows, which are dropped. Returns the
+        rows left unwritten if the database itself fails part-way.
+        """
+        parts = deque([batch])
+        while parts:
+            part = parts.popleft()
+            if len(part) == 1:
+                WEATHER_WRITES.inc("dropped")
+                log.error("Dropping weather check the database rejects", extra={"ride_id": part[0]["ride_id"]})
+                continue
+
+            middle = len(part) // 2
+            for half, rest in ((part[:middle], part[middle:]), (part[middle:], [])):
+                try:
+                    self.insert_rows(half)
+                except BAD_ROW_ERRORS:
+                    parts.append(half)
+                except Exception:
+                    log.exception("Weather flush failed while writing around a bad row")
+                    unwritten = half + rest + [row for left in parts for row in left]
+                    return sorted(unwritten, key=lambda row: row["checked_at"])
+                else:
+                    WEATHER_WRITES.inc("written", amount=len(half))
+                    WEATHER_FLUSH_ROWS.observe(len(half))
+        return []
+
+    def close(self):
+        """Stop the flusher and write what is left; safe to call more than once"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        if self._queue and not self.flush():
+            log.error("Lost %d weather checks at shutdown", len(self._queue))